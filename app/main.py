@@ -1,14 +1,29 @@
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
+import asyncio
 import logging
-from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 import json
+import hmac
 
 from config.settings import settings
 from services.telegram_service import TelegramService
 from services.user_service import UserService
+from services.http_client import http_pool
+from services.prediction_registry import prediction_registry, verify_webhook_signature
+from services.provider_router import provider_router
+from services.usage_events import usage_log
+from services.metrics import metrics
+from services.instrumentation import InstrumentedHTTPXRequest, PROMETHEUS_CONTENT_TYPE
+from services.update_ingestion import UpdateIngestor, parse_json
+from services.payment_service import PaymentService
+from services.stripe_events import StripeEventProcessor
+from services.send_scheduler import SendScheduler
+from services.broadcast import BroadcastEngine
+from services.lazy_imports import warm_up, configured_sdks
+from services.moderation import prompt_moderator
 
 # Configure logging
 logging.basicConfig(
@@ -34,11 +49,24 @@ app.add_middleware(
 )
 
 # Initialize services
-telegram_service = TelegramService()
 user_service = UserService()
+telegram_service = TelegramService(user_service=user_service)
+payment_service = PaymentService()
+stripe_events = StripeEventProcessor(user_service)
+broadcasts = BroadcastEngine(user_service)
 
 # Initialize Telegram bot application
-telegram_app = Application.builder().token(settings.telegram_bot_token).build()
+telegram_app = (
+    Application.builder()
+    .token(settings.telegram_bot_token)
+    .request(InstrumentedHTTPXRequest(connection_pool_size=256))
+    .rate_limiter(SendScheduler())
+    .build()
+)
+update_ingestor = UpdateIngestor(telegram_app, user_service.state)
+
+# Pre-encoded webhook ACK, the hot path skips response serialization
+WEBHOOK_OK = b'{"status":"ok"}'
 
 @app.on_event("startup")
 async def startup_event():
@@ -53,9 +81,24 @@ async def startup_event():
     telegram_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, telegram_service.handle_message))
     telegram_app.add_handler(MessageHandler(filters.PHOTO, telegram_service.handle_photo))
     
+    # Open shared HTTP client pool, user store and usage event log
+    await http_pool.start()
+    await user_service.start()
+    prediction_registry.attach(user_service.state, receives_webhooks=True)
+    if settings.replicate_webhook_url and not prediction_registry.available:
+        logger.warning("Replicate webhooks need SHARED_STATE_BACKEND=sqlite or redis with more than one web worker, polling instead")
+    await usage_log.start()
+    
     # Initialize telegram app
     await telegram_app.initialize()
     await telegram_app.start()
+    await update_ingestor.start()
+    await stripe_events.start(telegram_app.bot)
+    await broadcasts.start(telegram_app.bot)
+    
+    # Provider SDKs load in a thread while the webhook is already being served
+    if settings.sdk_warmup:
+        app.state.sdk_warmup = asyncio.create_task(warm_up(configured_sdks()))
     
     logger.info("Bot started successfully!")
 
@@ -63,8 +106,17 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup on shutdown"""
     logger.info("Shutting down Telegram AI Bot...")
+    await update_ingestor.close()
+    await stripe_events.close()
+    await broadcasts.close()
+    await telegram_service.ai_service.close()
+    await prompt_moderator.close()
     await telegram_app.stop()
     await telegram_app.shutdown()
+    await usage_log.close()
+    await user_service.close()
+    await http_pool.close()
+    payment_service.close()
 
 @app.get("/")
 async def root():
@@ -73,23 +125,107 @@ async def root():
 
 @app.post("/webhook")
 async def webhook(request: Request):
-    """Webhook endpoint for Telegram updates"""
+    """Webhook endpoint for Telegram updates, ACKed before the update is processed"""
+    if settings.telegram_webhook_secret and not hmac.compare_digest(
+        request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), settings.telegram_webhook_secret
+    ):
+        raise HTTPException(status_code=401, detail="Invalid secret token")
+    
+    try:
+        update_dict = parse_json(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid payload")
+    
+    if not isinstance(update_dict, dict):
+        raise HTTPException(status_code=400, detail="Invalid payload")
+    
+    # Queue full: a non-2xx answer makes Telegram redeliver later
+    if not update_ingestor.submit(update_dict):
+        raise HTTPException(status_code=503, detail="Busy")
+    
+    return Response(content=WEBHOOK_OK, media_type="application/json")
+
+@app.post("/replicate/webhook")
+async def replicate_webhook(request: Request):
+    """Webhook endpoint for Replicate prediction completion"""
+    body = await request.body()
+    
+    # Fail closed: without a secret nothing can be verified, so no callback is trusted
+    if not settings.replicate_webhook_secret:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not verify_webhook_signature(settings.replicate_webhook_secret, request.headers, body):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+    
     try:
-        # Get the raw body
-        body = await request.body()
-        
-        # Parse the update
-        update_dict = json.loads(body.decode('utf-8'))
-        update = Update.de_json(update_dict, telegram_app.bot)
-        
-        # Process the update
-        await telegram_app.process_update(update)
-        
-        return {"status": "ok"}
+        prediction = json.loads(body.decode('utf-8'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid payload")
+    
+    resolved = await prediction_registry.publish(prediction)
+    logger.info(f"Replicate webhook for prediction {prediction.get('id')} ({prediction.get('status')}), waiter found: {resolved}")
+    
+    return {"status": "ok"}
+
+@app.post("/stripe/webhook")
+async def stripe_webhook(request: Request):
+    """Webhook endpoint for Stripe events, side effects are applied after the response"""
+    body = await request.body()
+    
+    result = await payment_service.handle_webhook(body, request.headers.get("Stripe-Signature", ""))
+    if not result["success"]:
+        raise HTTPException(status_code=400, detail=result["error"])
     
-    except Exception as e:
-        logger.error(f"Error processing webhook: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+    # Recorded in the ledger before answering, so a crash can't lose an acknowledged event
+    new = await stripe_events.submit(result)
+    return {"received": True, "duplicate": not new}
+
+def require_admin(request: Request) -> None:
+    """Admin endpoints are disabled unless ADMIN_API_TOKEN is set and sent as X-Admin-Token"""
+    if not settings.admin_api_token:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), settings.admin_api_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.get("/admin/providers")
+async def provider_status(request: Request):
+    """Circuit breaker state and health EWMAs per provider endpoint"""
+    require_admin(request)
+    return {"breakers": provider_router.stats()}
+
+@app.post("/admin/broadcasts")
+async def create_broadcast(request: Request):
+    """Send {"text": ..., "parse_mode": ...} to every user who hasn't blocked the bot"""
+    require_admin(request)
+    body = await request.json()
+    if not body.get("text"):
+        raise HTTPException(status_code=400, detail="text is required")
+    return await broadcasts.create(body["text"], body.get("parse_mode"))
+
+@app.get("/admin/broadcasts/{broadcast_id}")
+async def broadcast_status(broadcast_id: str, request: Request):
+    """Counters, checkpoint, throughput and ETA of a broadcast"""
+    require_admin(request)
+    broadcast = await broadcasts.status(broadcast_id)
+    if not broadcast:
+        raise HTTPException(status_code=404, detail="Unknown broadcast")
+    return broadcast
+
+@app.post("/admin/broadcasts/{broadcast_id}/{action}")
+async def control_broadcast(broadcast_id: str, action: str, request: Request):
+    """pause, resume or cancel a broadcast"""
+    require_admin(request)
+    if action not in ("pause", "resume", "cancel"):
+        raise HTTPException(status_code=404, detail="Not found")
+    if not await getattr(broadcasts, action)(broadcast_id):
+        raise HTTPException(status_code=409, detail=f"Broadcast can't {action} from its current status")
+    return await broadcasts.status(broadcast_id)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Counters and latency histograms in the Prometheus text format"""
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Not found")
+    return PlainTextResponse(metrics.render_prometheus(), media_type=PROMETHEUS_CONTENT_TYPE)
 
 @app.get("/health")
 async def health_check():
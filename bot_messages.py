@@ -333,6 +333,38 @@ Please provide a valid description.
 • `/image a cute cat`
 • `/video bird flying`
 • `/music relaxing music`
+        """,
+        "prompt_too_long": """
+❌ **Prompt too long**
+
+Please shorten your description and try again.
+        """,
+        "prompt_language": """
+❌ **Language not supported**
+
+Please describe what you want in English or Portuguese.
+        """,
+        "prompt_rejected": """
+🚫 **Prompt not allowed**
+
+This description goes against our content policy.
+
+**💳 It was not counted against your plan limits**
+        """,
+        "queue_full": """
+⏳ **We're very busy right now**
+
+Too many generations are in progress.
+
+**🔄 Try again in a minute**
+        """,
+        "job_failed": """
+❌ **Generation failed**
+
+We couldn't finish your request.
+
+**💳 It was not counted against your plan limits**
+**🔄 Try again**
         """,
         "general": """
 ❌ **Something went wrong**
@@ -357,6 +389,24 @@ def get_generating_message(content_type: str) -> str:
     
     return messages.get(content_type, "⏳ **Processing...**")
 
+def get_queue_message(content_type: str, position: int) -> str:
+    """Queue position message while waiting for a generation slot"""
+    return f"""
+⏳ **You're #{position} in the {content_type} queue**
+
+Your request will start as soon as a slot is free.
+⬆️ Higher plans get priority, see `/upgrade`
+    """
+
+def get_job_queued_message(content_type: str) -> str:
+    """Message shown when a long generation is accepted as a background job"""
+    return f"""
+📥 **Your {content_type} request is queued**
+
+It runs in the background, you can keep using the bot.
+We'll send the result to this chat as soon as it's ready.
+    """
+
 def get_content_ready_message(content_type: str, prompt: str, cost: float, model: str) -> str:
     """Content ready messages"""
     type_emojis = {
@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import logging
+import sys
+from telegram.ext import ExtBot
+from config.settings import settings
+from services.user_service import UserService
+from services.broadcast import BroadcastEngine
+from services.send_scheduler import SendScheduler
+from services.instrumentation import InstrumentedHTTPXRequest
+
+logging.basicConfig(
+    format=r'%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+async def run(args) -> int:
+    user_service = UserService()
+    engine = BroadcastEngine(user_service)
+
+    if args.status or args.pause or args.cancel:
+        try:
+            if args.pause or args.cancel:
+                # Whichever process is sending it stops at its next checkpoint
+                broadcast_id = args.pause or args.cancel
+                if not await (engine.pause(broadcast_id) if args.pause else engine.cancel(broadcast_id)):
+                    logger.error(f"Broadcast {broadcast_id} is unknown or not in a state that allows this")
+                    return 1
+            for broadcast in await engine.store.list():
+                done = broadcast["sent"] + broadcast["blocked"] + broadcast["failed"]
+                print(f"{broadcast['id']}  {broadcast['status']:<9}  {done}/{broadcast['total']}  sent={broadcast['sent']} blocked={broadcast['blocked']} failed={broadcast['failed']}")
+        finally:
+            await engine.store.close()
+        return 0
+
+    bot = ExtBot(
+        settings.telegram_bot_token,
+        request=InstrumentedHTTPXRequest(connection_pool_size=256),
+        rate_limiter=SendScheduler()
+    )
+    await user_service.start()
+    try:
+        async with bot:
+            # Broadcasts interrupted elsewhere are only picked up with --resume
+            await engine.start(bot, resume=False)
+            if args.resume:
+                if not await engine.resume(args.resume):
+                    logger.error(f"Broadcast {args.resume} is unknown, completed or cancelled")
+                    return 1
+                broadcast_id = args.resume
+            else:
+                with open(args.text_file) as handle:
+                    text = handle.read().strip()
+                broadcast_id = (await engine.create(text, args.parse_mode))["id"]
+                logger.info(f"Started broadcast {broadcast_id}, interrupt and run with --resume {broadcast_id} to continue")
+            await engine.wait(broadcast_id)
+    finally:
+        await engine.close()
+        await user_service.close()
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Send an announcement to every user who hasn't blocked the bot")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--text-file", help="Message to broadcast")
+    action.add_argument("--resume", metavar="ID", help="Continue a paused or interrupted broadcast from its checkpoint")
+    action.add_argument("--pause", metavar="ID", help="Stop a running broadcast at its next checkpoint")
+    action.add_argument("--cancel", metavar="ID", help="Stop a broadcast for good")
+    action.add_argument("--status", action="store_true", help="List broadcasts and their progress")
+    parser.add_argument("--parse-mode", choices=["Markdown", "MarkdownV2", "HTML"], help="Telegram parse mode of the message")
+    args = parser.parse_args()
+
+    if not settings.telegram_bot_token:
+        parser.error("TELEGRAM_BOT_TOKEN is not set")
+    try:
+        return asyncio.run(run(args))
+    except KeyboardInterrupt:
+        # Interrupted mid-send: the checkpoint is saved and the broadcast resumes on the next run
+        return 130
+
+if __name__ == "__main__":
+    sys.exit(main())
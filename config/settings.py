@@ -14,20 +14,183 @@ class Settings(BaseSettings):
     replicate_api_token: Optional[str] = None
     fal_api_key: Optional[str] = None
     
+    # Replicate Prediction Completion
+    replicate_webhook_url: Optional[str] = None
+    replicate_webhook_secret: Optional[str] = None
+    replicate_poll_initial_interval: float = 1.0
+    replicate_poll_backoff: float = 1.5
+    replicate_poll_max_interval: float = 15.0
+    replicate_webhook_fallback_interval: float = 15.0
+    replicate_webhook_shared_interval: float = 0.5  # How often waiters check the shared store for a webhook another process received
+    replicate_webhook_result_ttl: float = 3600.0
+    
     # Database Configuration
     supabase_url: Optional[str] = None
     supabase_key: Optional[str] = None
+    user_store_backend: str = "sqlite"  # sqlite or supabase
+    sqlite_db_path: str = "data/bot.db"
+    user_store_flush_interval: float = 5.0
+    user_store_flush_batch_size: int = 100
     
     # Payment Configuration
     stripe_publishable_key: Optional[str] = None
     stripe_secret_key: Optional[str] = None
     stripe_webhook_secret: Optional[str] = None
+    stripe_max_workers: int = 8
     
     # Application Configuration
     debug: bool = True
     host: str = "0.0.0.0"
     port: int = 8000
+
+    # Chat Streaming Configuration
+    chat_streaming_enabled: bool = True
+    stream_first_chunk_chars: int = 30
+    stream_edit_interval: float = 1.0  # Telegram tolerates about one edit per second per chat
+    
+    # Conversation Memory Configuration
+    conversation_max_turns: int = 20
+    conversation_context_tokens: int = 2000
+    conversation_max_users_in_memory: int = 5000
+    conversation_spill_dir: Optional[str] = None  # e.g. data/conversations
+    conversation_summarize: bool = False
+    conversation_summary_model: str = "gpt-4o-mini"
+    conversation_summary_batch: bool = False  # Summaries through the OpenAI Batch API: half price, minutes to hours later
+    conversation_summary_trigger_tokens: int = 1000
+    
+    # Generation Result Cache Configuration
+    generation_cache_enabled: bool = True
+    generation_cache_max_entries: int = 2000
+    generation_cache_ttl: float = 86400.0  # Provider URLs expire, keep entries for a day
+    generation_cache_db_path: Optional[str] = None  # e.g. data/generation_cache.db
+    generation_cache_hits_count_quota: bool = True
+    
+    # Telegram Media Registry Configuration
+    media_registry_max_entries: int = 10000
+    media_registry_db_path: Optional[str] = None  # e.g. data/media.db
+    
+    # Generation Job Scheduling
+    max_concurrent_jobs: int = 20
+    fal_max_concurrent_jobs: int = 10
+    replicate_max_concurrent_jobs: int = 5
+    job_queue_max_size: int = 200
+    job_priority_aging_seconds: float = 30.0
+    
+    # Hedged Image Requests
+    image_hedging_enabled: bool = True
+    image_hedge_percentile: float = 0.95
+    image_hedge_default_delay: float = 15.0
+    image_hedge_min_delay: float = 2.0
+    image_hedge_max_delay: float = 45.0
+    image_hedge_min_samples: int = 20
+    image_hedge_window: int = 500
+    image_hedge_max_rate: float = 0.1
+    
+    # Provider Circuit Breakers
+    breaker_failure_threshold: int = 5
+    breaker_min_success_rate: float = 0.5
+    breaker_degraded_success_rate: float = 0.8
+    breaker_degraded_latency: float = 30.0
+    breaker_ewma_alpha: float = 0.2
+    breaker_open_seconds: float = 30.0
+    breaker_half_open_probes: int = 1
+    admin_api_token: Optional[str] = None
+    
+    # Background Jobs (/video and /music)
+    jobs_db_path: str = "data/jobs.db"
+    background_job_workers: int = 8
+    background_job_max_attempts: int = 3
+    background_job_retry_delay: float = 5.0
+    background_job_lease_seconds: float = 900.0
+    
+    # Shared State (quota counters, plans and job leases across worker processes)
+    shared_state_backend: str = "memory"  # memory, sqlite or redis
+    shared_state_db_path: str = "data/state.db"
+    web_concurrency: int = 1  # uvicorn --workers, WEB_CONCURRENCY in the Procfile
+    redis_url: Optional[str] = None
+    
+    # Usage Periods
+    usage_bucket_retention_days: int = 7
+    usage_compaction_interval: float = 3600.0
     
+    # Usage Event Log
+    usage_events_db_path: str = "data/usage_events.db"
+    usage_export_dir: str = "data/usage"
+    usage_events_flush_interval: float = 5.0
+    usage_events_batch_size: int = 500
+    usage_rollup_interval: float = 3600.0
+    
+    # Stripe Webhook Events
+    stripe_events_db_path: str = "data/stripe_events.db"
+    stripe_event_workers: int = 2
+    stripe_event_max_attempts: int = 5
+    stripe_event_retry_delay: float = 30.0
+    stripe_event_lease_seconds: float = 300.0
+    
+    # Telegram Webhook Ingestion
+    telegram_webhook_secret: Optional[str] = None  # Checked against X-Telegram-Bot-Api-Secret-Token
+    webhook_workers: int = 32
+    webhook_queue_size: int = 10000
+    webhook_dedup_window: int = 10000  # update_ids remembered in-process
+    webhook_dedup_ttl: float = 21600.0  # Seconds a processed update_id is remembered across workers
+    webhook_drain_timeout: float = 10.0
+    
+    # Outbound Telegram Rate Limits
+    telegram_global_rate: float = 30.0  # Messages per second across all chats
+    telegram_global_burst: float = 30.0
+    telegram_chat_rate: float = 1.0  # Messages per second in one private chat
+    telegram_chat_burst: float = 3.0
+    telegram_group_rate: float = 20 / 60  # Groups and channels allow ~20 messages a minute
+    telegram_group_burst: float = 3.0
+    telegram_max_retries: int = 3  # Retries after a 429 before the error reaches the caller
+    
+    # Broadcasts
+    broadcast_db_path: str = "data/broadcasts.db"
+    broadcast_rate: float = 25.0  # Messages per second, below telegram_global_rate so replies keep flowing
+    broadcast_workers: int = 16
+    broadcast_page_size: int = 1000
+    broadcast_checkpoint_interval: float = 5.0
+    broadcast_lease_seconds: float = 60.0
+    
+    # Providers (shared retry/timeout policy and micro-batching)
+    provider_max_retries: int = 2
+    provider_timeout: float = 60.0
+    provider_retry_backoff: float = 0.5
+    provider_retry_max_delay: float = 8.0
+    provider_batch_window: float = 0.05  # Seconds requests for a batch endpoint are collected
+    provider_batch_max_size: int = 32
+    openai_moderation_model: str = "omni-moderation-latest"
+    openai_batch_window: float = 60.0
+    openai_batch_poll_interval: float = 30.0
+    
+    # Prompt Moderation (checked before quota is reserved or a provider is called)
+    moderation_enabled: bool = True
+    moderation_min_prompt_length: int = 3
+    moderation_max_prompt_length: int = 1000
+    moderation_blocklist_path: Optional[str] = None  # Extra blocked terms, one per line
+    moderation_allowed_scripts: str = ""  # Comma-separated, e.g. "latin"; empty allows every script
+    moderation_remote: bool = True  # OpenAI moderation when OPENAI_API_KEY is set
+    moderation_fail_open: bool = True  # Let prompts through when the remote check errors
+    moderation_cache_max_entries: int = 5000
+    moderation_cache_ttl: float = 86400.0
+    
+    # Startup
+    sdk_warmup: bool = True  # Import provider SDKs in the background after startup instead of on first use
+    
+    # Metrics
+    metrics_enabled: bool = True
+    metrics_port: Optional[int] = None  # Standalone /metrics listener for main_bot.py
+    
+    # HTTP Client Pool Configuration
+    http2_enabled: bool = True
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 30.0
+    http_connect_timeout: float = 10.0
+    http_default_timeout: float = 60.0
+    fal_max_connections: int = 20
+    replicate_max_connections: int = 20
+
     # Pricing Configuration
     profit_margin_min: float = 0.30  # 30%
     profit_margin_max: float = 0.45  # 45%
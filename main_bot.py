@@ -12,7 +12,20 @@ from services.user_service import UserService
 from services.fal_service import FalService
 from services.replicate_service import ReplicateService
 from services.payment_service import PaymentService
-from models.user import UserPlan
+from services.http_client import http_pool
+from services.media_registry import media_registry
+from services.prediction_registry import prediction_registry
+from services.job_scheduler import job_scheduler, QueueFullError
+from services.background_jobs import BackgroundJobService
+from services.hedging import image_hedger, HedgeCandidate
+from services.provider_router import provider_router, CircuitOpenError
+from services.quota import QuotaEngine, QuotaReservation
+from services.usage_events import usage_log
+from services.instrumentation import instrument_handler, start_metrics_server, InstrumentedHTTPXRequest
+from services.send_scheduler import SendScheduler
+from services.lazy_imports import warm_up, configured_sdks
+from services.moderation import prompt_moderator
+from models.user import UserPlan, get_plan_limits
 from bot_messages import *
 
 # Configure logging
@@ -26,8 +39,11 @@ logger = logging.getLogger(__name__)
 user_service = UserService()
 fal_service = FalService()
 replicate_service = ReplicateService()
+quota_engine = QuotaEngine(user_service)
+background_jobs = BackgroundJobService(fal_service, replicate_service, user_service)
 payment_service = PaymentService()
 
+@instrument_handler
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
     user = update.effective_user
@@ -47,20 +63,23 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     # Then send start message
-    plan_features = payment_service.get_plan_features(bot_user.plan)
+    plan_limits = get_plan_limits(bot_user.plan)
     await update.message.reply_text(
-        get_start_message(user.first_name, plan_features["name"]), 
+        get_start_message(user.first_name, plan_limits.name), 
         parse_mode='Markdown'
     )
 
+@instrument_handler
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help command"""
     await update.message.reply_text(get_help_message(), parse_mode='Markdown')
 
+@instrument_handler
 async def plans_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /plans command"""
     await update.message.reply_text(get_plans_message(), parse_mode='Markdown')
 
+@instrument_handler
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /status command"""
     user = update.effective_user
@@ -79,22 +98,27 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='Markdown'
         )
 
+@instrument_handler
 async def upgrade_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /upgrade command"""
     await update.message.reply_text(get_upgrade_message(), parse_mode='Markdown')
 
+@instrument_handler
 async def upgrade_starter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /upgrade_starter command"""
     await handle_upgrade(update, context, UserPlan.STARTER)
 
+@instrument_handler
 async def upgrade_pro_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /upgrade_pro command"""
     await handle_upgrade(update, context, UserPlan.PRO)
 
+@instrument_handler
 async def upgrade_premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /upgrade_premium command"""
     await handle_upgrade(update, context, UserPlan.PREMIUM)
 
+@instrument_handler
 async def upgrade_ultimate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /upgrade_ultimate command"""
     await handle_upgrade(update, context, UserPlan.ULTIMATE)
@@ -104,7 +128,7 @@ async def handle_upgrade(update: Update, context: ContextTypes.DEFAULT_TYPE, pla
     user = update.effective_user
     
     # Get plan features
-    plan_features = payment_service.get_plan_features(plan)
+    plan_limits = get_plan_limits(plan)
     
     # Create checkout session
     success_url = f"https://t.me/{context.bot.username}?start=payment_success"
@@ -126,12 +150,12 @@ async def handle_upgrade(update: Update, context: ContextTypes.DEFAULT_TYPE, pla
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         message = f"""
-💳 **Upgrade to {plan_features['name']}**
+💳 **Upgrade to {plan_limits.name}**
 
 **🎯 You'll get:**
-{chr(10).join(plan_features['features'])}
+{chr(10).join(plan_limits.features)}
 
-**💰 Price:** {plan_features['price']}
+**💰 Price:** {plan_limits.price}
 
 Click "Pay Now" to complete your upgrade via Stripe.
         """
@@ -147,6 +171,56 @@ Click "Pay Now" to complete your upgrade via Stripe.
             parse_mode='Markdown'
         )
 
+def queue_notifier(generating_msg, content_type: str):
+    """Callback that tells the user their queue position while waiting for a slot"""
+    async def on_queued(position: int):
+        await generating_msg.edit_text(
+            get_queue_message(content_type, position),
+            parse_mode='Markdown'
+        )
+    return on_queued
+
+async def moderate_prompt(update: Update, prompt: str) -> bool:
+    """Pre-flight a generation prompt, replying with the reason when it is refused"""
+    verdict = await prompt_moderator.check(prompt)
+    if not verdict.allowed:
+        await update.message.reply_text(
+            get_error_message(verdict.reason),
+            parse_mode='Markdown'
+        )
+    return verdict.allowed
+
+async def routed_call(endpoint: str, func, *args, **kwargs) -> dict:
+    """Call a provider through its circuit breaker, an open breaker counts as a failed result"""
+    try:
+        return await provider_router.call(endpoint, func, *args, **kwargs)
+    except CircuitOpenError as e:
+        return {"success": False, "error": str(e)}
+
+async def send_generated_image(update: Update, generating_msg, reservation: QuotaReservation, prompt: str, result: dict, model_name: str, provider: str, model: str):
+    """Send a generated (or cached) image and settle the quota reserved for it"""
+    # Re-sent by file_id when this image was already uploaded to Telegram
+    await media_registry.reply(
+        update.message,
+        "photo",
+        result["url"],
+        content_key=result.get("cache_key"),
+        caption=get_content_ready_message("image", prompt, result['cost'], model_name),
+        parse_mode='Markdown'
+    )
+    
+    # Cache hits are free for us and optionally for the user
+    if result.get("cached") and not settings.generation_cache_hits_count_quota:
+        await quota_engine.refund(reservation)
+        # Still logged so delivery counts include free cache hits
+        usage_log.record(reservation.telegram_id, reservation.plan, reservation.resource, provider=provider, model=model, cached=True)
+    else:
+        await quota_engine.commit(reservation, provider=provider, model=model, cost=result.get("cost", 0.0), cached=bool(result.get("cached")))
+    
+    # Delete generating message
+    await generating_msg.delete()
+
+@instrument_handler
 async def image_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /image command"""
     if not context.args:
@@ -159,14 +233,19 @@ async def image_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     prompt = " ".join(context.args)
     user = update.effective_user
     
+    # Refused prompts fail here, before quota or a provider is touched
+    if not await moderate_prompt(update, prompt):
+        return
+    
     # Get user
     bot_user = await user_service.get_or_create_user(user.id)
-    plan_features = payment_service.get_plan_features(bot_user.plan)
+    plan_limits = get_plan_limits(bot_user.plan)
     
-    # Check usage limits
-    if bot_user.monthly_images >= plan_features["monthly_images"]:
+    # Reserve quota up front so concurrent requests can't overrun the limit
+    reservation = await quota_engine.reserve(bot_user, "monthly_images")
+    if reservation is None:
         await update.message.reply_text(
-            get_limit_exceeded_message("monthly_images", plan_features["name"]),
+            get_limit_exceeded_message("monthly_images", plan_limits.name),
             parse_mode='Markdown'
         )
         return
@@ -186,52 +265,52 @@ async def image_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:  # PREMIUM, ULTIMATE
             model = "fal-ai/flux-pro"
         
-        # Try Fal.ai first
-        result = await fal_service.generate_image(prompt, model=model)
+        async def generate_with_fal():
+            async with job_scheduler.slot("fal", bot_user.plan, queue_notifier(generating_msg, "image")):
+                return await routed_call("fal.image", fal_service.generate_image, prompt, model=model)
         
-        if result["success"]:
-            # Update user usage
-            bot_user.monthly_images += 1
-            await user_service.update_user_usage(bot_user)
-            
-            # Send image
-            await update.message.reply_photo(
-                photo=result["image_url"],
-                caption=get_content_ready_message("image", prompt, result['cost'], "Fal.ai FLUX"),
+        async def generate_with_replicate():
+            async with job_scheduler.slot("replicate", bot_user.plan):
+                return await routed_call("replicate.image", replicate_service.generate_image, prompt)
+        
+        async def announce_fallback():
+            await generating_msg.edit_text(
+                "🎨 **Trying alternative model...** \n\n⏱️ Please wait",
+                parse_mode='Markdown'
+            )
+        
+        candidates = {
+            "fal.image": HedgeCandidate("fal", generate_with_fal, fal_service._calculate_image_cost("square_hd", model)),
+            "replicate.image": HedgeCandidate("replicate", generate_with_replicate, replicate_service._calculate_image_cost("black-forest-labs/flux-dev"))
+        }
+        
+        # Fal.ai first unless its breaker is open or it's degraded; the backup is
+        # fired early when the first choice is slower than usual
+        routed = [candidates[endpoint] for endpoint in provider_router.available(candidates)]
+        if not routed:
+            await generating_msg.edit_text(
+                get_error_message("api_error"),
                 parse_mode='Markdown'
             )
-            
-            # Delete generating message
-            await generating_msg.delete()
-            
+            return
+        
+        provider, result = await image_hedger.run(*routed, on_fallback=announce_fallback)
+        
+        if result["success"]:
+            model_name = "Fal.ai FLUX" if provider == "fal" else "Replicate FLUX"
+            model_id = model if provider == "fal" else "black-forest-labs/flux-dev"
+            await send_generated_image(update, generating_msg, reservation, prompt, result, model_name, provider, model_id)
         else:
-            # Try Replicate as fallback
             await generating_msg.edit_text(
-                "🎨 **Trying alternative model...** \n\n⏱️ Please wait",
+                get_error_message("api_error"),
                 parse_mode='Markdown'
             )
-            
-            result = await replicate_service.generate_image(prompt)
-            
-            if result["success"]:
-                # Update user usage
-                bot_user.monthly_images += 1
-                await user_service.update_user_usage(bot_user)
-                
-                # Send image
-                await update.message.reply_photo(
-                    photo=result["image_url"],
-                    caption=get_content_ready_message("image", prompt, result['cost'], "Replicate FLUX"),
-                    parse_mode='Markdown'
-                )
-                
-                # Delete generating message
-                await generating_msg.delete()
-            else:
-                await generating_msg.edit_text(
-                    get_error_message("api_error"),
-                    parse_mode='Markdown'
-                )
+    
+    except QueueFullError:
+        await generating_msg.edit_text(
+            get_error_message("queue_full"),
+            parse_mode='Markdown'
+        )
     
     except Exception as e:
         logger.error(f"Error in image command: {e}")
@@ -239,7 +318,12 @@ async def image_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             get_error_message("general"),
             parse_mode='Markdown'
         )
+    
+    finally:
+        # No-op once committed, gives the reservation back on any failure
+        await quota_engine.refund(reservation)
 
+@instrument_handler
 async def video_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /video command"""
     if not context.args:
@@ -252,64 +336,49 @@ async def video_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     prompt = " ".join(context.args)
     user = update.effective_user
     
+    # Refused prompts fail here, before quota or a provider is touched
+    if not await moderate_prompt(update, prompt):
+        return
+    
     # Get user
     bot_user = await user_service.get_or_create_user(user.id)
-    plan_features = payment_service.get_plan_features(bot_user.plan)
+    plan_limits = get_plan_limits(bot_user.plan)
     
     # Check if plan supports videos
-    if plan_features["monthly_videos"] == 0:
+    if plan_limits.monthly_videos == 0:
         await update.message.reply_text(
-            f"🚫 **Video generation not available in {plan_features['name']} plan**\n\nUpgrade to PRO or higher to access video generation!\n\n👆 Use `/upgrade` to see options",
+            f"🚫 **Video generation not available in {plan_limits.name} plan**\n\nUpgrade to PRO or higher to access video generation!\n\n👆 Use `/upgrade` to see options",
             parse_mode='Markdown'
         )
         return
     
-    # Check usage limits
-    if bot_user.monthly_videos >= plan_features["monthly_videos"]:
+    # Reserve quota up front, the background job commits or refunds it
+    reservation = await quota_engine.reserve(bot_user, "monthly_videos")
+    if reservation is None:
         await update.message.reply_text(
-            get_limit_exceeded_message("monthly_videos", plan_features["name"]),
+            get_limit_exceeded_message("monthly_videos", plan_limits.name),
             parse_mode='Markdown'
         )
         return
     
-    # Send "generating" message
-    generating_msg = await update.message.reply_text(
-        get_generating_message("video"),
+    # Send "queued" message, the result is delivered by a background worker
+    status_msg = await update.message.reply_text(
+        get_job_queued_message("video"),
         parse_mode='Markdown'
     )
     
     try:
-        # Try Fal.ai first
-        result = await fal_service.generate_video(prompt)
-        
-        if result["success"]:
-            # Update user usage
-            bot_user.monthly_videos += 1
-            await user_service.update_user_usage(bot_user)
-            
-            # Send video
-            await update.message.reply_video(
-                video=result["video_url"],
-                caption=get_content_ready_message("video", prompt, result['cost'], "Fal.ai Luma"),
-                parse_mode='Markdown'
-            )
-            
-            # Delete generating message
-            await generating_msg.delete()
-            
-        else:
-            await generating_msg.edit_text(
-                get_error_message("api_error"),
-                parse_mode='Markdown'
-            )
+        await background_jobs.enqueue(bot_user, update.effective_chat.id, status_msg.message_id, "video", prompt)
     
     except Exception as e:
         logger.error(f"Error in video command: {e}")
-        await generating_msg.edit_text(
+        await quota_engine.refund(reservation)
+        await status_msg.edit_text(
             get_error_message("general"),
             parse_mode='Markdown'
         )
 
+@instrument_handler
 async def music_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /music command"""
     if not context.args:
@@ -322,56 +391,41 @@ async def music_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     prompt = " ".join(context.args)
     user = update.effective_user
     
+    # Refused prompts fail here, before quota or a provider is touched
+    if not await moderate_prompt(update, prompt):
+        return
+    
     # Get user
     bot_user = await user_service.get_or_create_user(user.id)
-    plan_features = payment_service.get_plan_features(bot_user.plan)
+    plan_limits = get_plan_limits(bot_user.plan)
     
-    # Check usage limits
-    if bot_user.monthly_music >= plan_features["monthly_music"]:
+    # Reserve quota up front, the background job commits or refunds it
+    reservation = await quota_engine.reserve(bot_user, "monthly_music")
+    if reservation is None:
         await update.message.reply_text(
-            get_limit_exceeded_message("monthly_music", plan_features["name"]),
+            get_limit_exceeded_message("monthly_music", plan_limits.name),
             parse_mode='Markdown'
         )
         return
     
-    # Send "generating" message
-    generating_msg = await update.message.reply_text(
-        get_generating_message("music"),
+    # Send "queued" message, the result is delivered by a background worker
+    status_msg = await update.message.reply_text(
+        get_job_queued_message("music"),
         parse_mode='Markdown'
     )
     
     try:
-        # Try Replicate for music generation
-        result = await replicate_service.generate_music(prompt)
-        
-        if result["success"]:
-            # Update user usage
-            bot_user.monthly_music += 1
-            await user_service.update_user_usage(bot_user)
-            
-            # Send audio
-            await update.message.reply_audio(
-                audio=result["audio_url"],
-                caption=get_content_ready_message("music", prompt, result['cost'], "Replicate Suno"),
-                parse_mode='Markdown'
-            )
-            
-            # Delete generating message
-            await generating_msg.delete()
-            
-        else:
-            await generating_msg.edit_text(
-                get_error_message("api_error"),
-                parse_mode='Markdown'
-            )
+        await background_jobs.enqueue(bot_user, update.effective_chat.id, status_msg.message_id, "music", prompt)
     
     except Exception as e:
         logger.error(f"Error in music command: {e}")
-        await generating_msg.edit_text(
+        await quota_engine.refund(reservation)
+        await status_msg.edit_text(
             get_error_message("general"),
             parse_mode='Markdown'
         )
 
+@instrument_handler
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle callback queries from inline keyboards"""
     query = update.callback_query
@@ -383,6 +437,7 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
             parse_mode='Markdown'
         )
 
+@instrument_handler
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle regular messages (AI chat)"""
     user = update.effective_user
@@ -390,12 +445,13 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Get or create user
     bot_user = await user_service.get_or_create_user(user.id)
-    plan_features = payment_service.get_plan_features(bot_user.plan)
+    plan_limits = get_plan_limits(bot_user.plan)
     
-    # Check daily GPT-4o limits
-    if bot_user.daily_gpt4o_messages >= plan_features["daily_gpt4o_messages"]:
+    # Reserve a daily GPT-4o message
+    reservation = await quota_engine.reserve(bot_user, "daily_gpt4o_messages")
+    if reservation is None:
         await update.message.reply_text(
-            get_limit_exceeded_message("daily_gpt4o", plan_features["name"]),
+            get_limit_exceeded_message("daily_gpt4o", plan_limits.name),
             parse_mode='Markdown'
         )
         return
@@ -415,15 +471,43 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • `/plans` - View pricing plans
 • `/upgrade` - Upgrade your plan
 
-**Your plan:** {plan_features['name']}
-**Daily messages used:** {bot_user.daily_gpt4o_messages + 1}/{plan_features['daily_gpt4o_messages']}
+**Your plan:** {plan_limits.name}
+**Daily messages used:** {bot_user.daily_gpt4o_messages}/{plan_limits.daily_gpt4o_messages}
     """
     
-    # Update usage
-    bot_user.daily_gpt4o_messages += 1
-    await user_service.update_user_usage(bot_user)
-    
-    await update.message.reply_text(response, parse_mode='Markdown')
+    try:
+        await update.message.reply_text(response, parse_mode='Markdown')
+        await quota_engine.commit(reservation)
+    finally:
+        await quota_engine.refund(reservation)
+
+async def post_init(application: Application):
+    """Open shared resources once the application is initialized"""
+    await http_pool.start()
+    await user_service.start()
+    # Webhooks reach the web app, not this process, so they only help through a shared store
+    prediction_registry.attach(user_service.state, receives_webhooks=False)
+    await background_jobs.start(application.bot)
+    await usage_log.start()
+    if settings.metrics_enabled and settings.metrics_port:
+        application.bot_data["metrics_server"] = await start_metrics_server(settings.metrics_port)
+    if settings.sdk_warmup:
+        # Provider SDKs load in a thread while the first updates are already being handled
+        application.bot_data["sdk_warmup"] = asyncio.create_task(warm_up(configured_sdks()))
+
+async def post_shutdown(application: Application):
+    """Release shared resources after the application stops"""
+    metrics_server = application.bot_data.pop("metrics_server", None)
+    if metrics_server:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    await background_jobs.close()
+    await prompt_moderator.close()
+    await replicate_service.close()
+    await usage_log.close()
+    await user_service.close()
+    await http_pool.close()
+    payment_service.close()
 
 def main():
     """Main function to run the bot"""
@@ -433,7 +517,15 @@ def main():
         return
     
     # Create application
-    application = Application.builder().token(settings.telegram_bot_token).build()
+    application = (
+        Application.builder()
+        .token(settings.telegram_bot_token)
+        .request(InstrumentedHTTPXRequest(connection_pool_size=256))
+        .rate_limiter(SendScheduler())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Add command handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -465,7 +557,8 @@ def main():
             listen="0.0.0.0",
             port=settings.port,
             url_path=settings.telegram_bot_token,
-            webhook_url=f"{settings.telegram_webhook_url}/{settings.telegram_bot_token}"
+            webhook_url=f"{settings.telegram_webhook_url}/{settings.telegram_bot_token}",
+            secret_token=settings.telegram_webhook_secret
         )
     else:
         logger.info("Starting AI Bot in polling mode...")
@@ -1,6 +1,8 @@
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
-from pydantic import BaseModel
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple
+from pydantic import BaseModel, Field
 from enum import Enum
 
 class UserPlan(str, Enum):
@@ -27,16 +29,29 @@ class User(BaseModel):
     daily_gpt4_messages: int = 0
     monthly_images: int = 0
     monthly_music: int = 0
+    monthly_videos: int = 0
     monthly_claude_tokens: int = 0
     
-    # Reset dates
+    # Usage period (period_id) each counter above belongs to, resets are implicit
+    usage_periods: Dict[str, str] = Field(default_factory=dict)
+    billing_anchor: Optional[datetime] = None
+    
+    # Set when a broadcast got 403 (bot blocked), cleared when the user writes again
+    blocked_at: Optional[datetime] = None
+    
+    # Reset dates (superseded by usage_periods, kept so old rows still load)
     last_daily_reset: Optional[datetime] = None
     last_monthly_reset: Optional[datetime] = None
 
-class PlanLimits(BaseModel):
+# Sentinel for limits that are not enforced
+UNLIMITED = -1
+
+@dataclass(frozen=True, slots=True)
+class PlanLimits:
     plan: UserPlan
+    name: str
+    price: str
     price_usd: float
-    price_brl: Optional[float] = None
     
     # Daily limits
     daily_gpt4o_messages: int
@@ -45,79 +60,185 @@ class PlanLimits(BaseModel):
     # Monthly limits
     monthly_images: int
     monthly_music: int
+    monthly_videos: int
     monthly_claude_tokens: int
     
+    features: Tuple[str, ...] = ()
+    stripe_price_id: Optional[str] = None
+    queue_priority: int = 9  # Lower runs first in the generation queue
+    price_brl: Optional[float] = None
+    
     # Features
     has_commercial_rights: bool = False
     has_priority_queue: bool = False
     has_stealth_mode: bool = False
 
-# Plan configurations based on the bot description
-PLAN_CONFIGS = {
+    def is_unlimited(self, resource: str) -> bool:
+        """Whether a limit field (e.g. "monthly_images") is unlimited"""
+        return getattr(self, resource) == UNLIMITED
+
+    def allows(self, resource: str, used: int) -> bool:
+        """Whether another unit of a resource fits in the plan limit"""
+        limit = getattr(self, resource)
+        return limit == UNLIMITED or used < limit
+
+# Plan limits registry, built once at import and read-only afterwards
+PLAN_CONFIGS: Mapping[UserPlan, PlanLimits] = MappingProxyType({
     UserPlan.FREE: PlanLimits(
         plan=UserPlan.FREE,
+        name="🆓 Free",
+        price="$0/mês",
         price_usd=0.0,
-        daily_gpt4o_messages=10,
+        daily_gpt4o_messages=5,
         daily_gpt4_messages=0,
-        monthly_images=5,
-        monthly_music=0,
-        monthly_claude_tokens=0
+        monthly_images=3,
+        monthly_music=1,
+        monthly_videos=0,
+        monthly_claude_tokens=0,
+        queue_priority=6,
+        features=(
+            "✅ 5 mensagens GPT-4o por dia",
+            "✅ 3 imagens por mês (FLUX Schnell)",
+            "✅ 1 música por mês",
+            "❌ Sem vídeos",
+            "❌ Sem Claude",
+            "❌ Sem GPT-4"
+        )
     ),
     UserPlan.MINI: PlanLimits(
         plan=UserPlan.MINI,
+        name="⭐ Mini",
+        price="$3.80/mês",
         price_usd=3.80,
         daily_gpt4o_messages=100,
         daily_gpt4_messages=0,
         monthly_images=10,
         monthly_music=5,
-        monthly_claude_tokens=0
+        monthly_videos=0,
+        monthly_claude_tokens=0,
+        queue_priority=5,
+        features=(
+            "✅ 100 mensagens GPT-4o por dia",
+            "✅ 10 imagens por mês (FLUX Schnell)",
+            "✅ 5 músicas por mês",
+            "❌ Sem vídeos",
+            "❌ Sem Claude",
+            "❌ Sem GPT-4"
+        )
     ),
     UserPlan.STARTER: PlanLimits(
         plan=UserPlan.STARTER,
-        price_usd=7.97,
-        daily_gpt4o_messages=0,
-        daily_gpt4_messages=25,
-        monthly_images=30,
-        monthly_music=10,
-        monthly_claude_tokens=0
+        name="🚀 Starter",
+        price="$9.99/mês",
+        price_usd=9.99,
+        daily_gpt4o_messages=50,
+        daily_gpt4_messages=0,
+        monthly_images=15,
+        monthly_music=3,
+        monthly_videos=0,
+        monthly_claude_tokens=0,
+        queue_priority=4,
+        features=(
+            "✅ 50 mensagens GPT-4o por dia",
+            "✅ 15 imagens por mês (FLUX Schnell)",
+            "✅ 3 músicas por mês",
+            "❌ Sem vídeos",
+            "❌ Sem Claude",
+            "❌ Sem GPT-4"
+        ),
+        stripe_price_id="price_starter_999"
     ),
     UserPlan.PRO: PlanLimits(
         plan=UserPlan.PRO,
+        name="💼 Pro",
+        price="$19.99/mês",
         price_usd=19.99,
         daily_gpt4o_messages=100,
         daily_gpt4_messages=0,
         monthly_images=50,
         monthly_music=10,
-        monthly_videos=0,
-        monthly_claude_tokens=0
+        monthly_videos=5,
+        monthly_claude_tokens=0,
+        queue_priority=3,
+        features=(
+            "✅ 100 mensagens GPT-4o por dia",
+            "✅ 50 imagens por mês (FLUX Dev)",
+            "✅ 10 músicas por mês",
+            "✅ 5 vídeos por mês",
+            "❌ Sem Claude",
+            "❌ Sem GPT-4"
+        ),
+        stripe_price_id="price_pro_1999"
     ),
     UserPlan.PREMIUM: PlanLimits(
         plan=UserPlan.PREMIUM,
-        price_usd=12.97,
-        daily_gpt4o_messages=0,
-        daily_gpt4_messages=50,
+        name="⭐ Premium",
+        price="$59.99/mês",
+        price_usd=59.99,
+        daily_gpt4o_messages=50,
+        daily_gpt4_messages=100,
         monthly_images=100,
         monthly_music=20,
-        monthly_claude_tokens=0
+        monthly_videos=10,
+        monthly_claude_tokens=0,
+        queue_priority=2,
+        features=(
+            "✅ 50 mensagens GPT-4o por dia",
+            "✅ 100 mensagens GPT-4 por dia",
+            "✅ 100 imagens por mês (FLUX Pro)",
+            "✅ 20 músicas por mês",
+            "✅ 10 vídeos por mês",
+            "❌ Sem Claude"
+        ),
+        stripe_price_id="price_premium_5999"
     ),
     UserPlan.ULTIMATE: PlanLimits(
         plan=UserPlan.ULTIMATE,
-        price_usd=18.38,
-        daily_gpt4o_messages=0,
-        daily_gpt4_messages=100,
+        name="👑 Ultimate",
+        price="$149.99/mês",
+        price_usd=149.99,
+        daily_gpt4o_messages=100,
+        daily_gpt4_messages=200,
         monthly_images=200,
-        monthly_music=50,
-        monthly_claude_tokens=0
+        monthly_music=30,
+        monthly_videos=20,
+        monthly_claude_tokens=1000000,
+        queue_priority=1,
+        features=(
+            "✅ 100 mensagens GPT-4o por dia",
+            "✅ 200 mensagens GPT-4 por dia",
+            "✅ 200 imagens por mês (FLUX Pro)",
+            "✅ 30 músicas por mês",
+            "✅ 20 vídeos por mês",
+            "✅ Claude 1M tokens por mês"
+        ),
+        stripe_price_id="price_ultimate_14999"
     ),
     UserPlan.ALPHA: PlanLimits(
         plan=UserPlan.ALPHA,
+        name="🔱 Alpha",
+        price="$44.95/mês",
         price_usd=44.95,
-        daily_gpt4o_messages=-1,  # Unlimited
-        daily_gpt4_messages=-1,   # Unlimited
-        monthly_images=-1,        # Unlimited
+        daily_gpt4o_messages=UNLIMITED,
+        daily_gpt4_messages=UNLIMITED,
+        monthly_images=UNLIMITED,
         monthly_music=200,
+        monthly_videos=0,
         monthly_claude_tokens=3000000,  # 3M tokens
+        queue_priority=0,
+        features=(
+            "✅ Mensagens GPT-4o e GPT-4 ilimitadas",
+            "✅ Imagens ilimitadas",
+            "✅ 200 músicas por mês",
+            "✅ Claude 3M tokens por mês",
+            "✅ Direitos comerciais",
+            "✅ Fila prioritária"
+        ),
         has_commercial_rights=True,
         has_priority_queue=True
     )
-}
+})
+
+def get_plan_limits(plan: UserPlan) -> PlanLimits:
+    """Look up the limits for a plan, unknown plans get the free tier"""
+    return PLAN_CONFIGS.get(plan, PLAN_CONFIGS[UserPlan.FREE])
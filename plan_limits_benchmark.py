@@ -0,0 +1,66 @@
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+logging.basicConfig(
+    format=r'%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:plan-limits-benchmark")
+
+from models.user import PLAN_CONFIGS, UserPlan, get_plan_limits
+
+LIMIT_FIELDS = (
+    "daily_gpt4o_messages",
+    "daily_gpt4_messages",
+    "monthly_images",
+    "monthly_music",
+    "monthly_videos",
+    "monthly_claude_tokens"
+)
+
+def rebuilt_plan_features(plan: UserPlan) -> dict:
+    """What PaymentService.get_plan_features used to do: build every plan's dict, then pick one.
+
+    Built from the registry rather than literals, so it runs somewhat slower than the old code did.
+    """
+    features = {
+        config.plan: {
+            "name": config.name,
+            "price": config.price,
+            **{field: getattr(config, field) for field in LIMIT_FIELDS},
+            "features": list(config.features)
+        }
+        for config in PLAN_CONFIGS.values()
+    }
+    return features.get(plan, features[UserPlan.FREE])
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-call plan dict construction with the frozen plan-limits registry")
+    parser.add_argument("--number", type=int, default=200000, help="Calls per timing run")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing runs, the fastest is reported")
+    parser.add_argument("--plan", default=UserPlan.PRO.value, choices=[plan.value for plan in UserPlan])
+    args = parser.parse_args()
+
+    plan = UserPlan(args.plan)
+    # The per-message work: find the plan's limits and check one counter against them
+    cases = {
+        "rebuilt dict": lambda: rebuilt_plan_features(plan)["daily_gpt4o_messages"] > 3,
+        "registry": lambda: get_plan_limits(plan).allows("daily_gpt4o_messages", 3)
+    }
+
+    timings = {}
+    for label, case in cases.items():
+        best = min(timeit.repeat(case, number=args.number, repeat=args.repeat))
+        timings[label] = best / args.number * 1e6
+        logger.info(f"{label:>12}: {timings[label]:.2f}us per message (best of {args.repeat} x {args.number})")
+
+    logger.info(f"Registry lookup is {timings['rebuilt dict'] / timings['registry']:.1f}x faster")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
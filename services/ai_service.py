@@ -1,111 +1,142 @@
 import logging
-import httpx
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, List, Optional
 from models.user import User
 from config.settings import settings
+from services.provider_router import provider_router, CircuitOpenError
+from services.providers import Capability, Provider
+from services.openai_provider import OpenAIProvider
+from services.anthropic_provider import AnthropicProvider
+from services.fal_service import FalService
+from services.replicate_service import ReplicateService
 
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = "Você é um assistente de IA útil e amigável. Responda em português brasileiro."
+
 class AIService:
     def __init__(self):
-        self.openai_client = None
-        self.anthropic_client = None
-        self.replicate_client = None
-        self.fal_client = None
+        self.openai = OpenAIProvider()
+        self.anthropic = AnthropicProvider()
+        self.fal = FalService()
+        self.replicate = ReplicateService()
         
-        # Initialize clients when API keys are available
-        self._initialize_clients()
-
-    def _initialize_clients(self):
-        """Initialize AI service clients"""
-        try:
-            if settings.openai_api_key:
-                import openai
-                self.openai_client = openai.AsyncOpenAI(api_key=settings.openai_api_key)
-                logger.info("OpenAI client initialized")
-        except Exception as e:
-            logger.warning(f"Failed to initialize OpenAI client: {e}")
-
-        try:
-            if settings.anthropic_api_key:
-                import anthropic
-                self.anthropic_client = anthropic.AsyncAnthropic(api_key=settings.anthropic_api_key)
-                logger.info("Anthropic client initialized")
-        except Exception as e:
-            logger.warning(f"Failed to initialize Anthropic client: {e}")
+        # Preference order when several providers can do the same thing
+        self.providers: List[Provider] = [self.replicate, self.fal, self.openai, self.anthropic]
+
+    async def close(self) -> None:
+        """Send pending micro-batches"""
+        for provider in self.providers:
+            await provider.close()
+
+    def _providers_for(self, capability: Capability) -> Dict[str, Provider]:
+        """Configured providers with a capability, keyed by router endpoint"""
+        return {
+            f"{provider.name}.{capability.value}": provider
+            for provider in self.providers
+            if provider.configured and provider.supports(capability)
+        }
+
+    def _text_provider(self, model: str) -> Optional[Provider]:
+        """Provider serving a model name, None when it isn't configured"""
+        if model.startswith("gpt") and self.openai.configured:
+            return self.openai
+        if model.startswith("claude") and self.anthropic.configured:
+            return self.anthropic
+        return None
+
+    def text_provider_name(self, model: str) -> str:
+        """Name of the provider a model's requests go to, "mock" when none is configured"""
+        provider = self._text_provider(model)
+        return provider.name if provider else "mock"
+
+    def _with_system_prompt(self, history: Optional[List[Dict[str, str]]]) -> List[Dict[str, str]]:
+        return [{"role": "system", "content": SYSTEM_PROMPT}, *(history or [])]
 
     async def generate_text_response(
         self,
         message: str,
         model: str = "gpt-4o",
-        user_context: Optional[User] = None
+        user_context: Optional[User] = None,
+        history: Optional[List[Dict[str, str]]] = None
     ) -> str:
-        """Generate text response using specified model"""
+        """Generate text response using specified model, provider errors are raised to the caller"""
         
-        try:
-            if model.startswith("gpt") and self.openai_client:
-                return await self._generate_openai_response(message, model)
-            elif model.startswith("claude") and self.anthropic_client:
-                return await self._generate_anthropic_response(message, model)
-            else:
-                # Fallback to mock response
-                return await self._generate_mock_response(message, model)
-                
-        except Exception as e:
-            logger.error(f"Error generating text response: {e}")
-            return "❌ Desculpe, ocorreu um erro ao gerar a resposta. Tente novamente."
+        provider = self._text_provider(model)
+        if provider:
+            return await provider.generate_text(message, model, self._with_system_prompt(history))
+        # Fallback to mock response
+        return await self._generate_mock_response(message, model)
+
+    async def stream_text_response(
+        self,
+        message: str,
+        model: str = "gpt-4o",
+        user_context: Optional[User] = None,
+        history: Optional[List[Dict[str, str]]] = None
+    ) -> AsyncIterator[str]:
+        """Stream a text response as it is generated, yielding text chunks"""
+        
+        provider = self._text_provider(model)
+        if provider:
+            async for chunk in provider.stream_text(message, model, self._with_system_prompt(history)):
+                yield chunk
+        else:
+            # Fallback to mock response
+            yield await self._generate_mock_response(message, model)
 
     async def generate_image(
         self,
         prompt: str,
         user_context: Optional[User] = None
-    ) -> str:
-        """Generate image using available APIs"""
+    ) -> Dict[str, Any]:
+        """Generate image using available APIs, the provider's result with its name added"""
         
-        try:
-            # Try Replicate first (preferred)
-            if settings.replicate_api_token:
-                return await self._generate_replicate_image(prompt)
-            
-            # Try Fal.ai
-            elif settings.fal_api_key:
-                return await self._generate_fal_image(prompt)
-            
-            # Try OpenAI DALL-E
-            elif self.openai_client:
-                return await self._generate_dalle_image(prompt)
-            
-            else:
-                # Return mock image URL
-                return "https://via.placeholder.com/512x512?text=Imagem+Gerada"
-                
-        except Exception as e:
-            logger.error(f"Error generating image: {e}")
-            raise Exception("Erro ao gerar imagem")
+        # Configured providers in preference order: Replicate, Fal.ai, DALL-E
+        providers = self._providers_for(Capability.IMAGE)
+        if not providers:
+            # Return mock image URL
+            return {"success": True, "url": "https://via.placeholder.com/512x512?text=Imagem+Gerada", "cost": 0.0, "provider": None, "model": None}
+        
+        # Skip providers whose circuit breaker is open, degraded ones are tried last
+        for endpoint in provider_router.available(providers):
+            try:
+                result = await provider_router.call(endpoint, providers[endpoint].generate_image, prompt)
+            except CircuitOpenError:
+                continue
+            except Exception as e:
+                logger.error(f"Error generating image with {endpoint}: {e}")
+                continue
+            if result["success"]:
+                return {**result, "provider": providers[endpoint].name}
+            logger.error(f"Error generating image with {endpoint}: {result.get('error')}")
+        
+        raise Exception("Erro ao gerar imagem")
 
     async def generate_music(
         self,
         prompt: str,
         user_context: Optional[User] = None
-    ) -> str:
-        """Generate music using available APIs"""
+    ) -> Dict[str, Any]:
+        """Generate music using available APIs, the provider's result with its name added"""
         
-        try:
-            # Try Replicate for Suno AI
-            if settings.replicate_api_token:
-                return await self._generate_replicate_music(prompt)
-            
-            # Try Fal.ai
-            elif settings.fal_api_key:
-                return await self._generate_fal_music(prompt)
-            
-            else:
-                # Return mock audio URL
-                return "https://www.soundjay.com/misc/sounds/bell-ringing-05.wav"
-                
-        except Exception as e:
-            logger.error(f"Error generating music: {e}")
-            raise Exception("Erro ao gerar música")
+        providers = self._providers_for(Capability.MUSIC)
+        if not providers:
+            # Return mock audio URL
+            return {"success": True, "url": "https://www.soundjay.com/misc/sounds/bell-ringing-05.wav", "cost": 0.0, "provider": None, "model": None}
+        
+        for endpoint in provider_router.available(providers):
+            try:
+                result = await provider_router.call(endpoint, providers[endpoint].generate_music, prompt)
+            except CircuitOpenError:
+                continue
+            except Exception as e:
+                logger.error(f"Error generating music with {endpoint}: {e}")
+                continue
+            if result["success"]:
+                return {**result, "provider": providers[endpoint].name}
+            logger.error(f"Error generating music with {endpoint}: {result.get('error')}")
+        
+        raise Exception("Erro ao gerar música")
 
     async def analyze_image(
         self,
@@ -117,8 +148,8 @@ class AIService:
         
         try:
             # Try OpenAI GPT-4 Vision
-            if self.openai_client:
-                return await self._analyze_image_openai(image_url, prompt)
+            if self.openai.configured:
+                return await self.openai.analyze_image(image_url, prompt)
             
             # Try Google Gemini Vision
             elif settings.google_ai_api_key:
@@ -131,85 +162,22 @@ class AIService:
             logger.error(f"Error analyzing image: {e}")
             return "❌ Erro ao analisar a imagem."
 
-    # OpenAI implementations
-    async def _generate_openai_response(self, message: str, model: str) -> str:
-        """Generate response using OpenAI"""
-        response = await self.openai_client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "Você é um assistente de IA útil e amigável. Responda em português brasileiro."},
-                {"role": "user", "content": message}
-            ],
-            max_tokens=1000,
-            temperature=0.7
-        )
-        return response.choices[0].message.content
-
-    async def _generate_dalle_image(self, prompt: str) -> str:
-        """Generate image using DALL-E"""
-        response = await self.openai_client.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            size="1024x1024",
-            quality="standard",
-            n=1
-        )
-        return response.data[0].url
-
-    async def _analyze_image_openai(self, image_url: str, prompt: str) -> str:
-        """Analyze image using GPT-4 Vision"""
-        response = await self.openai_client.chat.completions.create(
-            model="gpt-4-vision-preview",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": image_url}}
-                    ]
-                }
-            ],
-            max_tokens=500
-        )
-        return response.choices[0].message.content
-
-    # Anthropic implementations
-    async def _generate_anthropic_response(self, message: str, model: str) -> str:
-        """Generate response using Anthropic Claude"""
-        response = await self.anthropic_client.messages.create(
-            model=model,
-            max_tokens=1000,
-            messages=[
-                {"role": "user", "content": message}
-            ]
-        )
-        return response.content[0].text
-
-    # Replicate implementations
-    async def _generate_replicate_image(self, prompt: str) -> str:
-        """Generate image using Replicate"""
-        # This will be implemented when we have access to Replicate API
-        # For now, return placeholder
-        return "https://via.placeholder.com/512x512?text=Replicate+Image"
-
-    async def _generate_replicate_music(self, prompt: str) -> str:
-        """Generate music using Replicate"""
-        # This will be implemented when we have access to Replicate API
-        # For now, return placeholder
-        return "https://www.soundjay.com/misc/sounds/bell-ringing-05.wav"
-
-    # Fal.ai implementations
-    async def _generate_fal_image(self, prompt: str) -> str:
-        """Generate image using Fal.ai"""
-        # This will be implemented when we have access to Fal.ai API
-        # For now, return placeholder
-        return "https://via.placeholder.com/512x512?text=Fal.ai+Image"
-
-    async def _generate_fal_music(self, prompt: str) -> str:
-        """Generate music using Fal.ai"""
-        # This will be implemented when we have access to Fal.ai API
-        # For now, return placeholder
-        return "https://www.soundjay.com/misc/sounds/bell-ringing-05.wav"
+    async def summarize_conversation(self, previous_summary: str, turns: list) -> str:
+        """Fold older conversation turns into a short rolling summary"""
+        if not self.openai.configured:
+            return previous_summary
+        
+        transcript = "\n".join(f"{turn.role}: {turn.content}" for turn in turns)
+        message = f"Resumo anterior: {previous_summary or '(nenhum)'}\n\nNovas mensagens:\n{transcript}"
+        history = [{"role": "system", "content": "Resuma a conversa em no máximo 5 frases, mantendo fatos e preferências do usuário."}]
+        options = {"max_tokens": 200, "temperature": 0.3}
+        
+        if settings.conversation_summary_batch:
+            # Nobody waits on a summary, collect them for the Batch API at half price
+            request = self.openai.chat_request(message, settings.conversation_summary_model, history, **options)
+            response = await self.openai.batch("chat.completions", request, window=settings.openai_batch_window)
+            return response["choices"][0]["message"]["content"]
+        return await self.openai.generate_text(message, settings.conversation_summary_model, history, **options)
 
     # Google Gemini implementations
     async def _analyze_image_gemini(self, image_url: str, prompt: str) -> str:
@@ -0,0 +1,74 @@
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+from config.settings import settings
+from services.http_client import http_pool
+from services.instrumentation import instrument_provider
+from services.lazy_imports import lazy_import
+from services.providers import Capability, Provider
+
+logger = logging.getLogger(__name__)
+
+anthropic = lazy_import("anthropic")
+
+class AnthropicProvider(Provider):
+    name = "anthropic"
+    capabilities = frozenset({Capability.TEXT, Capability.STREAM})
+
+    def __init__(self):
+        super().__init__()
+        self._client = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(settings.anthropic_api_key)
+
+    @property
+    def client(self):
+        """AsyncAnthropic on the pooled HTTP client with the shared retry and timeout policy, None without a key"""
+        if self._client is None and self.configured:
+            try:
+                self._client = anthropic.AsyncAnthropic(
+                    api_key=settings.anthropic_api_key,
+                    max_retries=settings.provider_max_retries,
+                    timeout=settings.provider_timeout,
+                    http_client=http_pool.get_client(self.name)
+                )
+                logger.info("Anthropic client initialized")
+            except Exception as e:
+                logger.warning(f"Failed to initialize Anthropic client: {e}")
+                self._client = False
+        return self._client or None
+
+    def _build_request(self, message: str, history: Optional[List[Dict[str, str]]]) -> Dict[str, Any]:
+        """Anthropic takes system text separately from the user/assistant turns"""
+        history = history or []
+        system = "\n\n".join(turn["content"] for turn in history if turn["role"] == "system")
+        messages = [turn for turn in history if turn["role"] != "system"]
+        messages.append({"role": "user", "content": message})
+
+        request = {"messages": messages}
+        if system:
+            request["system"] = system
+        return request
+
+    @instrument_provider("anthropic")
+    async def generate_text(self, message: str, model: str, history: Optional[List[Dict[str, str]]] = None, **options: Any) -> str:
+        """Generate response using Anthropic Claude"""
+        response = await self.client.messages.create(
+            model=model,
+            max_tokens=options.pop("max_tokens", 1000),
+            **self._build_request(message, history),
+            **options
+        )
+        return response.content[0].text
+
+    @instrument_provider("anthropic")
+    async def stream_text(self, message: str, model: str, history: Optional[List[Dict[str, str]]] = None) -> AsyncIterator[str]:
+        """Stream response using Anthropic Claude"""
+        async with self.client.messages.stream(
+            model=model,
+            max_tokens=1000,
+            **self._build_request(message, history)
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
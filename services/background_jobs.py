@@ -0,0 +1,306 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from telegram import Bot
+from config.settings import settings
+from models.user import UserPlan
+from services.job_scheduler import job_scheduler, QueueFullError
+from services.media_registry import media_registry
+from services.quota import QuotaEngine, QuotaReservation
+from services.metrics import metrics
+from services.instrumentation import metric_labels
+from services.replicate_service import keep_predictions_on_cancel
+from bot_messages import get_content_ready_message, get_error_message, get_queue_message
+
+logger = logging.getLogger(__name__)
+
+# How each background job kind is generated and delivered
+JOB_KINDS = {
+    "video": {
+        "provider": "fal",
+        "model": "fal-ai/luma-dream-machine",
+        "usage_field": "monthly_videos",
+        "media": "video",
+        "model_name": "Fal.ai Luma"
+    },
+    "music": {
+        "provider": "replicate",
+        "model": "suno-ai/bark",
+        "usage_field": "monthly_music",
+        "media": "audio",
+        "model_name": "Replicate Suno"
+    }
+}
+
+class SQLiteJobStore:
+    """Durable job records so queued and running jobs survive restarts"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    status_message_id INTEGER,
+                    kind TEXT NOT NULL,
+                    prompt TEXT NOT NULL,
+                    plan TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    charged INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def _insert(self, job: Dict[str, Any]) -> None:
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    f"INSERT INTO jobs ({', '.join(job)}) VALUES ({', '.join('?' for _ in job)})",
+                    tuple(job.values())
+                )
+
+    def _update(self, job_id: str, fields: Dict[str, Any]) -> None:
+        fields = {**fields, "updated_at": time.time()}
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+                    (*fields.values(), job_id)
+                )
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def _unfinished(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self._connect().execute(
+                "SELECT * FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    async def insert(self, job: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._insert, job)
+
+    async def update(self, job_id: str, **fields: Any) -> None:
+        await asyncio.to_thread(self._update, job_id, fields)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def unfinished(self) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self._unfinished)
+
+    async def close(self) -> None:
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+class BackgroundJobService:
+    """Runs long /video and /music generations outside the update handlers"""
+
+    def __init__(self, fal_service, replicate_service, user_service, store: Optional[SQLiteJobStore] = None):
+        self.generators = {
+            "video": fal_service.generate_video,
+            "music": replicate_service.generate_music
+        }
+        self.user_service = user_service
+        self.quota = QuotaEngine(user_service)
+        self.store = store or SQLiteJobStore(settings.jobs_db_path)
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.workers: List[asyncio.Task] = []
+        self.bot: Optional[Bot] = None
+        # Lease owner id, so only one process runs a job when several share the store
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.queue_depth = metrics.gauge("background_jobs_queued", "Background jobs waiting for a worker")
+
+    async def start(self, bot: Bot) -> None:
+        """Resume unfinished jobs from the store and start the workers"""
+        self.bot = bot
+
+        for job in await self.store.unfinished():
+            logger.info(f"Resuming {job['kind']} job {job['id']} for user {job['user_id']}")
+            self.queue.put_nowait(job)
+        self.queue_depth.set(self.queue.qsize())
+
+        for index in range(settings.background_job_workers):
+            self.workers.append(asyncio.create_task(self._worker(f"{self.owner}:{index}")))
+
+    async def close(self) -> None:
+        """Stop the workers, unfinished jobs stay in the store for the next start"""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+        await self.store.close()
+
+    async def enqueue(self, user, chat_id: int, status_message_id: Optional[int], kind: str, prompt: str) -> str:
+        """Persist and queue a job whose quota the caller already reserved; returns the job id"""
+        # Persist the reservation before the job so a restart can't lose either
+        await self.user_service.flush()
+
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "user_id": user.telegram_id,
+            "chat_id": chat_id,
+            "status_message_id": status_message_id,
+            "kind": kind,
+            "prompt": prompt,
+            "plan": user.plan.value,
+            "status": "queued",
+            "charged": 1,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now
+        }
+        await self.store.insert(job)
+        self.queue.put_nowait(job)
+        self.queue_depth.set(self.queue.qsize())
+        return job["id"]
+
+    async def _worker(self, owner: str) -> None:
+        # Workers are only cancelled at shutdown and their jobs resume on the next start
+        keep_predictions_on_cancel.set(True)
+        # Leases are held per worker, two workers of one process must not share a claim
+        while True:
+            job = await self.queue.get()
+            self.queue_depth.set(self.queue.qsize())
+            lease = f"job:{job['id']}"
+            try:
+                if not await self.user_service.state.claim(lease, owner, settings.background_job_lease_seconds):
+                    logger.info(f"Job {job['id']} is being run by another worker")
+                    continue
+                # Every process queues the unfinished rows at startup and the lease is dropped once a
+                # job finishes, so the store decides whether this copy still needs running
+                stored = await self.store.get(job["id"])
+                if stored is None or stored["status"] not in ("queued", "running"):
+                    logger.info(f"Job {job['id']} already finished")
+                    continue
+                job = stored
+                with metric_labels(plan=job["plan"]):
+                    await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except QueueFullError:
+                # Scheduler is saturated, put the job back without spending an attempt
+                job["attempts"] -= 1
+                await self.store.update(job["id"], status="queued", attempts=job["attempts"])
+                await asyncio.sleep(settings.background_job_retry_delay)
+                self.queue.put_nowait(job)
+                self.queue_depth.set(self.queue.qsize())
+            except Exception as e:
+                logger.error(f"Error running background job {job['id']}: {e}")
+                await self._fail(job, str(e))
+            finally:
+                self.queue.task_done()
+                try:
+                    await self.user_service.state.release(lease, owner)
+                except Exception as e:
+                    logger.warning(f"Error releasing lease for job {job['id']}: {e}")
+
+    async def _edit_status(self, job: Dict[str, Any], text: str) -> None:
+        if not job.get("status_message_id"):
+            return
+        try:
+            await self.bot.edit_message_text(
+                text,
+                chat_id=job["chat_id"],
+                message_id=job["status_message_id"],
+                parse_mode='Markdown'
+            )
+        except Exception as e:
+            logger.debug(f"Could not update status message for job {job['id']}: {e}")
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        kind = JOB_KINDS[job["kind"]]
+        attempts = job["attempts"] + 1
+        if attempts > settings.background_job_max_attempts:
+            await self._fail(job, "Too many attempts")
+            return
+
+        job["attempts"] = attempts
+        await self.store.update(job["id"], status="running", attempts=attempts)
+
+        async def on_queued(position: int):
+            await self._edit_status(job, get_queue_message(job["kind"], position))
+
+        async with job_scheduler.slot(kind["provider"], UserPlan(job["plan"]), on_queued):
+            result = await self.generators[job["kind"]](job["prompt"], model=kind["model"])
+
+        if not result["success"]:
+            await self._fail(job, result.get("error", "Unknown error"))
+            return
+
+        send_func = getattr(self.bot, f"send_{kind['media']}")
+        await media_registry.send(
+            functools.partial(send_func, chat_id=job["chat_id"]),
+            kind["media"],
+            result["url"],
+            caption=get_content_ready_message(job["kind"], job["prompt"], result["cost"], kind["model_name"]),
+            parse_mode='Markdown'
+        )
+        await self.store.update(job["id"], status="done", result=json.dumps(result))
+        await self.quota.commit(
+            QuotaReservation(job["user_id"], kind["usage_field"], plan=job["plan"]),
+            provider=kind["provider"],
+            model=kind["model"],
+            cost=result.get("cost", 0.0)
+        )
+
+        if job.get("status_message_id"):
+            try:
+                await self.bot.delete_message(chat_id=job["chat_id"], message_id=job["status_message_id"])
+            except Exception as e:
+                logger.debug(f"Could not delete status message for job {job['id']}: {e}")
+
+    async def _fail(self, job: Dict[str, Any], error: str) -> None:
+        """Mark a job failed, refund the charged quota and tell the user"""
+        logger.error(f"Background job {job['id']} failed: {error}")
+
+        if job["charged"]:
+            await self.quota.refund(QuotaReservation(job["user_id"], JOB_KINDS[job["kind"]]["usage_field"]))
+            await self.user_service.flush()
+            job["charged"] = 0
+
+        await self.store.update(job["id"], status="failed", charged=0, error=error)
+        await self._edit_status(job, get_error_message("job_failed"))
+
+    def stats(self) -> Dict[str, int]:
+        """Queue and worker counts"""
+        return {
+            "queued": self.queue.qsize(),
+            "workers": len(self.workers)
+        }
@@ -0,0 +1,341 @@
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set
+from telegram import Bot
+from telegram.error import Forbidden, RetryAfter
+from config.settings import settings
+from services.metrics import metrics
+from services.send_scheduler import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+class BroadcastStore:
+    """Broadcast records and their checkpoints, so a restart resumes where sending stopped"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    parse_mode TEXT,
+                    status TEXT NOT NULL,
+                    cursor INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    sent INTEGER NOT NULL DEFAULT 0,
+                    blocked INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    finished_at REAL
+                )
+            """)
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def _insert(self, broadcast: Dict[str, Any]) -> None:
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    f"INSERT INTO broadcasts ({', '.join(broadcast)}) VALUES ({', '.join('?' for _ in broadcast)})",
+                    tuple(broadcast.values())
+                )
+
+    def _update(self, broadcast_id: str, fields: Dict[str, Any]) -> None:
+        fields = {**fields, "updated_at": time.time()}
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    f"UPDATE broadcasts SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+                    (*fields.values(), broadcast_id)
+                )
+
+    def _get(self, broadcast_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self._connect().execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+        return dict(row) if row else None
+
+    def _list(self, status: Optional[str]) -> List[Dict[str, Any]]:
+        with self.lock:
+            if status:
+                rows = self._connect().execute("SELECT * FROM broadcasts WHERE status = ? ORDER BY created_at", (status,)).fetchall()
+            else:
+                rows = self._connect().execute("SELECT * FROM broadcasts ORDER BY created_at").fetchall()
+        return [dict(row) for row in rows]
+
+    async def insert(self, broadcast: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._insert, broadcast)
+
+    async def update(self, broadcast_id: str, **fields: Any) -> None:
+        await asyncio.to_thread(self._update, broadcast_id, fields)
+
+    async def get(self, broadcast_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get, broadcast_id)
+
+    async def list(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self._list, status)
+
+    async def close(self) -> None:
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+class _BroadcastRun:
+    """Progress of a broadcast being sent by this process"""
+
+    def __init__(self, broadcast: Dict[str, Any]):
+        self.broadcast = broadcast
+        self.counts = {outcome: broadcast[outcome] for outcome in ("sent", "blocked", "failed")}
+        # Recipients handed to workers and not finished yet; every id below the smallest is done
+        self.outstanding: Set[int] = set()
+        self.last_dispatched = broadcast["cursor"]
+        self.blocked_ids: List[int] = []
+        self.started_at = time.monotonic()
+        self.processed = 0
+
+    def cursor(self) -> int:
+        """Highest telegram_id with every recipient up to it handled"""
+        return min(self.outstanding) - 1 if self.outstanding else self.last_dispatched
+
+    def progress(self) -> Dict[str, Any]:
+        """Counters plus throughput and ETA of this run"""
+        elapsed = time.monotonic() - self.started_at
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        done = sum(self.counts.values())
+        remaining = max(self.broadcast["total"] - done, 0)
+        return {
+            **self.counts,
+            "total": self.broadcast["total"],
+            "cursor": self.cursor(),
+            "messages_per_second": round(rate, 2),
+            "eta_seconds": round(remaining / rate) if rate > 0 else None
+        }
+
+class BroadcastEngine:
+    """Sends one message to every reachable user at a steady rate, checkpointing as it goes"""
+
+    def __init__(self, user_service, store: Optional[BroadcastStore] = None):
+        self.user_service = user_service
+        self.store = store or BroadcastStore(settings.broadcast_db_path)
+        self.bot: Optional[Bot] = None
+        self.runs: Dict[str, _BroadcastRun] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.messages = metrics.counter("broadcast_messages_total", "Broadcast deliveries by outcome", ("outcome",))
+
+    async def start(self, bot: Bot, resume: bool = True) -> None:
+        """Resume broadcasts that were running before the last shutdown"""
+        self.bot = bot
+        if not resume:
+            return
+        for broadcast in await self.store.list("running"):
+            logger.info(f"Resuming broadcast {broadcast['id']} after telegram_id {broadcast['cursor']}")
+            self._launch(broadcast)
+
+    async def close(self) -> None:
+        """Stop sending; running broadcasts keep their status and resume on the next start"""
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks.clear()
+        await self.store.close()
+
+    async def create(self, text: str, parse_mode: Optional[str] = None) -> Dict[str, Any]:
+        """Record a broadcast to every reachable user and start sending it"""
+        # Users created since the last write-behind flush must be in the store to be paged
+        await self.user_service.flush()
+        now = time.time()
+        broadcast = {
+            "id": uuid.uuid4().hex,
+            "text": text,
+            "parse_mode": parse_mode,
+            "status": "running",
+            "total": await self.user_service.store.count_reachable(),
+            "created_at": now,
+            "updated_at": now
+        }
+        await self.store.insert(broadcast)
+        broadcast = await self.store.get(broadcast["id"])
+        logger.info(f"Broadcast {broadcast['id']} created for {broadcast['total']} users")
+        self._launch(broadcast)
+        return broadcast
+
+    async def pause(self, broadcast_id: str) -> bool:
+        """Stop a running broadcast at its next checkpoint, whichever process is sending it"""
+        return await self._set_status(broadcast_id, "paused", ("running",))
+
+    async def cancel(self, broadcast_id: str) -> bool:
+        """Stop a broadcast for good"""
+        return await self._set_status(broadcast_id, "cancelled", ("running", "paused"))
+
+    async def resume(self, broadcast_id: str) -> bool:
+        """Continue a paused or interrupted broadcast from its checkpoint"""
+        if not await self._set_status(broadcast_id, "running", ("paused", "running")):
+            return False
+        self._launch(await self.store.get(broadcast_id))
+        return True
+
+    async def _set_status(self, broadcast_id: str, status: str, allowed: tuple) -> bool:
+        broadcast = await self.store.get(broadcast_id)
+        if not broadcast or broadcast["status"] not in allowed:
+            return False
+        await self.store.update(broadcast_id, status=status)
+        return True
+
+    async def status(self, broadcast_id: str) -> Optional[Dict[str, Any]]:
+        """Stored record, with live throughput and ETA when this process is sending it"""
+        broadcast = await self.store.get(broadcast_id)
+        if broadcast and broadcast_id in self.runs:
+            broadcast.update(self.runs[broadcast_id].progress())
+        return broadcast
+
+    def _launch(self, broadcast: Dict[str, Any]) -> None:
+        if self.bot is None:
+            raise RuntimeError("BroadcastEngine.start() must be called before sending")
+        if broadcast["id"] in self.tasks:
+            return
+        task = asyncio.create_task(self._run(broadcast))
+        self.tasks[broadcast["id"]] = task
+        task.add_done_callback(lambda _: self.tasks.pop(broadcast["id"], None))
+
+    async def wait(self, broadcast_id: str) -> None:
+        """Block until this process stops sending a broadcast"""
+        task = self.tasks.get(broadcast_id)
+        if task:
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self, broadcast: Dict[str, Any]) -> None:
+        lease = f"broadcast:{broadcast['id']}"
+        if not await self.user_service.state.claim(lease, self.owner, settings.broadcast_lease_seconds):
+            logger.info(f"Broadcast {broadcast['id']} is being sent by another process")
+            return
+
+        run = self.runs[broadcast["id"]] = _BroadcastRun(broadcast)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=settings.broadcast_workers * 2)
+        bucket = TokenBucket(settings.broadcast_rate, settings.broadcast_rate)
+        workers = [asyncio.create_task(self._worker(run, queue, bucket)) for _ in range(settings.broadcast_workers)]
+        checkpointer = asyncio.create_task(self._checkpoint_loop(run, lease))
+        try:
+            after = broadcast["cursor"]
+            while True:
+                page = await self.user_service.store.reachable_ids(after, settings.broadcast_page_size)
+                if not page:
+                    break
+                for telegram_id in page:
+                    if checkpointer.done():
+                        # Paused, cancelled or the lease was lost
+                        return
+                    run.outstanding.add(telegram_id)
+                    run.last_dispatched = telegram_id
+                    await queue.put(telegram_id)
+                after = page[-1]
+
+            await queue.join()
+            await self._checkpoint(run)
+            await self.store.update(broadcast["id"], status="completed", finished_at=time.time())
+            progress = run.progress()
+            logger.info(
+                f"Broadcast {broadcast['id']} completed: {progress['sent']} sent, {progress['blocked']} blocked, "
+                f"{progress['failed']} failed at {progress['messages_per_second']} msg/s"
+            )
+        finally:
+            checkpointer.cancel()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(checkpointer, *workers, return_exceptions=True)
+            # Only ids below every unfinished send are saved, the rest are sent again on resume
+            await asyncio.shield(self._checkpoint(run))
+            self.runs.pop(broadcast["id"], None)
+            await self.user_service.state.release(lease, self.owner)
+
+    async def _worker(self, run: _BroadcastRun, queue: asyncio.Queue, bucket: TokenBucket) -> None:
+        while True:
+            telegram_id = await queue.get()
+            try:
+                # Paced below the global Bot API limit so replies to users still get through
+                wait = bucket.reserve(time.monotonic())
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                outcome = await self._deliver(run.broadcast, telegram_id)
+                run.counts[outcome] += 1
+                run.processed += 1
+                if outcome == "blocked":
+                    run.blocked_ids.append(telegram_id)
+                self.messages.inc(outcome=outcome)
+                run.outstanding.discard(telegram_id)
+            finally:
+                queue.task_done()
+
+    async def _deliver(self, broadcast: Dict[str, Any], telegram_id: int) -> str:
+        """Send to one user, returns the outcome counter to bump"""
+        try:
+            await self.bot.send_message(chat_id=telegram_id, text=broadcast["text"], parse_mode=broadcast["parse_mode"])
+            return "sent"
+        except Forbidden:
+            # Blocked the bot or deleted their account
+            return "blocked"
+        except RetryAfter as e:
+            # The scheduler already waited out its retries, don't stall the whole broadcast on one user
+            logger.warning(f"Broadcast {broadcast['id']} gave up on {telegram_id} after flood waits: {e}")
+            return "failed"
+        except Exception as e:
+            logger.warning(f"Broadcast {broadcast['id']} could not reach {telegram_id}: {e}")
+            return "failed"
+
+    async def _checkpoint(self, run: _BroadcastRun) -> None:
+        """Persist the cursor and counters, and prune users who blocked the bot"""
+        blocked_ids, run.blocked_ids = run.blocked_ids, []
+        try:
+            await self.user_service.mark_blocked(blocked_ids)
+        except Exception as e:
+            run.blocked_ids.extend(blocked_ids)
+            logger.error(f"Error pruning {len(blocked_ids)} blocked users: {e}")
+        await self.store.update(run.broadcast["id"], cursor=run.cursor(), **run.counts)
+
+    async def _checkpoint_loop(self, run: _BroadcastRun, lease: str) -> None:
+        """Checkpoint periodically; returns when the broadcast should stop sending"""
+        broadcast_id = run.broadcast["id"]
+        while True:
+            await asyncio.sleep(settings.broadcast_checkpoint_interval)
+            try:
+                await self._checkpoint(run)
+            except Exception as e:
+                # Sending goes on, the next checkpoint covers this one
+                logger.error(f"Error checkpointing broadcast {broadcast_id}: {e}")
+                continue
+
+            progress = run.progress()
+            eta = f"{progress['eta_seconds'] // 60}m{progress['eta_seconds'] % 60:02d}s" if progress["eta_seconds"] is not None else "unknown"
+            logger.info(
+                f"Broadcast {broadcast_id}: {sum(run.counts.values())}/{progress['total']} done, "
+                f"{progress['messages_per_second']} msg/s, ETA {eta}"
+            )
+
+            stored = await self.store.get(broadcast_id)
+            if stored["status"] != "running":
+                logger.info(f"Broadcast {broadcast_id} {stored['status']}, stopping")
+                return
+            if not await self.user_service.state.claim(lease, self.owner, settings.broadcast_lease_seconds):
+                logger.warning(f"Lost the lease on broadcast {broadcast_id}, stopping")
+                return
@@ -0,0 +1,203 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+from collections import OrderedDict, deque
+from dataclasses import dataclass, asdict
+from typing import Awaitable, Callable, Dict, List, Optional
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=None)
+def _encoding():
+    """tiktoken's cl100k_base, loaded on first count since reading (or downloading) it is slow"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+# Context window per model family, the reply budget is taken out of it
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4": 8192,
+    "claude": 200000
+}
+REPLY_TOKENS = 1000
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when installed, otherwise estimate ~4 chars per token"""
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text) // 4 + 1
+
+@dataclass
+class ConversationTurn:
+    role: str
+    content: str
+    tokens: int
+
+class Conversation:
+    """Bounded ring buffer of turns with a running token total"""
+
+    def __init__(self, max_turns: int):
+        self.turns = deque(maxlen=max_turns)
+        self.total_tokens = 0
+        self.summary = ""
+        self.summary_tokens = 0
+        # Turns pushed out of the buffer, waiting to be folded into the summary
+        self.evicted: List[ConversationTurn] = []
+        self.evicted_tokens = 0
+
+    def append(self, turn: ConversationTurn) -> Optional[ConversationTurn]:
+        """Add a turn, returning the evicted oldest turn if the buffer was full"""
+        evicted = None
+        if len(self.turns) == self.turns.maxlen:
+            evicted = self.turns[0]
+            self.total_tokens -= evicted.tokens
+        self.turns.append(turn)
+        self.total_tokens += turn.tokens
+        return evicted
+
+    def to_dict(self) -> Dict:
+        return {
+            "turns": [asdict(turn) for turn in self.turns],
+            "summary": self.summary
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, max_turns: int) -> "Conversation":
+        conversation = cls(max_turns)
+        for turn in data.get("turns", []):
+            conversation.append(ConversationTurn(**turn))
+        conversation.summary = data.get("summary", "")
+        conversation.summary_tokens = count_tokens(conversation.summary) if conversation.summary else 0
+        return conversation
+
+class ConversationService:
+    """Per-user conversation memory with token-budgeted context windows"""
+
+    def __init__(
+        self,
+        summarizer: Optional[Callable[[str, List[ConversationTurn]], Awaitable[str]]] = None
+    ):
+        self.max_turns = settings.conversation_max_turns
+        self.max_users = settings.conversation_max_users_in_memory
+        self.spill_dir = settings.conversation_spill_dir
+        self.summarizer = summarizer
+
+        # Most recently used conversations last
+        self.conversations: "OrderedDict[int, Conversation]" = OrderedDict()
+
+    def _spill_path(self, user_id: int) -> str:
+        return os.path.join(self.spill_dir, f"{user_id}.json")
+
+    def _write_spill(self, user_id: int, data: Dict) -> None:
+        os.makedirs(self.spill_dir, exist_ok=True)
+        with open(self._spill_path(user_id), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    def _read_spill(self, user_id: int) -> Optional[Dict]:
+        path = self._spill_path(user_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    async def _get_conversation(self, user_id: int) -> Conversation:
+        """Get a user's conversation, reloading it from disk if it was spilled"""
+        conversation = self.conversations.get(user_id)
+        if conversation is not None:
+            self.conversations.move_to_end(user_id)
+            return conversation
+
+        data = None
+        if self.spill_dir:
+            try:
+                data = await asyncio.to_thread(self._read_spill, user_id)
+            except Exception as e:
+                logger.warning(f"Error loading spilled conversation for {user_id}: {e}")
+
+        conversation = Conversation.from_dict(data, self.max_turns) if data else Conversation(self.max_turns)
+        self.conversations[user_id] = conversation
+
+        # Keep memory bounded, idle conversations go to disk (or are dropped)
+        while len(self.conversations) > self.max_users:
+            idle_user_id, idle_conversation = self.conversations.popitem(last=False)
+            if self.spill_dir:
+                try:
+                    await asyncio.to_thread(self._write_spill, idle_user_id, idle_conversation.to_dict())
+                except Exception as e:
+                    logger.warning(f"Error spilling conversation for {idle_user_id}: {e}")
+
+        return conversation
+
+    async def add_turn(self, user_id: int, role: str, content: str) -> None:
+        """Append a message to the user's conversation"""
+        conversation = await self._get_conversation(user_id)
+        evicted = conversation.append(ConversationTurn(role=role, content=content, tokens=count_tokens(content)))
+
+        if evicted and self.summarizer:
+            conversation.evicted.append(evicted)
+            conversation.evicted_tokens += evicted.tokens
+            if conversation.evicted_tokens >= settings.conversation_summary_trigger_tokens:
+                turns = conversation.evicted
+                conversation.evicted = []
+                conversation.evicted_tokens = 0
+                asyncio.create_task(self._summarize(conversation, turns))
+
+    async def _summarize(self, conversation: Conversation, turns: List[ConversationTurn]) -> None:
+        """Fold evicted turns into the rolling summary"""
+        try:
+            summary = await self.summarizer(conversation.summary, turns)
+            if summary:
+                conversation.summary = summary
+                conversation.summary_tokens = count_tokens(summary)
+        except Exception as e:
+            logger.warning(f"Error summarising conversation: {e}")
+
+    def context_budget(self, model: str, message: str) -> int:
+        """Tokens available for history given the model window and the new message"""
+        window = next(
+            (size for prefix, size in MODEL_CONTEXT_WINDOWS.items() if model.startswith(prefix)),
+            8192
+        )
+        available = window - REPLY_TOKENS - count_tokens(message)
+        return max(0, min(settings.conversation_context_tokens, available))
+
+    async def build_context(self, user_id: int, model: str, message: str) -> List[Dict[str, str]]:
+        """Most recent history (plus summary) that fits the model's token budget, oldest first"""
+        conversation = await self._get_conversation(user_id)
+        budget = self.context_budget(model, message)
+
+        context = []
+        used = 0
+        if conversation.total_tokens <= budget:
+            # Fast path, everything fits
+            context = [{"role": turn.role, "content": turn.content} for turn in conversation.turns]
+            used = conversation.total_tokens
+        else:
+            # Walk back from the newest turn only as far as the budget allows
+            for turn in reversed(conversation.turns):
+                if used + turn.tokens > budget:
+                    break
+                context.append({"role": turn.role, "content": turn.content})
+                used += turn.tokens
+            context.reverse()
+
+        if conversation.summary and used + conversation.summary_tokens <= budget:
+            context.insert(0, {"role": "system", "content": f"Resumo da conversa anterior: {conversation.summary}"})
+
+        return context
+
+    async def clear(self, user_id: int) -> None:
+        """Forget a user's conversation"""
+        self.conversations.pop(user_id, None)
+        if self.spill_dir:
+            try:
+                await asyncio.to_thread(os.remove, self._spill_path(user_id))
+            except FileNotFoundError:
+                pass
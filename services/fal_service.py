@@ -1,12 +1,18 @@
 import logging
-import httpx
-from typing import Optional, Dict, Any
+from typing import Dict, Any
 from config.settings import settings
+from services.generation_cache import generation_cache
+from services.instrumentation import instrument_provider
+from services.providers import Capability, Provider
 
 logger = logging.getLogger(__name__)
 
-class FalService:
+class FalService(Provider):
+    name = "fal"
+    capabilities = frozenset({Capability.IMAGE, Capability.VIDEO, Capability.LORA})
+
     def __init__(self):
+        super().__init__()
         self.api_key = settings.fal_api_key
         self.base_url = "https://fal.run"
         self.headers = {
@@ -14,6 +20,11 @@ class FalService:
             "Content-Type": "application/json"
         }
 
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    @instrument_provider("fal")
     async def generate_image(
         self,
         prompt: str,
@@ -24,36 +35,46 @@ class FalService:
     ) -> Dict[str, Any]:
         """Generate image using Fal.ai FLUX models"""
         
+        # Identical prompts are answered from the cache without a paid call
+        if settings.generation_cache_enabled:
+            cached = await generation_cache.get(model, prompt, image_size)
+            if cached:
+                return {**cached, "success": True, "cached": True, "cost": 0.0, "model": model}
+        
         try:
-            async with httpx.AsyncClient() as client:
-                payload = {
-                    "prompt": prompt,
-                    "image_size": image_size,
-                    "num_inference_steps": num_inference_steps,
-                    "guidance_scale": guidance_scale
+            payload = {
+                "prompt": prompt,
+                "image_size": image_size,
+                "num_inference_steps": num_inference_steps,
+                "guidance_scale": guidance_scale
+            }
+            
+            response = await self.request("POST", f"{self.base_url}/{model}", json=payload, timeout=60.0)
+            
+            if response.status_code == 200:
+                result = response.json()
+                generated = {
+                    "url": result["images"][0]["url"],
+                    "cost": self._calculate_image_cost(image_size, model)
                 }
                 
-                response = await client.post(
-                    f"{self.base_url}/{model}",
-                    headers=self.headers,
-                    json=payload,
-                    timeout=60.0
-                )
+                cache_key = None
+                if settings.generation_cache_enabled:
+                    cache_key = await generation_cache.put(model, prompt, image_size, generated)
+                
+                return {
+                    "success": True,
+                    **generated,
+                    "model": model,
+                    "cache_key": cache_key
+                }
+            else:
+                logger.error(f"Fal.ai API error: {response.status_code} - {response.text}")
+                return {
+                    "success": False,
+                    "error": f"API error: {response.status_code}"
+                }
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    return {
-                        "success": True,
-                        "image_url": result["images"][0]["url"],
-                        "cost": self._calculate_image_cost(image_size, model)
-                    }
-                else:
-                    logger.error(f"Fal.ai API error: {response.status_code} - {response.text}")
-                    return {
-                        "success": False,
-                        "error": f"API error: {response.status_code}"
-                    }
-                    
         except Exception as e:
             logger.error(f"Error generating image with Fal.ai: {e}")
             return {
@@ -61,6 +82,7 @@ class FalService:
                 "error": str(e)
             }
 
+    @instrument_provider("fal")
     async def generate_video(
         self,
         prompt: str,
@@ -70,33 +92,27 @@ class FalService:
         """Generate video using Fal.ai video models"""
         
         try:
-            async with httpx.AsyncClient() as client:
-                payload = {
-                    "prompt": prompt,
-                    "duration": duration
+            payload = {
+                "prompt": prompt,
+                "duration": duration
+            }
+            
+            response = await self.request("POST", f"{self.base_url}/{model}", json=payload, timeout=120.0)
+            
+            if response.status_code == 200:
+                result = response.json()
+                return {
+                    "success": True,
+                    "url": result["video"]["url"],
+                    "cost": self._calculate_video_cost(duration, model)
+                }
+            else:
+                logger.error(f"Fal.ai video API error: {response.status_code} - {response.text}")
+                return {
+                    "success": False,
+                    "error": f"API error: {response.status_code}"
                 }
                 
-                response = await client.post(
-                    f"{self.base_url}/{model}",
-                    headers=self.headers,
-                    json=payload,
-                    timeout=120.0
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return {
-                        "success": True,
-                        "video_url": result["video"]["url"],
-                        "cost": self._calculate_video_cost(duration, model)
-                    }
-                else:
-                    logger.error(f"Fal.ai video API error: {response.status_code} - {response.text}")
-                    return {
-                        "success": False,
-                        "error": f"API error: {response.status_code}"
-                    }
-                    
         except Exception as e:
             logger.error(f"Error generating video with Fal.ai: {e}")
             return {
@@ -104,6 +120,7 @@ class FalService:
                 "error": str(e)
             }
 
+    @instrument_provider("fal")
     async def train_lora(
         self,
         images_url: str,
@@ -113,34 +130,28 @@ class FalService:
         """Train a LoRA model using Fal.ai"""
         
         try:
-            async with httpx.AsyncClient() as client:
-                payload = {
-                    "images_data_url": images_url,
-                    "trigger_word": trigger_word,
-                    "steps": 1000
+            payload = {
+                "images_data_url": images_url,
+                "trigger_word": trigger_word,
+                "steps": 1000
+            }
+            
+            response = await self.request("POST", f"{self.base_url}/{model}", json=payload, timeout=300.0)
+            
+            if response.status_code == 200:
+                result = response.json()
+                return {
+                    "success": True,
+                    "url": result["diffusers_lora_file"]["url"],
+                    "cost": 2.0  # Fixed cost for LoRA training
+                }
+            else:
+                logger.error(f"Fal.ai LoRA training error: {response.status_code} - {response.text}")
+                return {
+                    "success": False,
+                    "error": f"API error: {response.status_code}"
                 }
                 
-                response = await client.post(
-                    f"{self.base_url}/{model}",
-                    headers=self.headers,
-                    json=payload,
-                    timeout=300.0
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return {
-                        "success": True,
-                        "lora_url": result["diffusers_lora_file"]["url"],
-                        "cost": 2.0  # Fixed cost for LoRA training
-                    }
-                else:
-                    logger.error(f"Fal.ai LoRA training error: {response.status_code} - {response.text}")
-                    return {
-                        "success": False,
-                        "error": f"API error: {response.status_code}"
-                    }
-                    
         except Exception as e:
             logger.error(f"Error training LoRA with Fal.ai: {e}")
             return {
@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from config.settings import settings
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s.!?,;:]+$")
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalise a prompt so trivially different spellings share a cache entry"""
+    prompt = unicodedata.normalize("NFKC", prompt).casefold()
+    prompt = _WHITESPACE.sub(" ", prompt).strip()
+    return _TRAILING_PUNCTUATION.sub("", prompt)
+
+def make_cache_key(model: str, prompt: str, image_size: str) -> str:
+    """Content-addressed key for a (model, normalised prompt, size) triple"""
+    raw = f"{model}\0{image_size}\0{normalize_prompt(prompt)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class GenerationCache:
+    """LRU + TTL cache of generation results with an optional SQLite tier"""
+
+    def __init__(self, max_entries: int, ttl: float, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+        self.lookups = metrics.counter("generation_cache_lookups_total", "Generation cache lookups by outcome", ("outcome",))
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS generation_cache (
+                    key TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT expires_at, data FROM generation_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if not row or row[0] < time.time():
+            return None
+        return row[0], json.loads(row[1])
+
+    def _disk_put(self, key: str, expires_at: float, entry: Dict[str, Any]) -> None:
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO generation_cache (key, data, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(entry), expires_at)
+                )
+
+    def _remember(self, key: str, expires_at: float, entry: Dict[str, Any]) -> None:
+        self.entries[key] = (expires_at, entry)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get(self, model: str, prompt: str, image_size: str) -> Optional[Dict[str, Any]]:
+        """Look up a cached result, returns a copy including its cache_key"""
+        key = make_cache_key(model, prompt, image_size)
+        cached = self.entries.get(key)
+
+        if cached is not None and cached[0] < time.time():
+            del self.entries[key]
+            cached = None
+
+        if cached is None and self.db_path:
+            try:
+                cached = await asyncio.to_thread(self._disk_get, key)
+            except Exception as e:
+                logger.warning(f"Error reading generation cache from disk: {e}")
+            if cached is not None:
+                self._remember(key, *cached)
+
+        if cached is None:
+            self.lookups.inc(outcome="miss")
+            return None
+
+        self.entries.move_to_end(key)
+        self.lookups.inc(outcome="hit")
+        return {**cached[1], "cache_key": key}
+
+    async def put(self, model: str, prompt: str, image_size: str, entry: Dict[str, Any]) -> str:
+        """Store a result and return its cache key"""
+        key = make_cache_key(model, prompt, image_size)
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, dict(entry))
+
+        if self.db_path:
+            try:
+                await asyncio.to_thread(self._disk_put, key, expires_at, dict(entry))
+            except Exception as e:
+                logger.warning(f"Error writing generation cache to disk: {e}")
+
+        return key
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters"""
+        hits = int(self.lookups.get(outcome="hit"))
+        misses = int(self.lookups.get(outcome="miss"))
+        total = hits + misses
+        return {
+            "entries": len(self.entries),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0
+        }
+
+# Global image result cache
+generation_cache = GenerationCache(
+    max_entries=settings.generation_cache_max_entries,
+    ttl=settings.generation_cache_ttl,
+    db_path=settings.generation_cache_db_path
+)
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+from config.settings import settings
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class HedgeCandidate:
+    """One provider call that can take part in a hedged request"""
+    provider: str
+    call: Callable[[], Awaitable[Dict[str, Any]]]
+    estimated_cost: float = 0.0
+
+class LatencyTracker:
+    """Rolling window of successful call latencies per provider"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self.samples: Dict[str, Deque[float]] = {}
+
+    def observe(self, provider: str, seconds: float) -> None:
+        """Record a successful call's latency"""
+        self.samples.setdefault(provider, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, provider: str, q: float) -> Optional[float]:
+        """Observed latency percentile, None until enough samples were collected"""
+        samples = self.samples.get(provider)
+        if not samples or len(samples) < settings.image_hedge_min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class HedgedRequester:
+    """Fires a backup provider when the primary is slower than its usual tail latency"""
+
+    def __init__(self, tracker: LatencyTracker):
+        self.tracker = tracker
+        self.recent: Deque[bool] = deque(maxlen=settings.image_hedge_window)
+
+        self.requests = metrics.counter("hedged_requests_total", "Requests run through the hedger", ("primary",))
+        self.hedges = metrics.counter("hedged_requests_hedged_total", "Requests where the backup provider was fired", ("primary",))
+        self.wins = metrics.counter("hedged_requests_wins_total", "Which provider answered hedged requests", ("provider",))
+        self.extra_cost = metrics.counter("hedged_requests_extra_cost_usd", "Estimated spend on losing hedge calls", ("provider",))
+        self.latency = metrics.histogram("hedged_request_duration_seconds", "End-to-end latency of hedged requests", ("primary",))
+
+    def hedge_delay(self, provider: str) -> float:
+        """How long to wait for the primary before firing the backup"""
+        observed = self.tracker.percentile(provider, settings.image_hedge_percentile)
+        if observed is None:
+            return settings.image_hedge_default_delay
+        return min(max(observed, settings.image_hedge_min_delay), settings.image_hedge_max_delay)
+
+    def hedge_rate(self) -> float:
+        """Share of recent requests that fired the backup provider"""
+        return sum(self.recent) / len(self.recent) if self.recent else 0.0
+
+    async def _timed(self, candidate: HedgeCandidate) -> Dict[str, Any]:
+        start = time.monotonic()
+        result = await candidate.call()
+        if result.get("success") and not result.get("cached"):
+            self.tracker.observe(candidate.provider, time.monotonic() - start)
+        return result
+
+    async def run(
+        self,
+        primary: HedgeCandidate,
+        secondary: Optional[HedgeCandidate] = None,
+        on_fallback: Optional[Callable[[], Awaitable[None]]] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Run primary, hedging or falling back to secondary; returns (provider, result)"""
+        start = time.monotonic()
+        self.requests.inc(primary=primary.provider)
+        try:
+            return await self._run(primary, secondary, on_fallback)
+        finally:
+            self.latency.observe(time.monotonic() - start, primary=primary.provider)
+
+    async def _run(self, primary, secondary, on_fallback) -> Tuple[str, Dict[str, Any]]:
+        if secondary is None:
+            result = await self._timed(primary)
+            if result.get("success"):
+                self.wins.inc(provider=primary.provider)
+            return primary.provider, result
+        
+        primary_task = asyncio.create_task(self._timed(primary))
+        # Stay under the hedge budget so tail latency drops without doubling spend
+        can_hedge = settings.image_hedging_enabled and self.hedge_rate() < settings.image_hedge_max_rate
+
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=self.hedge_delay(primary.provider) if can_hedge else None)
+        except asyncio.CancelledError:
+            primary_task.cancel()
+            raise
+
+        if done:
+            self.recent.append(False)
+            result = primary_task.result()
+            if result.get("success"):
+                self.wins.inc(provider=primary.provider)
+                return primary.provider, result
+
+            # Primary failed outright, plain sequential fallback
+            if on_fallback:
+                await on_fallback()
+            result = await self._timed(secondary)
+            if result.get("success"):
+                self.wins.inc(provider=secondary.provider)
+            return secondary.provider, result
+
+        # Primary is slower than usual, race it against the backup
+        self.recent.append(True)
+        self.hedges.inc(primary=primary.provider)
+        logger.info(f"Hedging slow {primary.provider} request with {secondary.provider}")
+
+        secondary_task = asyncio.create_task(self._timed(secondary))
+        tasks = {primary_task: primary, secondary_task: secondary}
+        pending = set(tasks)
+        result: Dict[str, Any] = {"success": False, "error": "All providers failed"}
+        winner = secondary
+        answered = False
+        error: Optional[BaseException] = None
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Both attempts can finish together, look at every one before giving up
+                for task in done:
+                    try:
+                        outcome = task.result()
+                    except Exception as e:
+                        # The other provider may still answer
+                        logger.warning(f"Hedged {tasks[task].provider} request failed: {e}")
+                        error = e
+                        continue
+                    if not result.get("success"):
+                        winner, result, answered = tasks[task], outcome, True
+                if result.get("success"):
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+                loser = tasks[task]
+                # Assume the loser is billed in full, cancelled providers may charge partially
+                self.extra_cost.inc(loser.estimated_cost, provider=loser.provider)
+
+        if not answered and error is not None:
+            raise error
+        if result.get("success"):
+            self.wins.inc(provider=winner.provider)
+        return winner.provider, result
+
+    def stats(self) -> Dict[str, Any]:
+        """Hedge rate and cost overhead"""
+        def by_label(counter):
+            return {key[0]: value for key, value in counter.values.items()}
+        
+        return {
+            "hedge_rate": self.hedge_rate(),
+            "requests": by_label(self.requests),
+            "hedged": by_label(self.hedges),
+            "wins": by_label(self.wins),
+            "extra_cost_usd": by_label(self.extra_cost)
+        }
+
+# Global hedger for image generation
+image_hedger = HedgedRequester(LatencyTracker(settings.image_hedge_window))
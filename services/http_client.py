@@ -0,0 +1,65 @@
+import logging
+import httpx
+from typing import Dict, Optional
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+class HTTPClientPool:
+    """Process-wide pool of keep-alive HTTP clients, one per provider"""
+
+    def __init__(self):
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+
+        # Per-provider connection caps, everything else uses the default
+        self.provider_limits = {
+            "fal": settings.fal_max_connections,
+            "replicate": settings.replicate_max_connections
+        }
+
+    def _build_client(self, provider: str) -> httpx.AsyncClient:
+        """Create a pooled client for a provider"""
+        max_connections = self.provider_limits.get(provider, settings.http_max_connections)
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(settings.http_max_keepalive_connections, max_connections),
+            keepalive_expiry=settings.http_keepalive_expiry
+        )
+
+        logger.info(f"Opening HTTP client pool for {provider} (max {max_connections} connections)")
+        return httpx.AsyncClient(
+            http2=settings.http2_enabled and HTTP2_AVAILABLE,
+            limits=limits,
+            timeout=httpx.Timeout(settings.http_default_timeout, connect=settings.http_connect_timeout)
+        )
+
+    def get_client(self, provider: str) -> httpx.AsyncClient:
+        """Get the shared client for a provider, opening it on first use"""
+        client = self.clients.get(provider)
+        if client is None or client.is_closed:
+            client = self._build_client(provider)
+            self.clients[provider] = client
+        return client
+
+    async def start(self, providers: Optional[list] = None) -> None:
+        """Open clients for the given providers ahead of the first request"""
+        for provider in providers or list(self.provider_limits):
+            self.get_client(provider)
+
+    async def close(self) -> None:
+        """Close every pooled client"""
+        for provider, client in list(self.clients.items()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing HTTP client for {provider}: {e}")
+        self.clients.clear()
+
+# Global pool instance
+http_pool = HTTPClientPool()
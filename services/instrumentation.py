@@ -0,0 +1,178 @@
+import asyncio
+import functools
+import inspect
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Labels of the update or job being handled, filled in as they become known (e.g. the user's plan)
+_request_labels: ContextVar[Optional[Dict[str, str]]] = ContextVar("request_labels", default=None)
+
+handler_latency = metrics.histogram("bot_handler_duration_seconds", "Time spent in Telegram update handlers", ("handler", "plan"))
+handler_errors = metrics.counter("bot_handler_errors_total", "Exceptions raised by Telegram update handlers", ("handler", "error"))
+provider_latency = metrics.histogram("provider_request_duration_seconds", "Latency of provider calls", ("provider", "operation", "model", "plan", "outcome"))
+provider_requests = metrics.counter("provider_requests_total", "Provider calls by outcome", ("provider", "operation", "model", "plan", "outcome"))
+provider_cost = metrics.counter("provider_cost_usd_total", "Provider spend reported on call results", ("provider", "model", "plan"))
+telegram_latency = metrics.histogram("telegram_api_request_duration_seconds", "Latency of Bot API requests", ("method",))
+telegram_errors = metrics.counter("telegram_api_errors_total", "Failed Bot API requests", ("method", "error"))
+
+@contextmanager
+def metric_labels(**labels: str):
+    """Scope request labels to the current update or job"""
+    token = _request_labels.set(dict(labels))
+    try:
+        yield
+    finally:
+        _request_labels.reset(token)
+
+def tag_plan(plan: Any) -> None:
+    """Attach the user's plan to metrics recorded for the current update"""
+    labels = _request_labels.get()
+    if labels is not None:
+        labels["plan"] = getattr(plan, "value", plan)
+
+def _current_plan() -> str:
+    labels = _request_labels.get()
+    return labels.get("plan", "unknown") if labels else "none"
+
+def instrument_handler(func):
+    """Time a Telegram handler and count its exceptions, labelled with the user's plan"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with metric_labels():
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                handler_errors.inc(handler=name, error=type(e).__name__)
+                raise
+            finally:
+                handler_latency.observe(time.perf_counter() - start, handler=name, plan=_current_plan())
+
+    return wrapper
+
+def _outcome(result: Any) -> str:
+    if isinstance(result, dict):
+        if not result.get("success", True):
+            return "failure"
+        if result.get("cached"):
+            return "cached"
+    return "success"
+
+def instrument_provider(provider: str, model: Optional[str] = None):
+    """Time a provider method and count calls, failures and reported cost.
+
+    The model label comes from the call's `model` argument (or its default) unless a fixed model is given.
+    """
+    def decorator(func):
+        operation = func.__name__.lstrip("_")
+        parameters = list(inspect.signature(func).parameters.values())
+        names = [parameter.name for parameter in parameters]
+        model_index = names.index("model") if model is None and "model" in names else None
+        default_model = model or (parameters[model_index].default if model_index is not None else "")
+
+        def resolve_model(args, kwargs) -> str:
+            if model_index is None:
+                return default_model
+            if "model" in kwargs:
+                return kwargs["model"]
+            return args[model_index] if len(args) > model_index else default_model
+
+        def record(start: float, outcome: str, model_name: str, result: Any = None) -> None:
+            plan = _current_plan()
+            provider_latency.observe(time.perf_counter() - start, provider=provider, operation=operation, model=model_name, plan=plan, outcome=outcome)
+            provider_requests.inc(provider=provider, operation=operation, model=model_name, plan=plan, outcome=outcome)
+            if isinstance(result, dict) and result.get("cost"):
+                provider_cost.inc(result["cost"], provider=provider, model=model_name, plan=plan)
+
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def stream_wrapper(*args, **kwargs):
+                model_name = resolve_model(args, kwargs)
+                start = time.perf_counter()
+                outcome = "error"
+                try:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                    outcome = "success"
+                except (asyncio.CancelledError, GeneratorExit):
+                    outcome = "cancelled"
+                    raise
+                finally:
+                    record(start, outcome, model_name)
+
+            return stream_wrapper
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            model_name = resolve_model(args, kwargs)
+            start = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                # Lost a hedged race or the user went away
+                record(start, "cancelled", model_name)
+                raise
+            except Exception:
+                record(start, "error", model_name)
+                raise
+            record(start, _outcome(result), model_name, result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """Bot API transport recording latency and errors per API method"""
+
+    async def post(self, url: str, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            return await super().post(url, *args, **kwargs)
+        except TelegramError as e:
+            telegram_errors.inc(method=method, error=type(e).__name__)
+            raise
+        finally:
+            telegram_latency.observe(time.perf_counter() - start, method=method)
+
+async def _serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5.0)
+        # Drain the headers, the request body is never used
+        while (await asyncio.wait_for(reader.readline(), timeout=5.0)).strip():
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, content_type, body = "200 OK", PROMETHEUS_CONTENT_TYPE, metrics.render_prometheus().encode()
+        else:
+            status, content_type, body = "404 Not Found", "text/plain", b"Not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        logger.debug(f"Metrics request failed: {e}")
+    finally:
+        writer.close()
+
+async def start_metrics_server(port: int, host: str = "0.0.0.0") -> asyncio.AbstractServer:
+    """Serve /metrics for processes without a web app (the polling bot)"""
+    server = await asyncio.start_server(_serve_metrics, host, port)
+    logger.info(f"Metrics available on http://{host}:{port}/metrics")
+    return server
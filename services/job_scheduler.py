@@ -0,0 +1,150 @@
+import asyncio
+import itertools
+import logging
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional
+from config.settings import settings
+from models.user import UserPlan, get_plan_limits
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """Raised when the generation queue is at capacity"""
+
+class _Waiter:
+    __slots__ = ("provider", "plan", "priority", "seq", "enqueued_at", "future")
+
+    def __init__(self, provider: str, plan: UserPlan, priority: int, seq: int, enqueued_at: float, future: asyncio.Future):
+        self.provider = provider
+        self.plan = plan
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = enqueued_at
+        self.future = future
+
+class JobScheduler:
+    """Admission control for generation jobs: per-provider and global caps with plan-weighted priority"""
+
+    def __init__(self):
+        self.provider_limits: Dict[str, int] = {
+            "fal": settings.fal_max_concurrent_jobs,
+            "replicate": settings.replicate_max_concurrent_jobs
+        }
+        self.global_limit = settings.max_concurrent_jobs
+        self.max_queue = settings.job_queue_max_size
+        self.running: Dict[str, int] = {}
+        self.global_running = 0
+        self.waiting: List[_Waiter] = []
+        self.seq = itertools.count()
+
+        self.queue_depth = metrics.gauge("generation_queue_depth", "Jobs waiting for a provider slot", ("provider",))
+        self.running_jobs = metrics.gauge("generation_jobs_running", "Jobs holding a provider slot", ("provider",))
+        self.wait_time = metrics.histogram("generation_queue_wait_seconds", "Time jobs spent queued", ("provider", "plan"))
+        self.rejected = metrics.counter("generation_queue_rejected_total", "Jobs rejected because the queue was full", ("provider",))
+
+    def priority_for(self, plan: UserPlan) -> int:
+        """Queue priority for a plan, plans with priority queue access always go first"""
+        plan_limits = get_plan_limits(plan)
+        return -1 if plan_limits.has_priority_queue else plan_limits.queue_priority
+
+    def _has_capacity(self, provider: str) -> bool:
+        limit = self.provider_limits.get(provider, self.global_limit)
+        return self.global_running < self.global_limit and self.running.get(provider, 0) < limit
+
+    def _effective_priority(self, waiter: _Waiter, now: float):
+        # Waiting slowly raises priority so lower plans are never starved
+        aged = waiter.priority - (now - waiter.enqueued_at) / settings.job_priority_aging_seconds
+        return (aged, waiter.seq)
+
+    def _ordered_waiters(self, provider: Optional[str] = None) -> List[_Waiter]:
+        now = asyncio.get_running_loop().time()
+        waiters = [w for w in self.waiting if provider is None or w.provider == provider]
+        return sorted(waiters, key=lambda w: self._effective_priority(w, now))
+
+    def _acquire(self, provider: str) -> None:
+        self.running[provider] = self.running.get(provider, 0) + 1
+        self.global_running += 1
+        self.running_jobs.inc(provider=provider)
+
+    def _release(self, provider: str) -> None:
+        self.running[provider] -= 1
+        self.global_running -= 1
+        self.running_jobs.dec(provider=provider)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Hand free slots to the highest-priority waiters"""
+        for waiter in self._ordered_waiters():
+            if self.global_running >= self.global_limit:
+                break
+            if waiter.future.done() or not self._has_capacity(waiter.provider):
+                continue
+            self.waiting.remove(waiter)
+            self.queue_depth.dec(provider=waiter.provider)
+            self._acquire(waiter.provider)
+            waiter.future.set_result(None)
+
+    def queue_position(self, waiter: _Waiter) -> int:
+        """1-based position of a waiter among jobs queued for the same provider"""
+        return self._ordered_waiters(waiter.provider).index(waiter) + 1
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        provider: str,
+        plan: UserPlan,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None
+    ):
+        """Hold a generation slot for a provider, queueing by plan priority when full"""
+        loop = asyncio.get_running_loop()
+        enqueued_at = loop.time()
+
+        if self._has_capacity(provider) and not any(w.provider == provider for w in self.waiting):
+            self._acquire(provider)
+        else:
+            if len(self.waiting) >= self.max_queue:
+                self.rejected.inc(provider=provider)
+                raise QueueFullError(f"Generation queue is full ({self.max_queue} jobs)")
+
+            waiter = _Waiter(provider, plan, self.priority_for(plan), next(self.seq), enqueued_at, loop.create_future())
+            self.waiting.append(waiter)
+            self.queue_depth.inc(provider=provider)
+
+            if on_queued:
+                try:
+                    await on_queued(self.queue_position(waiter))
+                except Exception as e:
+                    logger.warning(f"Error reporting queue position: {e}")
+
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter in self.waiting:
+                    self.waiting.remove(waiter)
+                    self.queue_depth.dec(provider=provider)
+                elif waiter.future.done() and not waiter.future.cancelled():
+                    # Slot was granted just as we were cancelled, hand it on
+                    self._release(provider)
+                raise
+
+        self.wait_time.observe(loop.time() - enqueued_at, provider=provider, plan=plan.value)
+        try:
+            yield
+        finally:
+            self._release(provider)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Running and queued jobs per provider"""
+        providers = set(self.provider_limits) | set(self.running)
+        return {
+            provider: {
+                "running": self.running.get(provider, 0),
+                "queued": sum(1 for w in self.waiting if w.provider == provider),
+                "limit": self.provider_limits.get(provider, self.global_limit)
+            }
+            for provider in providers
+        }
+
+# Global scheduler instance
+job_scheduler = JobScheduler()
@@ -0,0 +1,78 @@
+import asyncio
+import importlib
+import logging
+import time
+from types import ModuleType
+from typing import Dict, Iterable, List, Optional
+from config.settings import settings
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+import_seconds = metrics.gauge("sdk_import_seconds", "Time spent importing a lazily loaded SDK", ("module",))
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access"""
+
+    def __init__(self, name: str):
+        self.__name = name
+        self.__module: Optional[ModuleType] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.__module is not None
+
+    def load(self) -> ModuleType:
+        """Import the module now if it isn't yet"""
+        if self.__module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(self.__name)
+            elapsed = time.perf_counter() - start
+            import_seconds.set(elapsed, module=self.__name)
+            logger.info(f"Imported {self.__name} in {elapsed * 1000:.0f}ms")
+            self.__module = module
+        return self.__module
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+    def __setattr__(self, attr: str, value) -> None:
+        # Module configuration such as stripe.api_key has to land on the real module
+        if attr.startswith("_LazyModule__"):
+            object.__setattr__(self, attr, value)
+        else:
+            setattr(self.load(), attr, value)
+
+    def __repr__(self) -> str:
+        return f"<LazyModule {self.__name} ({'loaded' if self.loaded else 'not loaded'})>"
+
+# One stand-in per module name, shared by every importer
+_registry: Dict[str, LazyModule] = {}
+
+def lazy_import(name: str) -> LazyModule:
+    """Module proxy for name, the real import happens on first use or in warm_up()"""
+    module = _registry.get(name)
+    if module is None:
+        module = _registry[name] = LazyModule(name)
+    return module
+
+async def warm_up(names: Iterable[str]) -> None:
+    """Import SDKs in a thread after startup so the first request doesn't pay for them"""
+    for name in names:
+        module = lazy_import(name)
+        if module.loaded:
+            continue
+        try:
+            await asyncio.to_thread(module.load)
+        except Exception as e:
+            # Left for first use, which reports the error where it matters
+            logger.warning(f"Could not warm up {name}: {e}")
+
+def configured_sdks() -> List[str]:
+    """SDKs that a loaded service declared with lazy_import() and that have credentials set"""
+    credentials = {
+        "openai": settings.openai_api_key,
+        "anthropic": settings.anthropic_api_key,
+        "stripe": settings.stripe_secret_key
+    }
+    return [name for name, key in credentials.items() if key and name in _registry]
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+from telegram import Message
+from telegram.error import BadRequest
+from config.settings import settings
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class MediaRecord:
+    kind: str
+    url: str
+    file_id: str
+    file_unique_id: Optional[str] = None
+    file_size: int = 0
+    content_key: Optional[str] = None
+
+def _sent_media(message: Message, kind: str):
+    """The media object Telegram returned for a sent message"""
+    if kind == "photo":
+        return message.photo[-1] if message.photo else None
+    return getattr(message, kind, None) or message.document
+
+class MediaRegistry:
+    """Maps provider URLs and content keys to Telegram file_ids so media is uploaded once"""
+
+    def __init__(self, max_entries: int, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.by_url: "OrderedDict[str, MediaRecord]" = OrderedDict()
+        self.by_content: Dict[str, str] = {}
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+        self.sends = metrics.counter("telegram_media_sends_total", "Media sent by URL (upload) or by stored file_id (reuse)", ("outcome",))
+        self.bytes_saved = metrics.counter("telegram_media_bytes_saved_total", "Bytes Telegram did not have to fetch again thanks to file_id reuse")
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS media (
+                    url TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    file_unique_id TEXT,
+                    file_size INTEGER NOT NULL DEFAULT 0,
+                    content_key TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_media_content_key ON media(content_key)")
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def _disk_lookup(self, url: Optional[str], content_key: Optional[str]) -> Optional[MediaRecord]:
+        query = "SELECT kind, url, file_id, file_unique_id, file_size, content_key FROM media WHERE "
+        with self.lock:
+            conn = self._connect()
+            row = None
+            if url:
+                row = conn.execute(query + "url = ?", (url,)).fetchone()
+            if row is None and content_key:
+                row = conn.execute(query + "content_key = ?", (content_key,)).fetchone()
+        return MediaRecord(*row) if row else None
+
+    def _disk_save(self, record: MediaRecord) -> None:
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO media (url, kind, file_id, file_unique_id, file_size, content_key) VALUES (?, ?, ?, ?, ?, ?)",
+                    (record.url, record.kind, record.file_id, record.file_unique_id, record.file_size, record.content_key)
+                )
+
+    def _disk_delete(self, url: str) -> None:
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM media WHERE url = ?", (url,))
+
+    def _remember(self, record: MediaRecord) -> None:
+        self.by_url[record.url] = record
+        self.by_url.move_to_end(record.url)
+        if record.content_key:
+            self.by_content[record.content_key] = record.url
+
+        while len(self.by_url) > self.max_entries:
+            _, evicted = self.by_url.popitem(last=False)
+            if evicted.content_key and self.by_content.get(evicted.content_key) == evicted.url:
+                del self.by_content[evicted.content_key]
+
+    async def lookup(self, url: Optional[str] = None, content_key: Optional[str] = None) -> Optional[MediaRecord]:
+        """Find a known upload by provider URL or content key"""
+        if url and url in self.by_url:
+            return self.by_url[url]
+        if content_key and content_key in self.by_content:
+            return self.by_url.get(self.by_content[content_key])
+
+        if self.db_path:
+            try:
+                record = await asyncio.to_thread(self._disk_lookup, url, content_key)
+            except Exception as e:
+                logger.warning(f"Error reading media registry: {e}")
+                return None
+            if record:
+                self._remember(record)
+            return record
+
+        return None
+
+    async def record(self, kind: str, url: str, message: Message, content_key: Optional[str] = None) -> Optional[MediaRecord]:
+        """Remember the file_id Telegram assigned to an uploaded URL"""
+        media = _sent_media(message, kind)
+        if media is None:
+            return None
+
+        record = MediaRecord(
+            kind=kind,
+            url=url,
+            file_id=media.file_id,
+            file_unique_id=media.file_unique_id,
+            file_size=media.file_size or 0,
+            content_key=content_key
+        )
+        self._remember(record)
+
+        if self.db_path:
+            try:
+                await asyncio.to_thread(self._disk_save, record)
+            except Exception as e:
+                logger.warning(f"Error saving media registry: {e}")
+
+        return record
+
+    async def forget(self, record: MediaRecord) -> None:
+        """Drop a record whose file_id Telegram no longer accepts"""
+        self.by_url.pop(record.url, None)
+        if record.content_key and self.by_content.get(record.content_key) == record.url:
+            del self.by_content[record.content_key]
+
+        if self.db_path:
+            try:
+                await asyncio.to_thread(self._disk_delete, record.url)
+            except Exception as e:
+                logger.warning(f"Error deleting from media registry: {e}")
+
+    async def send(
+        self,
+        send_func: Callable[..., Awaitable[Message]],
+        kind: str,
+        url: str,
+        content_key: Optional[str] = None,
+        **kwargs: Any
+    ) -> Message:
+        """Send media by file_id when already uploaded, otherwise by URL and record the result"""
+        record = await self.lookup(url, content_key)
+
+        if record is not None:
+            try:
+                message = await send_func(**{kind: record.file_id}, **kwargs)
+                self.sends.inc(outcome="reuse")
+                self.bytes_saved.inc(record.file_size)
+                return message
+            except BadRequest as e:
+                logger.warning(f"Stored file_id rejected, re-uploading {url}: {e}")
+                await self.forget(record)
+
+        message = await send_func(**{kind: url}, **kwargs)
+        self.sends.inc(outcome="upload")
+        await self.record(kind, url, message, content_key)
+        return message
+
+    async def reply(self, message: Message, kind: str, url: str, content_key: Optional[str] = None, **kwargs: Any) -> Message:
+        """Reply to a message with media (kind is photo, video or audio)"""
+        return await self.send(getattr(message, f"reply_{kind}"), kind, url, content_key, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Upload/reuse counters and bytes Telegram did not have to fetch again"""
+        return {
+            "entries": len(self.by_url),
+            "uploads": int(self.sends.get(outcome="upload")),
+            "reuses": int(self.sends.get(outcome="reuse")),
+            "bytes_saved": int(self.bytes_saved.get())
+        }
+
+# Global media registry
+media_registry = MediaRegistry(
+    max_entries=settings.media_registry_max_entries,
+    db_path=settings.media_registry_db_path
+)
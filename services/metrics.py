@@ -0,0 +1,193 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple, Any, List
+
+# Latency buckets in seconds, from fast API calls up to long generations
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames: Tuple[str, ...], key: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple([str(labels.get(name, "")) for name in self.labelnames])
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        """Increase the counter"""
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        """Current value for a label set"""
+        return self.values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        """Prometheus text exposition lines"""
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        """Set the gauge"""
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        """Decrease the gauge"""
+        self.inc(-amount, **labels)
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple([str(labels.get(name, "")) for name in self.labelnames])
+
+    def observe(self, value: float, **labels) -> None:
+        """Record one observation"""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self.series[key] = series
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Context manager observing the elapsed wall time"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _quantile(self, counts: list, total: int, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in"""
+        target = q * total
+        running = 0
+        for index, count in enumerate(counts):
+            running += count
+            if running >= target:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Per-label-set summary: count, sum, average and bucket-estimated p50/p95/p99"""
+        with self.lock:
+            items = [(key, list(series["counts"]), series["sum"], series["count"]) for key, series in self.series.items()]
+
+        result = {}
+        for key, counts, total_sum, count in items:
+            label = ",".join(f"{name}={value}" for name, value in zip(self.labelnames, key)) or "all"
+            result[label] = {
+                "count": count,
+                "sum": total_sum,
+                "avg": total_sum / count if count else 0.0,
+                "p50": self._quantile(counts, count, 0.50),
+                "p95": self._quantile(counts, count, 0.95),
+                "p99": self._quantile(counts, count, 0.99)
+            }
+        return result
+
+    def render(self) -> List[str]:
+        """Prometheus text exposition lines (cumulative buckets, _sum and _count)"""
+        with self.lock:
+            items = [(key, list(series["counts"]), series["sum"], series["count"]) for key, series in self.series.items()]
+
+        lines = []
+        for key, counts, total_sum, count in items:
+            running = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                running += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {running}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total_sum)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Holds every metric so they can be reported from one place"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Any] = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args)
+                self.metrics[name] = metric
+            return metric
+
+    def counter(self, name: str, description: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        """Get or create a counter"""
+        return self._get_or_create(Counter, name, description, labelnames)
+
+    def gauge(self, name: str, description: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        """Get or create a gauge"""
+        return self._get_or_create(Gauge, name, description, labelnames)
+
+    def histogram(self, name: str, description: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        """Get or create a histogram"""
+        return self._get_or_create(Histogram, name, description, labelnames, buckets)
+
+    def render_prometheus(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        with self.lock:
+            registered = sorted(self.metrics.items())
+
+        lines = []
+        for name, metric in registered:
+            lines.append(f"# HELP {name} {metric.description}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# Global metrics registry
+metrics = MetricsRegistry()
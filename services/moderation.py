@@ -0,0 +1,195 @@
+import logging
+import re
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import FrozenSet, Iterable, Optional, Tuple
+from config.settings import settings
+from services.generation_cache import normalize_prompt
+from services.metrics import metrics
+from services.openai_provider import OpenAIProvider
+
+logger = logging.getLogger(__name__)
+
+# Always refused before any provider sees them; extended with moderation_blocklist_path
+BLOCKED_TERMS = frozenset({
+    "child porn",
+    "child pornography",
+    "csam",
+    "loli",
+    "lolicon",
+    "shotacon",
+    "underage nude",
+    "underage sex",
+    "nude child",
+    "naked child",
+    "nude kid",
+    "naked kid",
+    "nude minor",
+    "naked minor",
+    "pornografia infantil",
+    "criança nua",
+    "crianca nua",
+    "menor nua",
+    "menor nu",
+    "estupro",
+    "rape",
+    "bestiality",
+    "zoofilia",
+    "beheading",
+    "decapitação",
+    "decapitacao",
+})
+
+# Hyphens, underscores and dots used to split a term ("child-porn") match like spaces
+_SEPARATORS = re.compile(r"[\s\-_.*/]+")
+
+moderations = metrics.counter("prompt_moderation_total", "Prompts checked before generation by stage and outcome", ("stage", "outcome"))
+
+@dataclass(frozen=True)
+class ModerationVerdict:
+    """Outcome of the pre-flight checks; reason is a get_error_message() key when refused"""
+    allowed: bool
+    stage: str
+    reason: Optional[str] = None
+    detail: Optional[str] = None
+
+ALLOWED = ModerationVerdict(True, "local")
+
+def build_keyword_pattern(terms: Iterable[str]) -> Optional[re.Pattern]:
+    """One compiled alternation over every term, matched on word boundaries in a single pass"""
+    normalized = {_SEPARATORS.sub(" ", normalize_prompt(term)) for term in terms if term.strip()}
+    if not normalized:
+        return None
+    # Longest first so "child pornography" wins over "child porn"
+    alternation = "|".join(re.escape(term) for term in sorted(normalized, key=len, reverse=True))
+    return re.compile(rf"(?<!\w)(?:{alternation})(?!\w)")
+
+def load_blocklist(path: Optional[str]) -> FrozenSet[str]:
+    """Extra blocked terms, one per line, # starts a comment"""
+    if not path:
+        return frozenset()
+    try:
+        with open(path, encoding="utf-8") as handle:
+            return frozenset(line.split("#", 1)[0].strip() for line in handle if line.split("#", 1)[0].strip())
+    except OSError as e:
+        logger.error(f"Could not read moderation blocklist {path}: {e}")
+        return frozenset()
+
+def dominant_script(text: str) -> Optional[str]:
+    """Most common script among the letters of text (latin, cyrillic, cjk, ...), None without letters"""
+    scripts = Counter()
+    for char in text:
+        if not char.isalpha():
+            continue
+        if char.isascii():
+            scripts["latin"] += 1
+            continue
+        name = unicodedata.name(char, "")
+        scripts[name.split(" ", 1)[0].lower() if name else "unknown"] += 1
+    if not scripts:
+        return None
+    return scripts.most_common(1)[0][0]
+
+def _allowed_scripts() -> FrozenSet[str]:
+    return frozenset(script.strip().lower() for script in settings.moderation_allowed_scripts.split(",") if script.strip())
+
+class PromptModerator:
+    """Pre-flight for paid generation: local length/keyword/script checks, then batched remote moderation"""
+
+    def __init__(self, provider: Optional[OpenAIProvider] = None):
+        self.provider = provider or OpenAIProvider()
+        self.pattern = build_keyword_pattern(BLOCKED_TERMS | load_blocklist(settings.moderation_blocklist_path))
+        self.allowed_scripts = _allowed_scripts()
+        self.cache: "OrderedDict[str, Tuple[float, ModerationVerdict]]" = OrderedDict()
+
+    @property
+    def remote_enabled(self) -> bool:
+        return settings.moderation_remote and self.provider.configured
+
+    async def check(self, prompt: str) -> ModerationVerdict:
+        """Whether prompt may be sent to a paid provider"""
+        if not settings.moderation_enabled:
+            return ALLOWED
+
+        normalized = normalize_prompt(prompt)
+        verdict = self._local_check(normalized)
+        if verdict is not None:
+            moderations.inc(stage=verdict.stage, outcome="rejected")
+            logger.info(f"Prompt rejected by {verdict.stage} check: {verdict.detail}")
+            return verdict
+        if not self.remote_enabled:
+            moderations.inc(stage="local", outcome="allowed")
+            return ALLOWED
+
+        cached = self._cache_get(normalized)
+        if cached is not None:
+            moderations.inc(stage="cache", outcome="allowed" if cached.allowed else "rejected")
+            return cached
+        return await self._remote_check(normalized)
+
+    def _local_check(self, normalized: str) -> Optional[ModerationVerdict]:
+        """Microsecond checks on the normalised prompt, a verdict only when it is refused"""
+        if len(normalized) < settings.moderation_min_prompt_length:
+            return ModerationVerdict(False, "length", "invalid_prompt", f"{len(normalized)} characters")
+        if len(normalized) > settings.moderation_max_prompt_length:
+            return ModerationVerdict(False, "length", "prompt_too_long", f"{len(normalized)} characters")
+
+        script = dominant_script(normalized)
+        if script is None:
+            return ModerationVerdict(False, "script", "invalid_prompt", "no letters")
+        if self.allowed_scripts and script not in self.allowed_scripts:
+            return ModerationVerdict(False, "script", "prompt_language", script)
+
+        if self.pattern is not None:
+            match = self.pattern.search(_SEPARATORS.sub(" ", normalized))
+            if match:
+                return ModerationVerdict(False, "keyword", "prompt_rejected", match.group(0))
+        return None
+
+    async def _remote_check(self, normalized: str) -> ModerationVerdict:
+        """Provider moderation through the micro-batcher, failing open or closed per settings"""
+        try:
+            result = await self.provider.batch("moderations", normalized)
+        except Exception as e:
+            logger.warning(f"Remote moderation failed: {e}")
+            if settings.moderation_fail_open:
+                moderations.inc(stage="remote", outcome="error_allowed")
+                return ALLOWED
+            moderations.inc(stage="remote", outcome="error_rejected")
+            return ModerationVerdict(False, "remote", "api_error", str(e))
+
+        if result.get("flagged"):
+            categories = sorted(name for name, flagged in (result.get("categories") or {}).items() if flagged)
+            verdict = ModerationVerdict(False, "remote", "prompt_rejected", ", ".join(categories) or "flagged")
+            logger.info(f"Prompt rejected by remote moderation: {verdict.detail}")
+        else:
+            verdict = ModerationVerdict(True, "remote")
+        moderations.inc(stage="remote", outcome="allowed" if verdict.allowed else "rejected")
+        self._cache_put(normalized, verdict)
+        return verdict
+
+    def _cache_get(self, normalized: str) -> Optional[ModerationVerdict]:
+        entry = self.cache.get(normalized)
+        if entry is None:
+            return None
+        expires_at, verdict = entry
+        if expires_at < time.monotonic():
+            del self.cache[normalized]
+            return None
+        self.cache.move_to_end(normalized)
+        return verdict
+
+    def _cache_put(self, normalized: str, verdict: ModerationVerdict) -> None:
+        self.cache[normalized] = (time.monotonic() + settings.moderation_cache_ttl, verdict)
+        self.cache.move_to_end(normalized)
+        while len(self.cache) > settings.moderation_cache_max_entries:
+            self.cache.popitem(last=False)
+
+    async def close(self) -> None:
+        """Send pending moderation batches"""
+        await self.provider.close()
+
+# Global moderator instance
+prompt_moderator = PromptModerator()
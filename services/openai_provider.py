@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+from config.settings import settings
+from services.http_client import http_pool
+from services.instrumentation import instrument_provider
+from services.lazy_imports import lazy_import
+from services.providers import Capability, Provider
+
+logger = logging.getLogger(__name__)
+
+openai = lazy_import("openai")
+
+# Batch API jobs that will never produce an output file
+BATCH_FAILED_STATUSES = frozenset({"failed", "expired", "cancelled"})
+
+class OpenAIProvider(Provider):
+    name = "openai"
+    capabilities = frozenset({Capability.TEXT, Capability.STREAM, Capability.IMAGE, Capability.VISION, Capability.BATCH})
+
+    def __init__(self):
+        super().__init__()
+        # Built on first use, importing the SDK costs most of a second of cold start
+        self._client = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(settings.openai_api_key)
+
+    @property
+    def client(self):
+        """AsyncOpenAI on the pooled HTTP client with the shared retry and timeout policy, None without a key"""
+        if self._client is None and self.configured:
+            try:
+                self._client = openai.AsyncOpenAI(
+                    api_key=settings.openai_api_key,
+                    max_retries=settings.provider_max_retries,
+                    timeout=settings.provider_timeout,
+                    http_client=http_pool.get_client(self.name)
+                )
+                logger.info("OpenAI client initialized")
+            except Exception as e:
+                logger.warning(f"Failed to initialize OpenAI client: {e}")
+                self._client = False
+        return self._client or None
+
+    def chat_request(self, message: str, model: str, history: Optional[List[Dict[str, str]]] = None, **options: Any) -> Dict[str, Any]:
+        """Chat completion body: conversation history and the new message"""
+        return {
+            "model": model,
+            "messages": [*(history or []), {"role": "user", "content": message}],
+            "max_tokens": 1000,
+            "temperature": 0.7,
+            **options
+        }
+
+    @instrument_provider("openai")
+    async def generate_text(self, message: str, model: str, history: Optional[List[Dict[str, str]]] = None, **options: Any) -> str:
+        """Generate response using OpenAI"""
+        response = await self.client.chat.completions.create(**self.chat_request(message, model, history, **options))
+        return response.choices[0].message.content
+
+    @instrument_provider("openai")
+    async def stream_text(self, message: str, model: str, history: Optional[List[Dict[str, str]]] = None) -> AsyncIterator[str]:
+        """Stream response using OpenAI"""
+        stream = await self.client.chat.completions.create(**self.chat_request(message, model, history), stream=True)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    @instrument_provider("openai", model="dall-e-3")
+    async def generate_image(self, prompt: str, **options: Any) -> Dict[str, Any]:
+        """Generate image using DALL-E"""
+        try:
+            response = await self.client.images.generate(
+                model="dall-e-3",
+                prompt=prompt,
+                size="1024x1024",
+                quality="standard",
+                n=1
+            )
+            return {
+                "success": True,
+                "url": response.data[0].url,
+                "cost": 0.04,  # DALL-E 3 standard 1024x1024
+                "model": "dall-e-3"
+            }
+        except Exception as e:
+            logger.error(f"Error generating image with DALL-E: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+
+    @instrument_provider("openai", model="gpt-4-vision-preview")
+    async def analyze_image(self, image_url: str, prompt: str) -> str:
+        """Analyze image using GPT-4 Vision"""
+        response = await self.client.chat.completions.create(
+            model="gpt-4-vision-preview",
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": {"url": image_url}}
+                    ]
+                }
+            ],
+            max_tokens=500
+        )
+        return response.choices[0].message.content
+
+    async def submit_batch(self, endpoint: str, items: List[Any]) -> List[Any]:
+        """moderations takes a list of texts in one call; chat.completions goes through the Batch API"""
+        if endpoint == "moderations":
+            return await self._moderate(items)
+        if endpoint == "chat.completions":
+            return await self._batch_chat(items)
+        raise NotImplementedError(f"No OpenAI batch endpoint {endpoint}")
+
+    @instrument_provider("openai", model=settings.openai_moderation_model)
+    async def _moderate(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """Moderation results for several texts in one request"""
+        response = await self.client.moderations.create(model=settings.openai_moderation_model, input=texts)
+        return [result.model_dump() for result in response.results]
+
+    @instrument_provider("openai", model="batch")
+    async def _batch_chat(self, bodies: List[Dict[str, Any]]) -> List[Any]:
+        """Run chat completions through the Batch API (half price, finishes within 24h)"""
+        lines = "\n".join(
+            json.dumps({"custom_id": str(index), "method": "POST", "url": "/v1/chat/completions", "body": body})
+            for index, body in enumerate(bodies)
+        )
+        upload = await self.client.files.create(file=("batch.jsonl", lines.encode()), purpose="batch")
+        batch = await self.client.batches.create(input_file_id=upload.id, endpoint="/v1/chat/completions", completion_window="24h")
+        logger.info(f"Submitted OpenAI batch {batch.id} with {len(bodies)} requests")
+
+        while batch.status != "completed":
+            if batch.status in BATCH_FAILED_STATUSES:
+                raise RuntimeError(f"OpenAI batch {batch.id} {batch.status}")
+            await asyncio.sleep(settings.openai_batch_poll_interval)
+            batch = await self.client.batches.retrieve(batch.id)
+
+        responses = {}
+        if batch.output_file_id:
+            output = await self.client.files.content(batch.output_file_id)
+            for line in output.text.splitlines():
+                row = json.loads(line)
+                responses[row["custom_id"]] = row
+
+        results = []
+        for index in range(len(bodies)):
+            row = responses.get(str(index))
+            response = row.get("response") if row else None
+            if response and response.get("status_code") == 200:
+                results.append(response["body"])
+            else:
+                results.append(RuntimeError(f"Batch request failed: {(row or {}).get('error') or 'no response'}"))
+        return results
@@ -1,15 +1,50 @@
+import asyncio
+import functools
 import logging
-import stripe
-from typing import Dict, Any, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any
 from config.settings import settings
-from models.user import UserPlan
+from models.user import UserPlan, get_plan_limits
+from services.metrics import metrics
+from services.lazy_imports import lazy_import
 
 logger = logging.getLogger(__name__)
 
+stripe = lazy_import("stripe")
+
 class PaymentService:
     def __init__(self):
-        stripe.api_key = settings.stripe_secret_key
         self.webhook_secret = settings.stripe_webhook_secret
+        
+        # The stripe SDK is synchronous, run it on a bounded pool off the event loop
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.stripe_max_workers,
+            thread_name_prefix="stripe"
+        )
+        self.latency = metrics.histogram(
+            "stripe_request_duration_seconds",
+            "Latency of Stripe API calls",
+            labelnames=("operation",)
+        )
+
+    async def _call_stripe(self, operation: str, func, *args, **kwargs):
+        """Run a blocking Stripe SDK call on the executor and record its latency"""
+        stripe.api_key = settings.stripe_secret_key
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self.latency.observe(time.perf_counter() - start, operation=operation)
+
+    def get_latency_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Latency summary per Stripe operation"""
+        return self.latency.snapshot()
+
+    def close(self) -> None:
+        """Shut down the Stripe executor"""
+        self.executor.shutdown(wait=False)
 
     async def create_checkout_session(
         self,
@@ -21,22 +56,7 @@ class PaymentService:
         """Create Stripe checkout session for subscription"""
         
         try:
-            # Plan pricing mapping
-            plan_prices = {
-                UserPlan.FREE: None,  # Free plan
-                UserPlan.STARTER: "price_starter_999",  # $9.99/month
-                UserPlan.PRO: "price_pro_1999",        # $19.99/month
-                UserPlan.PREMIUM: "price_premium_5999", # $59.99/month
-                UserPlan.ULTIMATE: "price_ultimate_14999" # $149.99/month
-            }
-            
-            if plan == UserPlan.FREE:
-                return {
-                    "success": False,
-                    "error": "Cannot create checkout for free plan"
-                }
-            
-            price_id = plan_prices.get(plan)
+            price_id = get_plan_limits(plan).stripe_price_id
             if not price_id:
                 return {
                     "success": False,
@@ -44,7 +64,9 @@ class PaymentService:
                 }
             
             # Create checkout session
-            session = stripe.checkout.Session.create(
+            session = await self._call_stripe(
+                "checkout_session_create",
+                stripe.checkout.Session.create,
                 payment_method_types=['card'],
                 line_items=[{
                     'price': price_id,
@@ -108,7 +130,9 @@ class PaymentService:
             
             for plan in plans:
                 # Create product
-                product = stripe.Product.create(
+                product = await self._call_stripe(
+                    "product_create",
+                    stripe.Product.create,
                     name=plan["name"],
                     description=plan["description"],
                     metadata={
@@ -117,7 +141,9 @@ class PaymentService:
                 )
                 
                 # Create price
-                price = stripe.Price.create(
+                price = await self._call_stripe(
+                    "price_create",
+                    stripe.Price.create,
                     unit_amount=plan["price"],
                     currency='usd',
                     recurring={'interval': 'month'},
@@ -161,10 +187,14 @@ class PaymentService:
                 
                 return {
                     "success": True,
+                    "event_id": event['id'],
                     "event_type": "subscription_created",
                     "user_id": user_id,
                     "plan": plan_name,
-                    "subscription_id": session.get('subscription')
+                    # Stripe objects are not dicts in current SDKs, no .get()
+                    "subscription_id": session['subscription'] if 'subscription' in session else None,
+                    # Billing cycle starts at checkout, monthly usage periods follow it
+                    "billing_anchor": session['created'] if 'created' in session else None
                 }
                 
             elif event['type'] == 'invoice.payment_succeeded':
@@ -172,6 +202,7 @@ class PaymentService:
                 
                 return {
                     "success": True,
+                    "event_id": event['id'],
                     "event_type": "payment_succeeded",
                     "subscription_id": invoice['subscription'],
                     "amount_paid": invoice['amount_paid']
@@ -182,6 +213,7 @@ class PaymentService:
                 
                 return {
                     "success": True,
+                    "event_id": event['id'],
                     "event_type": "payment_failed",
                     "subscription_id": invoice['subscription']
                 }
@@ -191,12 +223,14 @@ class PaymentService:
                 
                 return {
                     "success": True,
+                    "event_id": event['id'],
                     "event_type": "subscription_cancelled",
                     "subscription_id": subscription['id']
                 }
             
             return {
                 "success": True,
+                "event_id": event['id'],
                 "event_type": "unhandled",
                 "type": event['type']
             }
@@ -224,7 +258,11 @@ class PaymentService:
         """Get subscription status from Stripe"""
         
         try:
-            subscription = stripe.Subscription.retrieve(subscription_id)
+            subscription = await self._call_stripe(
+                "subscription_retrieve",
+                stripe.Subscription.retrieve,
+                subscription_id
+            )
             
             return {
                 "success": True,
@@ -244,7 +282,9 @@ class PaymentService:
         """Cancel subscription at period end"""
         
         try:
-            subscription = stripe.Subscription.modify(
+            subscription = await self._call_stripe(
+                "subscription_modify",
+                stripe.Subscription.modify,
                 subscription_id,
                 cancel_at_period_end=True
             )
@@ -261,102 +301,3 @@ class PaymentService:
                 "success": False,
                 "error": str(e)
             }
-
-    def get_plan_features(self, plan: UserPlan) -> Dict[str, Any]:
-        """Get plan features and limits"""
-        
-        features = {
-            UserPlan.FREE: {
-                "name": "🆓 Free",
-                "price": "$0/mês",
-                "daily_gpt4o_messages": 5,
-                "daily_gpt4_messages": 0,
-                "monthly_images": 3,
-                "monthly_music": 1,
-                "monthly_videos": 0,
-                "monthly_claude_tokens": 0,
-                "features": [
-                    "✅ 5 mensagens GPT-4o por dia",
-                    "✅ 3 imagens por mês (FLUX Schnell)",
-                    "✅ 1 música por mês",
-                    "❌ Sem vídeos",
-                    "❌ Sem Claude",
-                    "❌ Sem GPT-4"
-                ]
-            },
-            UserPlan.STARTER: {
-                "name": "🚀 Starter",
-                "price": "$9.99/mês",
-                "daily_gpt4o_messages": 50,
-                "daily_gpt4_messages": 0,
-                "monthly_images": 15,
-                "monthly_music": 3,
-                "monthly_videos": 0,
-                "monthly_claude_tokens": 0,
-                "features": [
-                    "✅ 50 mensagens GPT-4o por dia",
-                    "✅ 15 imagens por mês (FLUX Schnell)",
-                    "✅ 3 músicas por mês",
-                    "❌ Sem vídeos",
-                    "❌ Sem Claude",
-                    "❌ Sem GPT-4"
-                ]
-            },
-            UserPlan.PRO: {
-                "name": "💼 Pro",
-                "price": "$19.99/mês",
-                "daily_gpt4o_messages": 100,
-                "daily_gpt4_messages": 0,
-                "monthly_images": 50,
-                "monthly_music": 10,
-                "monthly_videos": 5,
-                "monthly_claude_tokens": 0,
-                "features": [
-                    "✅ 100 mensagens GPT-4o por dia",
-                    "✅ 50 imagens por mês (FLUX Dev)",
-                    "✅ 10 músicas por mês",
-                    "✅ 5 vídeos por mês",
-                    "❌ Sem Claude",
-                    "❌ Sem GPT-4"
-                ]
-            },
-            UserPlan.PREMIUM: {
-                "name": "⭐ Premium",
-                "price": "$59.99/mês",
-                "daily_gpt4o_messages": 50,
-                "daily_gpt4_messages": 100,
-                "monthly_images": 100,
-                "monthly_music": 20,
-                "monthly_videos": 10,
-                "monthly_claude_tokens": 0,
-                "features": [
-                    "✅ 50 mensagens GPT-4o por dia",
-                    "✅ 100 mensagens GPT-4 por dia",
-                    "✅ 100 imagens por mês (FLUX Pro)",
-                    "✅ 20 músicas por mês",
-                    "✅ 10 vídeos por mês",
-                    "❌ Sem Claude"
-                ]
-            },
-            UserPlan.ULTIMATE: {
-                "name": "👑 Ultimate",
-                "price": "$149.99/mês",
-                "daily_gpt4o_messages": 100,
-                "daily_gpt4_messages": 200,
-                "monthly_images": 200,
-                "monthly_music": 30,
-                "monthly_videos": 20,
-                "monthly_claude_tokens": 1000000,
-                "features": [
-                    "✅ 100 mensagens GPT-4o por dia",
-                    "✅ 200 mensagens GPT-4 por dia",
-                    "✅ 200 imagens por mês (FLUX Pro)",
-                    "✅ 30 músicas por mês",
-                    "✅ 20 vídeos por mês",
-                    "✅ Claude 1M tokens por mês"
-                ]
-            }
-        }
-        
-        return features.get(plan, features[UserPlan.FREE])
-
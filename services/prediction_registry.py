@@ -0,0 +1,149 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from config.settings import settings
+from services.shared_state import SharedStateStore
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+
+class PredictionRegistry:
+    """Tracks in-flight Replicate predictions resolved by the completion webhook"""
+
+    def __init__(self, max_early_results: int = 1000):
+        self.waiters: Dict[str, asyncio.Future] = {}
+        # Webhooks can arrive before the creating coroutine registers its waiter
+        self.early_results: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.max_early_results = max_early_results
+        # Set by attach(): where webhooks received by another process are published
+        self.state: Optional[SharedStateStore] = None
+        self.receives_webhooks = False
+
+    def attach(self, state: SharedStateStore, receives_webhooks: bool) -> None:
+        """Use state to hand webhooks between processes; receives_webhooks for the web app serving /replicate/webhook"""
+        self.state = state
+        self.receives_webhooks = receives_webhooks
+
+    @property
+    def shared(self) -> bool:
+        return self.state is not None and self.state.shared
+
+    @property
+    def available(self) -> bool:
+        """Whether a webhook can reach this process's waiters, otherwise predictions are polled.
+
+        The callback lands on any web worker, so without a shared store only a single web worker
+        serving the endpoint itself can wait for it (main_bot.py never receives callbacks).
+        """
+        return self.shared or (self.receives_webhooks and settings.web_concurrency <= 1)
+
+    def register(self, prediction_id: str) -> asyncio.Future:
+        """Register a waiter for a prediction and return its future"""
+        future = self.waiters.get(prediction_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.waiters[prediction_id] = future
+
+        early_result = self.early_results.pop(prediction_id, None)
+        if early_result is not None and not future.done():
+            future.set_result(early_result)
+
+        return future
+
+    def resolve(self, prediction: Dict[str, Any]) -> bool:
+        """Resolve the waiter for a finished prediction, returns True if one was waiting"""
+        prediction_id = prediction.get("id")
+        if not prediction_id or prediction.get("status") not in TERMINAL_STATUSES:
+            return False
+
+        future = self.waiters.get(prediction_id)
+        if future is None:
+            self.early_results[prediction_id] = prediction
+            while len(self.early_results) > self.max_early_results:
+                self.early_results.popitem(last=False)
+            return False
+
+        if not future.done():
+            future.set_result(prediction)
+        return True
+
+    async def publish(self, prediction: Dict[str, Any]) -> bool:
+        """Resolve a local waiter and, with a shared store, hand the result to waiters in other processes"""
+        resolved = self.resolve(prediction)
+        if self.shared and prediction.get("id") and prediction.get("status") in TERMINAL_STATUSES:
+            await self.state.set(
+                f"prediction:{prediction['id']}",
+                json.dumps(prediction),
+                expires_at=time.time() + settings.replicate_webhook_result_ttl
+            )
+        return resolved
+
+    async def wait(self, prediction_id: str, future: asyncio.Future, timeout: float) -> Optional[Dict[str, Any]]:
+        """Webhook result for a prediction within timeout, from this process or the shared store"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        key = f"prediction:{prediction_id}"
+        while True:
+            if self.shared:
+                value = (await self.state.get_many([key]))[key]
+                if value:
+                    return json.loads(value)
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            # Without a shared store only this process's waiter can be resolved
+            interval = min(settings.replicate_webhook_shared_interval, remaining) if self.shared else remaining
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def discard(self, prediction_id: str) -> None:
+        """Forget a prediction once its waiter is done"""
+        future = self.waiters.pop(prediction_id, None)
+        if future is not None and not future.done():
+            future.cancel()
+
+    def pending_count(self) -> int:
+        """Number of predictions currently awaiting a webhook"""
+        return len(self.waiters)
+
+def verify_webhook_signature(
+    secret: str,
+    headers: Dict[str, str],
+    body: bytes,
+    tolerance: int = 300
+) -> bool:
+    """Verify a Replicate webhook signature (webhook-id/timestamp/signature headers)"""
+    webhook_id = headers.get("webhook-id")
+    timestamp = headers.get("webhook-timestamp")
+    signatures = headers.get("webhook-signature")
+    if not webhook_id or not timestamp or not signatures:
+        return False
+
+    # Reject stale deliveries to limit replay
+    try:
+        if abs(time.time() - int(timestamp)) > tolerance:
+            return False
+    except ValueError:
+        return False
+
+    key = base64.b64decode(secret.split("_", 1)[1] if secret.startswith("whsec_") else secret)
+    signed_content = f"{webhook_id}.{timestamp}.".encode() + body
+    expected = base64.b64encode(hmac.new(key, signed_content, hashlib.sha256).digest()).decode()
+
+    for signature in signatures.split():
+        _, _, value = signature.partition(",")
+        if hmac.compare_digest(value, expected):
+            return True
+    return False
+
+# Global registry instance
+prediction_registry = PredictionRegistry()
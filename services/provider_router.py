@@ -0,0 +1,161 @@
+import logging
+import time
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from config.settings import settings
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class BreakerState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised when a call is refused because the provider's breaker is open"""
+
+class CircuitBreaker:
+    """Per-endpoint breaker with rolling success-rate and latency EWMAs"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = BreakerState.CLOSED
+        self.success_rate = 1.0
+        self.latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.calls = 0
+        self.failures = 0
+
+    def _transition(self, state: BreakerState) -> None:
+        if state != self.state:
+            logger.warning(f"Circuit breaker {self.name}: {self.state.value} -> {state.value}")
+            self.state = state
+            if state == BreakerState.OPEN:
+                self.opened_at = time.monotonic()
+                self.probes_in_flight = 0
+
+    def current_state(self) -> BreakerState:
+        """State after applying the open cooldown"""
+        if self.state == BreakerState.OPEN and time.monotonic() - self.opened_at >= settings.breaker_open_seconds:
+            self._transition(BreakerState.HALF_OPEN)
+        return self.state
+
+    def allow_request(self) -> bool:
+        """Whether a call may go through now, reserving a probe slot when half-open"""
+        state = self.current_state()
+        if state == BreakerState.CLOSED:
+            return True
+        if state == BreakerState.HALF_OPEN and self.probes_in_flight < settings.breaker_half_open_probes:
+            self.probes_in_flight += 1
+            return True
+        return False
+
+    def _observe(self, success: bool, latency: Optional[float]) -> None:
+        alpha = settings.breaker_ewma_alpha
+        self.calls += 1
+        self.success_rate = (1 - alpha) * self.success_rate + alpha * (1.0 if success else 0.0)
+        if latency is not None:
+            self.latency = latency if self.latency is None else (1 - alpha) * self.latency + alpha * latency
+
+    def record_success(self, latency: Optional[float] = None) -> None:
+        """Count a successful call"""
+        self._observe(True, latency)
+        self.consecutive_failures = 0
+        if self.state == BreakerState.HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            # Recovered, start a fresh success-rate window so one blip doesn't reopen it
+            self.success_rate = 1.0
+            self._transition(BreakerState.CLOSED)
+
+    def record_failure(self, latency: Optional[float] = None) -> None:
+        """Count a failed call, opening the breaker when the provider looks unhealthy"""
+        self._observe(False, latency)
+        self.failures += 1
+        self.consecutive_failures += 1
+
+        if self.state == BreakerState.HALF_OPEN:
+            self._transition(BreakerState.OPEN)
+        elif self.state == BreakerState.CLOSED and (
+            self.consecutive_failures >= settings.breaker_failure_threshold
+            or (self.calls >= settings.breaker_failure_threshold and self.success_rate < settings.breaker_min_success_rate)
+        ):
+            self._transition(BreakerState.OPEN)
+
+    def is_degraded(self) -> bool:
+        """Closed but slow or flaky enough that healthier providers should go first"""
+        if self.success_rate < settings.breaker_degraded_success_rate:
+            return True
+        return self.latency is not None and self.latency > settings.breaker_degraded_latency
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Breaker state for the admin endpoint"""
+        state = self.current_state()
+        return {
+            "state": state.value,
+            "success_rate": round(self.success_rate, 4),
+            "latency_ewma": round(self.latency, 3) if self.latency is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "calls": self.calls,
+            "failures": self.failures,
+            "degraded": self.is_degraded(),
+            "retry_in": max(0.0, settings.breaker_open_seconds - (time.monotonic() - self.opened_at)) if state == BreakerState.OPEN else 0.0
+        }
+
+class ProviderRouter:
+    """Orders providers by health and guards every call with its endpoint's breaker"""
+
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.rejected = metrics.counter("provider_breaker_rejected_total", "Calls refused by an open circuit breaker", ("endpoint",))
+        self.failures = metrics.counter("provider_call_failures_total", "Failed provider calls", ("endpoint",))
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        """Get or create the breaker for an endpoint such as 'fal.image'"""
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+    def available(self, endpoints: Iterable[str]) -> List[str]:
+        """Endpoints whose breaker isn't open, in preference order with degraded ones last"""
+        usable = [endpoint for endpoint in endpoints if self.breaker(endpoint).current_state() != BreakerState.OPEN]
+        return sorted(usable, key=lambda endpoint: self.breaker(endpoint).is_degraded())
+
+    async def call(self, endpoint: str, func: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        """Run a provider call through its breaker; result dicts with success=False count as failures"""
+        breaker = self.breaker(endpoint)
+        if not breaker.allow_request():
+            self.rejected.inc(endpoint=endpoint)
+            raise CircuitOpenError(f"Circuit breaker for {endpoint} is open")
+
+        start = time.monotonic()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception:
+            breaker.record_failure(time.monotonic() - start)
+            self.failures.inc(endpoint=endpoint)
+            raise
+        except BaseException:
+            # Cancelled (e.g. lost a hedged race), says nothing about provider health
+            if breaker.state == BreakerState.HALF_OPEN:
+                breaker.probes_in_flight = max(0, breaker.probes_in_flight - 1)
+            raise
+
+        if isinstance(result, dict) and not result.get("success", True):
+            breaker.record_failure(time.monotonic() - start)
+            self.failures.inc(endpoint=endpoint)
+        elif isinstance(result, dict) and result.get("cached"):
+            breaker.record_success()
+        else:
+            breaker.record_success(time.monotonic() - start)
+        return result
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Snapshot of every breaker"""
+        return {endpoint: breaker.snapshot() for endpoint, breaker in self.breakers.items()}
+
+# Global provider router
+provider_router = ProviderRouter()
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import random
+from abc import ABC, abstractmethod
+from enum import Enum
+from typing import Any, AsyncIterator, Dict, FrozenSet, List, Optional, Set, Tuple
+import httpx
+from config.settings import settings
+from services.http_client import http_pool
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class Capability(str, Enum):
+    TEXT = "text"
+    STREAM = "stream"
+    IMAGE = "image"
+    VIDEO = "video"
+    MUSIC = "music"
+    VISION = "vision"
+    LORA = "lora"
+    BATCH = "batch"
+
+# Statuses that mean the request wasn't processed and is safe to send again
+RETRYABLE_STATUSES = frozenset({429, 502, 503, 504})
+
+# Never reached the provider, so even a generation POST can be retried without paying twice
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+retries = metrics.counter("provider_retries_total", "Provider HTTP requests sent again under the shared retry policy", ("provider", "reason"))
+batch_sizes = metrics.histogram("provider_batch_size", "Requests sent together to a batch endpoint", ("provider", "endpoint"))
+
+class MicroBatcher:
+    """Collects single requests for one batch endpoint over a short window and sends them together"""
+
+    def __init__(self, provider: "Provider", endpoint: str, window: float, max_size: int):
+        self.provider = provider
+        self.endpoint = endpoint
+        self.window = window
+        self.max_size = max_size
+        self.pending: List[Tuple[Any, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.in_flight: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one request and wait for its share of the batch response"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        """Send whatever is pending now"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self._send(batch))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+    async def _send(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        batch_sizes.observe(len(batch), provider=self.provider.name, endpoint=self.endpoint)
+        try:
+            results = await self.provider.submit_batch(self.endpoint, [item for item, _ in batch])
+        except Exception as e:
+            logger.error(f"Batch of {len(batch)} to {self.provider.name} {self.endpoint} failed: {e}")
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            # Callers that gave up while waiting have a cancelled future
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def close(self) -> None:
+        """Send pending requests and wait for every batch in flight"""
+        self.flush()
+        await asyncio.gather(*self.in_flight, return_exceptions=True)
+
+class Provider(ABC):
+    """Async generation backend: declares its capabilities and shares the pooled client and retry policy"""
+
+    name: str = ""
+    capabilities: FrozenSet[Capability] = frozenset()
+
+    def __init__(self):
+        self.headers: Dict[str, str] = {}
+        self.batchers: Dict[str, MicroBatcher] = {}
+
+    @property
+    @abstractmethod
+    def configured(self) -> bool:
+        """Whether credentials are set, unconfigured providers are skipped"""
+
+    def supports(self, capability: Capability) -> bool:
+        return capability in self.capabilities
+
+    async def start(self) -> None:
+        """Open the pooled HTTP client ahead of the first request"""
+        http_pool.get_client(self.name)
+
+    async def close(self) -> None:
+        """Send pending micro-batches; the pooled client is closed by http_pool"""
+        await asyncio.gather(*(batcher.close() for batcher in self.batchers.values()))
+
+    async def __aenter__(self) -> "Provider":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def request(self, method: str, url: str, timeout: Optional[float] = None, **kwargs: Any) -> httpx.Response:
+        """HTTP request on the provider's pooled client, retrying only what can't have been processed"""
+        client = http_pool.get_client(self.name)
+        headers = {**self.headers, **kwargs.pop("headers", {})}
+        # Reads are idempotent, a timed-out GET is safe to repeat
+        retryable = RETRYABLE_ERRORS + ((httpx.ReadTimeout, httpx.RemoteProtocolError) if method == "GET" else ())
+
+        for attempt in range(settings.provider_max_retries + 1):
+            last_attempt = attempt == settings.provider_max_retries
+            try:
+                response = await client.request(method, url, headers=headers, timeout=timeout or settings.provider_timeout, **kwargs)
+            except retryable as e:
+                if last_attempt:
+                    raise
+                reason, retry_after = type(e).__name__, None
+            else:
+                if response.status_code not in RETRYABLE_STATUSES or last_attempt:
+                    return response
+                reason, retry_after = str(response.status_code), response.headers.get("Retry-After")
+
+            retries.inc(provider=self.name, reason=reason)
+            await asyncio.sleep(self._retry_delay(attempt, retry_after))
+
+    def _retry_delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        """Retry-After when the provider sent one, otherwise exponential backoff with full jitter"""
+        if retry_after:
+            try:
+                return min(float(retry_after), settings.provider_retry_max_delay)
+            except ValueError:
+                pass
+        return random.uniform(0, min(settings.provider_retry_backoff * 2 ** attempt, settings.provider_retry_max_delay))
+
+    async def batch(self, endpoint: str, item: Any, window: Optional[float] = None) -> Any:
+        """Send one request through the endpoint's micro-batcher"""
+        if not self.supports(Capability.BATCH):
+            raise NotImplementedError(f"{self.name} has no batch endpoints")
+        batcher = self.batchers.get(endpoint)
+        if batcher is None:
+            batcher = self.batchers[endpoint] = MicroBatcher(
+                self,
+                endpoint,
+                window if window is not None else settings.provider_batch_window,
+                settings.provider_batch_max_size
+            )
+        return await batcher.submit(item)
+
+    async def submit_batch(self, endpoint: str, items: List[Any]) -> List[Any]:
+        """One call to a batch endpoint; results (or exceptions) in the order of items"""
+        raise NotImplementedError
+
+    # Capability methods, only those listed in capabilities are implemented (callers check supports());
+    # media results are {"success", "url", "cost", ...} dicts
+    async def generate_text(self, message: str, model: str, history: Optional[List[Dict[str, str]]] = None) -> str:
+        raise NotImplementedError
+
+    async def stream_text(self, message: str, model: str, history: Optional[List[Dict[str, str]]] = None) -> AsyncIterator[str]:
+        raise NotImplementedError
+        yield
+
+    async def generate_image(self, prompt: str, **options: Any) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def generate_video(self, prompt: str, **options: Any) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def generate_music(self, prompt: str, **options: Any) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def analyze_image(self, image_url: str, prompt: str) -> str:
+        raise NotImplementedError
@@ -0,0 +1,69 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional
+from models.user import User, get_plan_limits
+from services.metrics import metrics
+from services.usage_events import usage_log
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class QuotaReservation:
+    """Units of a resource held for a user until the work is committed or refunded"""
+    telegram_id: int
+    resource: str
+    amount: int = 1
+    state: str = "reserved"  # reserved, committed or refunded
+    plan: str = ""
+
+class QuotaEngine:
+    """Reserve/commit/refund quota per (user, resource) on atomic shared counters"""
+
+    def __init__(self, user_service):
+        self.user_service = user_service
+        self.operations = metrics.counter("quota_operations_total", "Quota reservations by outcome", ("resource", "outcome"))
+
+    async def reserve(self, user: User, resource: str, amount: int = 1) -> Optional[QuotaReservation]:
+        """Atomically take amount units if the plan allows it, None when over the limit"""
+        plan_limits = get_plan_limits(user.plan)
+        limit = None if plan_limits.is_unlimited(resource) else getattr(plan_limits, resource)
+
+        value = await self.user_service.increment_usage(user, resource, amount, limit=limit)
+        if value is None:
+            self.operations.inc(resource=resource, outcome="rejected")
+            return None
+
+        self.operations.inc(resource=resource, outcome="reserved")
+        return QuotaReservation(user.telegram_id, resource, amount, plan=user.plan.value)
+
+    async def commit(
+        self,
+        reservation: QuotaReservation,
+        provider: Optional[str] = None,
+        model: Optional[str] = None,
+        cost: float = 0.0,
+        cached: bool = False
+    ) -> None:
+        """Keep the reserved units, the work they paid for was delivered, and log the usage event"""
+        if reservation.state != "reserved":
+            return
+        reservation.state = "committed"
+        self.operations.inc(resource=reservation.resource, outcome="committed")
+        usage_log.record(
+            reservation.telegram_id, reservation.plan, reservation.resource,
+            provider=provider, model=model, cost=cost, quantity=reservation.amount, cached=cached
+        )
+
+    async def refund(self, reservation: QuotaReservation) -> None:
+        """Give reserved units back (idempotent)"""
+        if reservation.state != "reserved":
+            return
+        reservation.state = "refunded"
+
+        user = await self.user_service.get_user_by_telegram_id(reservation.telegram_id)
+        if user is None:
+            logger.warning(f"Cannot refund {reservation.resource} for unknown user {reservation.telegram_id}")
+            return
+
+        await self.user_service.increment_usage(user, reservation.resource, -reservation.amount)
+        self.operations.inc(resource=reservation.resource, outcome="refunded")
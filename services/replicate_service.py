@@ -1,19 +1,48 @@
+import asyncio
+import contextvars
 import logging
-import httpx
-from typing import Optional, Dict, Any, List
+from typing import Dict, Any, Set
 from config.settings import settings
+from services.generation_cache import generation_cache
+from services.instrumentation import instrument_provider
+from services.prediction_registry import prediction_registry, TERMINAL_STATUSES
+from services.providers import Capability, Provider
 
 logger = logging.getLogger(__name__)
 
-class ReplicateService:
+# Set by callers whose work is resumed after a restart (background jobs): their cancellation
+# means shutdown, and the prediction is left alone instead of being cancelled remotely
+keep_predictions_on_cancel: contextvars.ContextVar[bool] = contextvars.ContextVar("keep_predictions_on_cancel", default=False)
+
+class ReplicateService(Provider):
+    name = "replicate"
+    capabilities = frozenset({Capability.IMAGE, Capability.VIDEO, Capability.MUSIC})
+
     def __init__(self):
+        super().__init__()
         self.api_token = settings.replicate_api_token
         self.base_url = "https://api.replicate.com/v1"
         self.headers = {
             "Authorization": f"Token {self.api_token}",
             "Content-Type": "application/json"
         }
+        # Unsigned callbacks could resolve predictions with arbitrary output, so no secret means polling
+        self.webhook_url = settings.replicate_webhook_url if settings.replicate_webhook_secret else None
+        if settings.replicate_webhook_url and not settings.replicate_webhook_secret:
+            logger.error("REPLICATE_WEBHOOK_URL is set without REPLICATE_WEBHOOK_SECRET, webhooks are disabled")
+        # Remote cancels outlive the cancelled caller, keep them referenced until they finish
+        self.cancel_tasks: Set[asyncio.Task] = set()
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_token)
 
+    async def close(self) -> None:
+        """Let remote cancels in flight finish before the pooled client goes away"""
+        await asyncio.gather(*self.cancel_tasks, return_exceptions=True)
+        await super().close()
+
+    @instrument_provider("replicate")
     async def generate_image(
         self,
         prompt: str,
@@ -25,52 +54,64 @@ class ReplicateService:
     ) -> Dict[str, Any]:
         """Generate image using Replicate models"""
         
+        # Identical prompts are answered from the cache without a paid call
+        if settings.generation_cache_enabled:
+            cached = await generation_cache.get(model, prompt, aspect_ratio)
+            if cached:
+                return {**cached, "success": True, "cached": True, "cost": 0.0, "model": model}
+        
         try:
-            async with httpx.AsyncClient() as client:
-                # Create prediction
-                payload = {
-                    "version": await self._get_model_version(model),
-                    "input": {
-                        "prompt": prompt,
-                        "aspect_ratio": aspect_ratio,
-                        "num_outputs": num_outputs,
-                        "output_format": output_format,
-                        "output_quality": output_quality
-                    }
+            # Create prediction
+            payload = {
+                "version": await self._get_model_version(model),
+                "input": {
+                    "prompt": prompt,
+                    "aspect_ratio": aspect_ratio,
+                    "num_outputs": num_outputs,
+                    "output_format": output_format,
+                    "output_quality": output_quality
                 }
+            }
+            
+            payload.update(self._webhook_fields())
+            
+            response = await self.request("POST", f"{self.base_url}/predictions", json=payload, timeout=60.0)
+            
+            if response.status_code == 201:
+                prediction = response.json()
                 
-                response = await client.post(
-                    f"{self.base_url}/predictions",
-                    headers=self.headers,
-                    json=payload,
-                    timeout=60.0
-                )
+                # Wait for completion
+                result = await self._wait_for_prediction(prediction["id"])
                 
-                if response.status_code == 201:
-                    prediction = response.json()
+                if result["status"] == "succeeded":
+                    generated = {
+                        "url": result["output"][0] if result["output"] else None,
+                        "cost": self._calculate_image_cost(model)
+                    }
                     
-                    # Wait for completion
-                    result = await self._wait_for_prediction(prediction["id"])
+                    cache_key = None
+                    if settings.generation_cache_enabled and generated["url"]:
+                        cache_key = await generation_cache.put(model, prompt, aspect_ratio, generated)
                     
-                    if result["status"] == "succeeded":
-                        return {
-                            "success": True,
-                            "image_url": result["output"][0] if result["output"] else None,
-                            "cost": self._calculate_image_cost(model),
-                            "prediction_id": result["id"]
-                        }
-                    else:
-                        return {
-                            "success": False,
-                            "error": f"Prediction failed: {result.get('error', 'Unknown error')}"
-                        }
+                    return {
+                        "success": True,
+                        **generated,
+                        "model": model,
+                        "prediction_id": result["id"],
+                        "cache_key": cache_key
+                    }
                 else:
-                    logger.error(f"Replicate API error: {response.status_code} - {response.text}")
                     return {
                         "success": False,
-                        "error": f"API error: {response.status_code}"
+                        "error": f"Prediction failed: {result.get('error', 'Unknown error')}"
                     }
-                    
+            else:
+                logger.error(f"Replicate API error: {response.status_code} - {response.text}")
+                return {
+                    "success": False,
+                    "error": f"API error: {response.status_code}"
+                }
+                
         except Exception as e:
             logger.error(f"Error generating image with Replicate: {e}")
             return {
@@ -78,6 +119,7 @@ class ReplicateService:
                 "error": str(e)
             }
 
+    @instrument_provider("replicate")
     async def generate_video(
         self,
         prompt: str,
@@ -87,47 +129,43 @@ class ReplicateService:
         """Generate video using Replicate models"""
         
         try:
-            async with httpx.AsyncClient() as client:
-                payload = {
-                    "version": await self._get_model_version(model),
-                    "input": {
-                        "prompt": prompt,
-                        "duration": duration
-                    }
+            payload = {
+                "version": await self._get_model_version(model),
+                "input": {
+                    "prompt": prompt,
+                    "duration": duration
                 }
+            }
+            
+            payload.update(self._webhook_fields())
+            
+            response = await self.request("POST", f"{self.base_url}/predictions", json=payload, timeout=60.0)
+            
+            if response.status_code == 201:
+                prediction = response.json()
                 
-                response = await client.post(
-                    f"{self.base_url}/predictions",
-                    headers=self.headers,
-                    json=payload,
-                    timeout=60.0
-                )
+                # Wait for completion (videos take longer)
+                result = await self._wait_for_prediction(prediction["id"], timeout=300)
                 
-                if response.status_code == 201:
-                    prediction = response.json()
-                    
-                    # Wait for completion (videos take longer)
-                    result = await self._wait_for_prediction(prediction["id"], timeout=300)
-                    
-                    if result["status"] == "succeeded":
-                        return {
-                            "success": True,
-                            "video_url": result["output"],
-                            "cost": self._calculate_video_cost(model, duration),
-                            "prediction_id": result["id"]
-                        }
-                    else:
-                        return {
-                            "success": False,
-                            "error": f"Prediction failed: {result.get('error', 'Unknown error')}"
-                        }
+                if result["status"] == "succeeded":
+                    return {
+                        "success": True,
+                        "url": result["output"],
+                        "cost": self._calculate_video_cost(model, duration),
+                        "prediction_id": result["id"]
+                    }
                 else:
-                    logger.error(f"Replicate video API error: {response.status_code} - {response.text}")
                     return {
                         "success": False,
-                        "error": f"API error: {response.status_code}"
+                        "error": f"Prediction failed: {result.get('error', 'Unknown error')}"
                     }
-                    
+            else:
+                logger.error(f"Replicate video API error: {response.status_code} - {response.text}")
+                return {
+                    "success": False,
+                    "error": f"API error: {response.status_code}"
+                }
+                
         except Exception as e:
             logger.error(f"Error generating video with Replicate: {e}")
             return {
@@ -135,6 +173,7 @@ class ReplicateService:
                 "error": str(e)
             }
 
+    @instrument_provider("replicate")
     async def generate_music(
         self,
         prompt: str,
@@ -144,47 +183,44 @@ class ReplicateService:
         """Generate music using Replicate models"""
         
         try:
-            async with httpx.AsyncClient() as client:
-                payload = {
-                    "version": await self._get_model_version(model),
-                    "input": {
-                        "prompt": prompt,
-                        "duration": duration
-                    }
+            payload = {
+                "version": await self._get_model_version(model),
+                "input": {
+                    "prompt": prompt,
+                    "duration": duration
                 }
+            }
+            
+            payload.update(self._webhook_fields())
+            
+            response = await self.request("POST", f"{self.base_url}/predictions", json=payload, timeout=60.0)
+            
+            if response.status_code == 201:
+                prediction = response.json()
                 
-                response = await client.post(
-                    f"{self.base_url}/predictions",
-                    headers=self.headers,
-                    json=payload,
-                    timeout=60.0
-                )
+                # Wait for completion
+                result = await self._wait_for_prediction(prediction["id"], timeout=180)
                 
-                if response.status_code == 201:
-                    prediction = response.json()
-                    
-                    # Wait for completion
-                    result = await self._wait_for_prediction(prediction["id"], timeout=180)
-                    
-                    if result["status"] == "succeeded":
-                        return {
-                            "success": True,
-                            "audio_url": result["output"],
-                            "cost": self._calculate_music_cost(model, duration),
-                            "prediction_id": result["id"]
-                        }
-                    else:
-                        return {
-                            "success": False,
-                            "error": f"Prediction failed: {result.get('error', 'Unknown error')}"
-                        }
+                if result["status"] == "succeeded":
+                    return {
+                        "success": True,
+                        "url": result["output"],
+                        "cost": self._calculate_music_cost(model, duration),
+                        "model": model,
+                        "prediction_id": result["id"]
+                    }
                 else:
-                    logger.error(f"Replicate music API error: {response.status_code} - {response.text}")
                     return {
                         "success": False,
-                        "error": f"API error: {response.status_code}"
+                        "error": f"Prediction failed: {result.get('error', 'Unknown error')}"
                     }
-                    
+            else:
+                logger.error(f"Replicate music API error: {response.status_code} - {response.text}")
+                return {
+                    "success": False,
+                    "error": f"API error: {response.status_code}"
+                }
+                
         except Exception as e:
             logger.error(f"Error generating music with Replicate: {e}")
             return {
@@ -192,40 +228,67 @@ class ReplicateService:
                 "error": str(e)
             }
 
+    def _webhook_fields(self) -> Dict[str, Any]:
+        """Webhook fields for prediction creation when completion callbacks are configured"""
+        
+        if not self.webhook_url or not prediction_registry.available:
+            return {}
+        
+        return {
+            "webhook": self.webhook_url,
+            "webhook_events_filter": ["completed"]
+        }
+
     async def _wait_for_prediction(self, prediction_id: str, timeout: int = 120) -> Dict[str, Any]:
-        """Wait for prediction to complete"""
+        """Wait for prediction to complete via webhook, polling with backoff as fallback"""
         
-        import asyncio
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
         
-        async with httpx.AsyncClient() as client:
-            start_time = asyncio.get_event_loop().time()
-            
+        # With a webhook configured polling is only a safety net, so start slow
+        waiter = prediction_registry.register(prediction_id) if self.webhook_url and prediction_registry.available else None
+        delay = settings.replicate_webhook_fallback_interval if waiter else settings.replicate_poll_initial_interval
+        
+        try:
             while True:
-                response = await client.get(
-                    f"{self.base_url}/predictions/{prediction_id}",
-                    headers=self.headers
-                )
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return {
+                        "status": "failed",
+                        "error": "Timeout waiting for prediction"
+                    }
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    if result["status"] in ["succeeded", "failed", "canceled"]:
+                if waiter:
+                    result = await prediction_registry.wait(prediction_id, waiter, min(delay, remaining))
+                    if result is not None:
                         return result
-                    
-                    # Check timeout
-                    if asyncio.get_event_loop().time() - start_time > timeout:
-                        return {
-                            "status": "failed",
-                            "error": "Timeout waiting for prediction"
-                        }
-                    
-                    # Wait before next check
-                    await asyncio.sleep(2)
                 else:
+                    await asyncio.sleep(min(delay, remaining))
+                
+                response = await self.request("GET", f"{self.base_url}/predictions/{prediction_id}")
+                
+                if response.status_code != 200:
                     return {
                         "status": "failed",
                         "error": f"Failed to check prediction status: {response.status_code}"
                     }
+                
+                result = response.json()
+                if result["status"] in TERMINAL_STATUSES:
+                    return result
+                
+                # Back off between polls, long jobs don't need 2 s resolution
+                delay = min(delay * settings.replicate_poll_backoff, settings.replicate_poll_max_interval)
+        except asyncio.CancelledError:
+            # Caller gave up (e.g. lost a hedged race), stop paying for the prediction
+            if not keep_predictions_on_cancel.get():
+                task = asyncio.create_task(self.cancel_prediction(prediction_id))
+                self.cancel_tasks.add(task)
+                task.add_done_callback(self.cancel_tasks.discard)
+            raise
+        finally:
+            if waiter:
+                prediction_registry.discard(prediction_id)
 
     async def _get_model_version(self, model: str) -> str:
         """Get the latest version of a model"""
@@ -339,23 +402,30 @@ class ReplicateService:
             ]
         }
 
+    async def cancel_prediction(self, prediction_id: str) -> bool:
+        """Cancel a running prediction"""
+        
+        try:
+            response = await self.request("POST", f"{self.base_url}/predictions/{prediction_id}/cancel")
+            return response.status_code == 200
+                
+        except Exception as e:
+            logger.error(f"Error cancelling prediction {prediction_id}: {e}")
+            return False
+
     async def get_prediction_status(self, prediction_id: str) -> Dict[str, Any]:
         """Get status of a specific prediction"""
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/predictions/{prediction_id}",
-                    headers=self.headers
-                )
+            response = await self.request("GET", f"{self.base_url}/predictions/{prediction_id}")
+            
+            if response.status_code == 200:
+                return response.json()
+            else:
+                return {
+                    "error": f"Failed to get prediction status: {response.status_code}"
+                }
                 
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    return {
-                        "error": f"Failed to get prediction status: {response.status_code}"
-                    }
-                    
         except Exception as e:
             logger.error(f"Error getting prediction status: {e}")
             return {
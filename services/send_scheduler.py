@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Coroutine, Dict, Optional, Tuple
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config.settings import settings
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Edits where only the latest content matters, a newer one replaces a queued one
+COALESCED_ENDPOINTS = frozenset({"editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup"})
+
+# Calls that don't count as messages in a chat, they only take a global token
+CHAT_EXEMPT_ENDPOINTS = frozenset({"deleteMessage", "sendChatAction", "answerCallbackQuery"})
+
+class TokenBucket:
+    """Token bucket handing out send slots in FIFO order; tokens may go negative to book future slots"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self, now: float) -> float:
+        """Book one slot, returns how long to wait before using it"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.paused_until - now)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every slot until Telegram's retry_after has passed"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        """Full again and not paused, safe to forget"""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity and now >= self.paused_until
+
+class _OutboundRequest:
+    """Payload of a queued call; for edits, newer content of the same message may replace it"""
+
+    def __init__(self, args: Any, kwargs: Dict[str, Any]):
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Optional[asyncio.Future] = None
+
+class SendScheduler(BaseRateLimiter[Dict[str, Any]]):
+    """Bot API rate limiter: global and per-chat token buckets, retry_after backoff and edit coalescing"""
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(settings.telegram_global_rate, settings.telegram_global_burst)
+        self.chat_buckets: Dict[Any, TokenBucket] = {}
+        self.pending_edits: Dict[Tuple[str, Any, Any], _OutboundRequest] = {}
+        self.reservations = 0
+
+        self.wait_time = metrics.histogram("telegram_send_wait_seconds", "Time outbound Bot API calls waited for a send slot", ("endpoint",))
+        self.throttled = metrics.counter("telegram_flood_waits_total", "429 responses from Telegram", ("scope",))
+        self.coalesced = metrics.counter("telegram_edits_coalesced_total", "Edits dropped because a newer edit of the same message replaced them")
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # Negative ids are groups and channels, which Telegram limits to ~20 messages a minute
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(settings.telegram_group_rate, settings.telegram_group_burst)
+            else:
+                bucket = TokenBucket(settings.telegram_chat_rate, settings.telegram_chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune(self, now: float) -> None:
+        self.reservations += 1
+        if self.reservations % 1000 == 0:
+            for chat_id in [chat_id for chat_id, bucket in self.chat_buckets.items() if bucket.idle(now)]:
+                del self.chat_buckets[chat_id]
+
+    async def _acquire(self, endpoint: str, chat_id: Any) -> None:
+        """Wait for a per-chat slot, then a global one"""
+        start = time.monotonic()
+        self._prune(start)
+        if chat_id is not None and endpoint not in CHAT_EXEMPT_ENDPOINTS:
+            wait = self._chat_bucket(chat_id).reserve(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+        wait = self.global_bucket.reserve(time.monotonic())
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self.wait_time.observe(time.monotonic() - start, endpoint=endpoint)
+
+    def _back_off(self, error: RetryAfter, endpoint: str, chat_id: Any) -> None:
+        retry_after = error.retry_after.total_seconds() if hasattr(error.retry_after, "total_seconds") else float(error.retry_after)
+        scope = "chat" if chat_id is not None else "global"
+        self.throttled.inc(scope=scope)
+        logger.warning(f"Telegram flood limit on {endpoint} ({scope}), retrying in {retry_after}s")
+        (self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket).pause(retry_after)
+
+    async def _send(
+        self,
+        callback: Callable[..., Coroutine],
+        request: _OutboundRequest,
+        endpoint: str,
+        chat_id: Any,
+        max_retries: int,
+        acquired: bool = False
+    ):
+        """Send once a slot is free, sleeping out 429s and retrying up to max_retries times"""
+        for attempt in range(max_retries + 1):
+            if not acquired:
+                await self._acquire(endpoint, chat_id)
+            acquired = False
+            try:
+                return await callback(*request.args, **request.kwargs)
+            except RetryAfter as e:
+                self._back_off(e, endpoint, chat_id)
+                if attempt == max_retries:
+                    raise
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]]
+    ):
+        chat_id = data.get("chat_id")
+        max_retries = (rate_limit_args or {}).get("max_retries", settings.telegram_max_retries)
+
+        message_id = data.get("message_id") or data.get("inline_message_id")
+        if endpoint not in COALESCED_ENDPOINTS or message_id is None:
+            return await self._send(callback, _OutboundRequest(args, kwargs), endpoint, chat_id, max_retries)
+
+        key = (endpoint, chat_id, message_id)
+        pending = self.pending_edits.get(key)
+        if pending is not None:
+            # Still waiting for a slot: send this content instead and share the result
+            pending.args, pending.kwargs = args, kwargs
+            self.coalesced.inc()
+            return await asyncio.shield(pending.future)
+
+        request = self.pending_edits[key] = _OutboundRequest(args, kwargs)
+        request.future = asyncio.get_running_loop().create_future()
+        try:
+            try:
+                await self._acquire(endpoint, chat_id)
+            finally:
+                # From here on the payload is fixed, later edits queue behind this one
+                del self.pending_edits[key]
+            result = await self._send(callback, request, endpoint, chat_id, max_retries, acquired=True)
+        except asyncio.CancelledError:
+            request.future.cancel()
+            raise
+        except Exception as e:
+            request.future.set_exception(e)
+            # Callers that were coalesced into this edit see the error, it isn't "never retrieved"
+            request.future.exception()
+            raise
+        request.future.set_result(result)
+        return result
@@ -0,0 +1,320 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Optional
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+class SharedStateStore(ABC):
+    """Atomic counters and leases shared by every worker process"""
+
+    # Whether other processes can see this store's state
+    shared = True
+
+    async def initialize(self) -> None:
+        """Prepare the backend (idempotent)"""
+
+    @abstractmethod
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Current values for keys, None when absent"""
+
+    @abstractmethod
+    async def set(self, key: str, value: str, expires_at: Optional[float] = None) -> None:
+        """Overwrite a value, dropped by compact() after expires_at when given"""
+
+    @abstractmethod
+    async def incr(
+        self,
+        key: str,
+        amount: int = 1,
+        limit: Optional[int] = None,
+        initial: int = 0,
+        expires_at: Optional[float] = None
+    ) -> Optional[int]:
+        """Atomically add to a counter (seeded with initial when absent), floored at 0.
+
+        Returns the new value, or None without changing anything when it would exceed limit.
+        Counters with expires_at are dropped by compact() once that time has passed.
+        """
+
+    async def compact(self) -> int:
+        """Delete expired counters in bulk, returns how many were removed"""
+        return 0
+
+    @abstractmethod
+    async def claim(self, key: str, owner: str, ttl: float) -> bool:
+        """Take a lease on key unless another owner holds an unexpired one"""
+
+    @abstractmethod
+    async def release(self, key: str, owner: str) -> None:
+        """Drop a lease held by owner"""
+
+    async def close(self) -> None:
+        """Release backend resources"""
+
+class MemoryStateStore(SharedStateStore):
+    """In-process state for single-worker deployments"""
+
+    shared = False
+
+    def __init__(self):
+        self.values: Dict[str, str] = {}
+        self.expiries: Dict[str, float] = {}
+        self.leases: Dict[str, tuple] = {}
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Optional[str]]:
+        return {key: self.values.get(key) for key in keys}
+
+    async def set(self, key: str, value: str, expires_at: Optional[float] = None) -> None:
+        self.values[key] = str(value)
+        if expires_at is not None:
+            self.expiries[key] = expires_at
+        else:
+            self.expiries.pop(key, None)
+
+    async def incr(self, key: str, amount: int = 1, limit: Optional[int] = None, initial: int = 0, expires_at: Optional[float] = None) -> Optional[int]:
+        value = max(0, int(self.values.get(key, initial)) + amount)
+        if limit is not None and amount > 0 and value > limit:
+            return None
+        self.values[key] = str(value)
+        if expires_at is not None:
+            self.expiries[key] = expires_at
+        return value
+
+    async def compact(self) -> int:
+        now = time.time()
+        expired = [key for key, expires_at in self.expiries.items() if expires_at <= now]
+        for key in expired:
+            self.values.pop(key, None)
+            del self.expiries[key]
+        for key in [key for key, holder in self.leases.items() if holder[1] <= now]:
+            del self.leases[key]
+        return len(expired)
+
+    async def claim(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        holder = self.leases.get(key)
+        if holder and holder[0] != owner and holder[1] > now:
+            return False
+        self.leases[key] = (owner, now + ttl)
+        return True
+
+    async def release(self, key: str, owner: str) -> None:
+        if self.leases.get(key, (None,))[0] == owner:
+            del self.leases[key]
+
+class SQLiteStateStore(SharedStateStore):
+    """State in a local SQLite file, shared by worker processes on one host"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Autocommit mode, writes take explicit BEGIN IMMEDIATE locks
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+            if "expires_at" not in {row[1] for row in conn.execute("PRAGMA table_info(state)")}:
+                conn.execute("ALTER TABLE state ADD COLUMN expires_at REAL")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_state_expires_at ON state(expires_at) WHERE expires_at IS NOT NULL")
+            conn.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+            self.conn = conn
+        return self.conn
+
+    def _get_many(self, keys: list) -> Dict[str, Optional[str]]:
+        result = dict.fromkeys(keys)
+        with self.lock:
+            rows = self._connect().execute(
+                f"SELECT key, value FROM state WHERE key IN ({', '.join('?' for _ in keys)})", keys
+            ).fetchall()
+        result.update(rows)
+        return result
+
+    def _set(self, key: str, value: str, expires_at: Optional[float]) -> None:
+        with self.lock:
+            self._connect().execute("INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)", (key, str(value), expires_at))
+
+    def _incr(self, key: str, amount: int, limit: Optional[int], initial: int, expires_at: Optional[float]) -> Optional[int]:
+        with self.lock:
+            conn = self._connect()
+            # BEGIN IMMEDIATE takes the write lock first, so the read-check-write is atomic across processes
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+                value = max(0, int(row[0] if row else initial) + amount)
+                if limit is not None and amount > 0 and value > limit:
+                    conn.execute("ROLLBACK")
+                    return None
+                conn.execute("INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)", (key, str(value), expires_at))
+                conn.execute("COMMIT")
+                return value
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _compact(self) -> int:
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            removed = conn.execute("DELETE FROM state WHERE expires_at <= ?", (now,)).rowcount
+            conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+        return removed
+
+    def _claim(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self.lock:
+            cursor = self._connect().execute("""
+                INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE leases.owner = excluded.owner OR leases.expires_at <= ?
+            """, (key, owner, now + ttl, now))
+        return cursor.rowcount == 1
+
+    def _release(self, key: str, owner: str) -> None:
+        with self.lock:
+            self._connect().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+    async def initialize(self) -> None:
+        await asyncio.to_thread(self._locked_connect)
+
+    def _locked_connect(self) -> None:
+        with self.lock:
+            self._connect()
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Optional[str]]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        return await asyncio.to_thread(self._get_many, keys)
+
+    async def set(self, key: str, value: str, expires_at: Optional[float] = None) -> None:
+        await asyncio.to_thread(self._set, key, value, expires_at)
+
+    async def incr(self, key: str, amount: int = 1, limit: Optional[int] = None, initial: int = 0, expires_at: Optional[float] = None) -> Optional[int]:
+        return await asyncio.to_thread(self._incr, key, amount, limit, initial, expires_at)
+
+    async def compact(self) -> int:
+        return await asyncio.to_thread(self._compact)
+
+    async def claim(self, key: str, owner: str, ttl: float) -> bool:
+        return await asyncio.to_thread(self._claim, key, owner, ttl)
+
+    async def release(self, key: str, owner: str) -> None:
+        await asyncio.to_thread(self._release, key, owner)
+
+    async def close(self) -> None:
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+# Check-and-increment in one round trip: KEYS[1], ARGV = amount, limit (-1 = none), initial, expiry ms (0 = none)
+_REDIS_INCR = """
+local current = redis.call('GET', KEYS[1])
+if not current then current = ARGV[3] end
+local value = tonumber(current) + tonumber(ARGV[1])
+if value < 0 then value = 0 end
+local limit = tonumber(ARGV[2])
+if limit >= 0 and tonumber(ARGV[1]) > 0 and value > limit then return -1 end
+redis.call('SET', KEYS[1], value)
+if tonumber(ARGV[4]) > 0 then redis.call('PEXPIREAT', KEYS[1], ARGV[4]) end
+return value
+"""
+
+# Take or renew a lease in one step: KEYS[1], ARGV = owner, ttl ms; 1 when owner holds it afterwards
+_REDIS_CLAIM = """
+if redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2], 'NX') then return 1 end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Drop a lease only while owner still holds it: KEYS[1], ARGV = owner
+_REDIS_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+class RedisStateStore(SharedStateStore):
+    """State in Redis or any RESP-compatible server (KeyDB, Dragonfly, a local redis-server)"""
+
+    def __init__(self, url: str, prefix: str = "bot:"):
+        self.url = url
+        self.prefix = prefix
+        self.client = None
+        self.incr_script = None
+        self.claim_script = None
+        self.release_script = None
+
+    async def initialize(self) -> None:
+        if self.client is None:
+            import redis.asyncio as redis
+            self.client = redis.from_url(self.url, decode_responses=True)
+            self.incr_script = self.client.register_script(_REDIS_INCR)
+            self.claim_script = self.client.register_script(_REDIS_CLAIM)
+            self.release_script = self.client.register_script(_REDIS_RELEASE)
+            logger.info("Redis shared state store initialized")
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Optional[str]]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        await self.initialize()
+        values = await self.client.mget([self.prefix + key for key in keys])
+        return dict(zip(keys, values))
+
+    async def set(self, key: str, value: str, expires_at: Optional[float] = None) -> None:
+        await self.initialize()
+        await self.client.set(self.prefix + key, str(value), pxat=int(expires_at * 1000) if expires_at else None)
+
+    async def incr(self, key: str, amount: int = 1, limit: Optional[int] = None, initial: int = 0, expires_at: Optional[float] = None) -> Optional[int]:
+        # Expired buckets are evicted by Redis itself, compact() has nothing to do
+        await self.initialize()
+        args = [amount, -1 if limit is None else limit, initial, int(expires_at * 1000) if expires_at else 0]
+        value = await self.incr_script(keys=[self.prefix + key], args=args)
+        return None if int(value) < 0 else int(value)
+
+    async def claim(self, key: str, owner: str, ttl: float) -> bool:
+        await self.initialize()
+        # Check and renew in one script, a lease that expires in between can't be extended for its new owner
+        return bool(await self.claim_script(keys=[f"{self.prefix}lease:{key}"], args=[owner, int(ttl * 1000)]))
+
+    async def release(self, key: str, owner: str) -> None:
+        await self.initialize()
+        await self.release_script(keys=[f"{self.prefix}lease:{key}"], args=[owner])
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+def create_state_store() -> SharedStateStore:
+    """Build the shared state store selected in settings"""
+    backend = settings.shared_state_backend.lower()
+
+    if backend == "memory":
+        return MemoryStateStore()
+
+    if backend == "sqlite":
+        return SQLiteStateStore(settings.shared_state_db_path)
+
+    if backend == "redis":
+        if not settings.redis_url:
+            raise ValueError("REDIS_URL is required for the redis shared state store")
+        return RedisStateStore(settings.redis_url)
+
+    raise ValueError(f"Unknown shared state backend: {settings.shared_state_backend}")
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from telegram import Bot
+from config.settings import settings
+from models.user import UserPlan, get_plan_limits
+from services.metrics import metrics
+from bot_messages import get_payment_success_message
+
+logger = logging.getLogger(__name__)
+
+class StripeEventLedger:
+    """Every Stripe event id seen, so retried deliveries are applied at most once"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS stripe_events (
+                    event_id TEXT PRIMARY KEY,
+                    event_type TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    received_at REAL NOT NULL,
+                    processed_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_stripe_events_pending ON stripe_events(received_at) WHERE status = 'pending'")
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def _record(self, event: Dict[str, Any]) -> bool:
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO stripe_events (event_id, event_type, payload, status, received_at) VALUES (?, ?, ?, 'pending', ?)",
+                    (event["event_id"], event["event_type"], json.dumps(event), time.time())
+                )
+        return cursor.rowcount == 1
+
+    def _update(self, event_id: str, fields: Dict[str, Any]) -> None:
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    f"UPDATE stripe_events SET {', '.join(f'{name} = ?' for name in fields)} WHERE event_id = ?",
+                    (*fields.values(), event_id)
+                )
+
+    def _status(self, event_id: str) -> Optional[str]:
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT status FROM stripe_events WHERE event_id = ?", (event_id,)
+            ).fetchone()
+        return row["status"] if row else None
+
+    def _pending(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self._connect().execute(
+                "SELECT payload, attempts FROM stripe_events WHERE status = 'pending' ORDER BY received_at"
+            ).fetchall()
+        return [{**json.loads(row["payload"]), "attempts": row["attempts"]} for row in rows]
+
+    async def record(self, event: Dict[str, Any]) -> bool:
+        """Insert an event as pending, False when its id was already recorded"""
+        return await asyncio.to_thread(self._record, event)
+
+    async def update(self, event_id: str, **fields: Any) -> None:
+        await asyncio.to_thread(self._update, event_id, fields)
+
+    async def status(self, event_id: str) -> Optional[str]:
+        """Ledger status of an event, None when it was never recorded"""
+        return await asyncio.to_thread(self._status, event_id)
+
+    async def pending(self) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self._pending)
+
+    async def close(self) -> None:
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+class StripeEventProcessor:
+    """Records verified Stripe events and applies their side effects off the request path"""
+
+    def __init__(self, user_service, ledger: Optional[StripeEventLedger] = None):
+        self.user_service = user_service
+        self.ledger = ledger or StripeEventLedger(settings.stripe_events_db_path)
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.workers: List[asyncio.Task] = []
+        self.bot: Optional[Bot] = None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.events = metrics.counter("stripe_events_total", "Stripe webhook events by outcome", ("event_type", "outcome"))
+
+    async def start(self, bot: Optional[Bot] = None) -> None:
+        """Resume events recorded but not applied before the last shutdown, then start the workers"""
+        self.bot = bot
+
+        for event in await self.ledger.pending():
+            logger.info(f"Resuming Stripe event {event['event_id']} ({event['event_type']})")
+            self.queue.put_nowait(event)
+
+        for index in range(settings.stripe_event_workers):
+            self.workers.append(asyncio.create_task(self._worker(f"{self.owner}:{index}")))
+
+    async def close(self) -> None:
+        """Stop the workers, pending events stay in the ledger for the next start"""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+        await self.ledger.close()
+
+    async def submit(self, event: Dict[str, Any]) -> bool:
+        """Record a parsed event and queue it; False for a redelivery that was already recorded"""
+        if not await self.ledger.record(event):
+            self.events.inc(event_type=event["event_type"], outcome="duplicate")
+            return False
+
+        self.events.inc(event_type=event["event_type"], outcome="accepted")
+        self.queue.put_nowait({**event, "attempts": 0})
+        return True
+
+    async def _worker(self, owner: str) -> None:
+        # Leases are held per worker, two workers of one process must not share a claim
+        while True:
+            event = await self.queue.get()
+            lease = f"stripe:{event['event_id']}"
+            try:
+                if not await self.user_service.state.claim(lease, owner, settings.stripe_event_lease_seconds):
+                    logger.info(f"Stripe event {event['event_id']} is being applied by another worker")
+                    continue
+                # Every process queues the pending rows at startup and the lease is dropped once an
+                # event is applied, so the ledger decides whether this copy still needs applying
+                if await self.ledger.status(event["event_id"]) != "pending":
+                    logger.info(f"Stripe event {event['event_id']} was already applied")
+                    continue
+                outcome = await self._apply(event)
+                await self.ledger.update(event["event_id"], status=outcome, processed_at=time.time())
+                self.events.inc(event_type=event["event_type"], outcome=outcome)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._retry(event, str(e))
+            finally:
+                self.queue.task_done()
+                try:
+                    await self.user_service.state.release(lease, owner)
+                except Exception as e:
+                    logger.warning(f"Error releasing lease for Stripe event {event['event_id']}: {e}")
+
+    async def _retry(self, event: Dict[str, Any], error: str) -> None:
+        """Requeue a failed event after a delay, giving up after stripe_event_max_attempts"""
+        event["attempts"] += 1
+        if event["attempts"] >= settings.stripe_event_max_attempts:
+            logger.error(f"Giving up on Stripe event {event['event_id']}: {error}")
+            await self.ledger.update(event["event_id"], status="failed", attempts=event["attempts"], error=error)
+            self.events.inc(event_type=event["event_type"], outcome="failed")
+            return
+
+        logger.warning(f"Stripe event {event['event_id']} failed (attempt {event['attempts']}): {error}")
+        await self.ledger.update(event["event_id"], attempts=event["attempts"], error=error)
+        asyncio.get_running_loop().call_later(settings.stripe_event_retry_delay, self.queue.put_nowait, event)
+
+    async def _apply(self, event: Dict[str, Any]) -> str:
+        """Apply one event, returns the ledger status"""
+        if event["event_type"] != "subscription_created":
+            # Payments and cancellations are only recorded for now
+            return "recorded"
+
+        plan = UserPlan(event["plan"])
+        billing_anchor = datetime.fromtimestamp(event["billing_anchor"], timezone.utc) if event.get("billing_anchor") else None
+        if not await self.user_service.upgrade_user_plan(event["user_id"], plan, billing_anchor=billing_anchor):
+            raise ValueError(f"Unknown user {event['user_id']}")
+
+        if self.bot is not None:
+            try:
+                await self.bot.send_message(
+                    chat_id=event["user_id"],
+                    text=get_payment_success_message(get_plan_limits(plan).name),
+                    parse_mode='Markdown'
+                )
+            except Exception as e:
+                # The upgrade already happened, a lost confirmation must not replay it
+                logger.warning(f"Could not send payment confirmation to {event['user_id']}: {e}")
+        return "applied"
+
+    def stats(self) -> Dict[str, int]:
+        """Events waiting to be applied"""
+        return {
+            "queued": self.queue.qsize(),
+            "workers": len(self.workers)
+        }
@@ -1,19 +1,57 @@
+import asyncio
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Message, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import ContextTypes
 from typing import Optional
 
-from models.user import User, UserPlan, PLAN_CONFIGS
+from config.settings import settings
+from models.user import PLAN_CONFIGS, User, get_plan_limits
 from services.user_service import UserService
 from services.ai_service import AIService
+from services.conversation_service import ConversationService
+from services.quota import QuotaEngine
+from services.moderation import prompt_moderator
+from services.instrumentation import instrument_handler
 
 logger = logging.getLogger(__name__)
 
+# Telegram rejects messages longer than this
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+def _plans_text() -> str:
+    """/plans text built from the plan-limits registry, so quoted limits are the enforced ones"""
+    sections = ["💎 **Planos Disponíveis:**"]
+    for limits in PLAN_CONFIGS.values():
+        lines = [f"**{limits.name}** - {limits.price}"]
+        lines.extend(f"• {feature}" for feature in limits.features)
+        sections.append("\n".join(lines))
+    sections.append("Para fazer upgrade, entre em contato conosco!")
+    return "\n\n".join(sections)
+
+# The registry is immutable, build the text once
+PLANS_TEXT = _plans_text()
+
+# Replies for prompts refused by the moderation pre-flight, by verdict reason
+PROMPT_REFUSED_MESSAGES = {
+    "invalid_prompt": "❌ Por favor, forneça uma descrição válida.",
+    "prompt_too_long": "❌ Descrição muito longa. Encurte e tente novamente.",
+    "prompt_language": "❌ Idioma não suportado. Descreva em português ou inglês.",
+    "prompt_rejected": "🚫 Essa descrição viola nossa política de conteúdo. Nada foi descontado do seu plano.",
+    "api_error": "❌ Não foi possível verificar a descrição agora. Tente novamente."
+}
+
 class TelegramService:
-    def __init__(self):
-        self.user_service = UserService()
+    def __init__(self, user_service: Optional[UserService] = None):
+        # Share the application's UserService so quotas and plans stay consistent
+        self.user_service = user_service or UserService()
+        self.quota = QuotaEngine(self.user_service)
         self.ai_service = AIService()
+        self.conversation_service = ConversationService(
+            summarizer=self.ai_service.summarize_conversation if settings.conversation_summarize else None
+        )
 
+    @instrument_handler
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /start command"""
         user = update.effective_user
@@ -50,6 +88,7 @@ Envie uma mensagem ou imagem para começar! 🚀
         
         await update.message.reply_text(welcome_message, parse_mode='Markdown')
 
+    @instrument_handler
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /help command"""
         help_text = """
@@ -80,53 +119,17 @@ Envie uma mensagem ou imagem para começar! 🚀
         
         await update.message.reply_text(help_text, parse_mode='Markdown')
 
+    @instrument_handler
     async def plans_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /plans command"""
-        plans_text = """
-💎 **Planos Disponíveis:**
-
-**🆓 FREE** - Grátis
-• 10 mensagens GPT-4o/dia
-• 5 imagens/mês
-• Sem música
-
-**⭐ MINI** - $3.80/mês
-• 100 mensagens GPT-4o/dia
-• 10 imagens/mês
-• 5 músicas/mês
-
-**🚀 STARTER** - $7.97/mês
-• 25 mensagens GPT-4/dia
-• 30 imagens/mês
-• 10 músicas/mês
-
-**💎 PREMIUM** - $12.97/mês
-• 50 mensagens GPT-4/dia
-• 100 imagens/mês
-• 20 músicas/mês
-
-**🔥 ULTIMATE** - $18.38/mês
-• 100 mensagens GPT-4/dia
-• 200 imagens/mês
-• 50 músicas/mês
-
-**👑 ALPHA** - $44.95/mês
-• Mensagens ilimitadas
-• Imagens ilimitadas
-• 200 músicas/mês
-• 3M tokens Claude
-• Direitos comerciais
-
-Para fazer upgrade, entre em contato conosco!
-        """
-        
         keyboard = [
             [InlineKeyboardButton("💳 Fazer Upgrade", url="https://t.me/seu_contato")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(plans_text, parse_mode='Markdown', reply_markup=reply_markup)
+        await update.message.reply_text(PLANS_TEXT, parse_mode='Markdown', reply_markup=reply_markup)
 
+    @instrument_handler
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /status command"""
         user = update.effective_user
@@ -136,7 +139,7 @@ Para fazer upgrade, entre em contato conosco!
             await update.message.reply_text("❌ Usuário não encontrado. Use /start primeiro.")
             return
         
-        plan_config = PLAN_CONFIGS[db_user.plan]
+        plan_config = get_plan_limits(db_user.plan)
         
         status_text = f"""
 📊 **Status da Conta:**
@@ -157,6 +160,7 @@ Use /plans para ver outros planos disponíveis.
         
         await update.message.reply_text(status_text, parse_mode='Markdown')
 
+    @instrument_handler
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle text messages"""
         user = update.effective_user
@@ -181,6 +185,7 @@ Use /plans para ver outros planos disponíveis.
         # Handle regular chat
         await self._handle_chat(update, context, db_user)
 
+    @instrument_handler
     async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle photo messages"""
         user = update.effective_user
@@ -196,112 +201,221 @@ Use /plans para ver outros planos disponíveis.
     async def _handle_chat(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User) -> None:
         """Handle regular chat messages"""
         # Check usage limits
-        plan_config = PLAN_CONFIGS[user.plan]
-        
-        # Determine which model to use based on plan and availability
-        if plan_config.daily_gpt4_messages > 0 and user.daily_gpt4_messages < plan_config.daily_gpt4_messages:
-            model = "gpt-4"
-            user.daily_gpt4_messages += 1
-        elif plan_config.daily_gpt4o_messages > 0 and user.daily_gpt4o_messages < plan_config.daily_gpt4o_messages:
-            model = "gpt-4o"
-            user.daily_gpt4o_messages += 1
-        elif plan_config.daily_gpt4_messages == -1:  # Unlimited
-            model = "gpt-4"
-        elif plan_config.daily_gpt4o_messages == -1:  # Unlimited
-            model = "gpt-4o"
-        else:
+        plan_config = get_plan_limits(user.plan)
+        
+        # Determine which model to use based on plan and availability,
+        # limited allowances are used up before unlimited ones
+        candidates = [("daily_gpt4_messages", "gpt-4"), ("daily_gpt4o_messages", "gpt-4o")]
+        candidates.sort(key=lambda candidate: plan_config.is_unlimited(candidate[0]))
+        
+        reservation = None
+        for usage_field, model in candidates:
+            if getattr(plan_config, usage_field) == 0:
+                continue
+            reservation = await self.quota.reserve(user, usage_field)
+            if reservation:
+                break
+        
+        if reservation is None:
             await update.message.reply_text("❌ Você atingiu o limite de mensagens para hoje. Use /plans para fazer upgrade.")
             return
         
-        # Update user usage
-        await self.user_service.update_user_usage(user)
-        
         # Send typing indicator
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         
         try:
-            # Generate response using AI service
-            response = await self.ai_service.generate_text_response(
-                message=update.message.text,
-                model=model,
-                user_context=user
-            )
+            # Recent conversation that fits the model's context budget
+            history = await self.conversation_service.build_context(user.telegram_id, model, update.message.text)
+            
+            if settings.chat_streaming_enabled:
+                response = await self._stream_chat_reply(update, model, user, history)
+            else:
+                # Generate response using AI service
+                response = await self.ai_service.generate_text_response(
+                    message=update.message.text,
+                    model=model,
+                    user_context=user,
+                    history=history
+                )
+                
+                await update.message.reply_text(response)
             
-            await update.message.reply_text(response)
+            # Only a reply that was actually generated is charged and remembered
+            await self.quota.commit(reservation, provider=self.ai_service.text_provider_name(model), model=model)
+            
+            await self.conversation_service.add_turn(user.telegram_id, "user", update.message.text)
+            await self.conversation_service.add_turn(user.telegram_id, "assistant", response)
             
         except Exception as e:
             logger.error(f"Error generating text response: {e}")
             await update.message.reply_text("❌ Erro ao gerar resposta. Tente novamente.")
+        
+        finally:
+            await self.quota.refund(reservation)
+
+    async def _stream_chat_reply(self, update: Update, model: str, user: User, history: Optional[list] = None) -> str:
+        """Stream a chat reply, posting a first partial message and editing it as tokens arrive"""
+        loop = asyncio.get_running_loop()
+        text = ""
+        offset = 0  # Start of the part of text shown in the current message
+        message: Optional[Message] = None
+        shown = ""
+        last_edit = 0.0
+        
+        async for chunk in self.ai_service.stream_text_response(
+            message=update.message.text,
+            model=model,
+            user_context=user,
+            history=history
+        ):
+            text += chunk
+            
+            # Roll over to a new message before hitting Telegram's length limit
+            while len(text) - offset > TELEGRAM_MESSAGE_LIMIT:
+                segment = text[offset:offset + TELEGRAM_MESSAGE_LIMIT]
+                if message is None:
+                    await update.message.reply_text(segment)
+                else:
+                    await self._edit_stream_message(message, segment, final=True)
+                offset += TELEGRAM_MESSAGE_LIMIT
+                message = None
+                shown = ""
+            
+            segment = text[offset:]
+            if message is None:
+                # First partial reply as soon as there is something worth reading
+                if len(segment.strip()) >= settings.stream_first_chunk_chars:
+                    message = await update.message.reply_text(segment)
+                    shown = segment
+                    last_edit = loop.time()
+            elif loop.time() - last_edit >= settings.stream_edit_interval and segment != shown:
+                if await self._edit_stream_message(message, segment):
+                    shown = segment
+                last_edit = loop.time()
+        
+        # Final state of the reply
+        segment = text[offset:]
+        if message is None:
+            if segment.strip():
+                await update.message.reply_text(segment)
+        elif segment != shown:
+            await self._edit_stream_message(message, segment, final=True)
+        
+        return text
+
+    async def _edit_stream_message(self, message: Message, text: str, final: bool = False) -> bool:
+        """Edit a streamed message, skipping intermediate edits Telegram refuses"""
+        try:
+            await message.edit_text(text)
+            return True
+        except RetryAfter as e:
+            logger.warning(f"Telegram edit rate limited, retry after {e.retry_after}s")
+            if final:
+                # The final text must land, wait out the flood limit once
+                retry_after = e.retry_after
+                await asyncio.sleep(retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else retry_after)
+                return await self._edit_stream_message(message, text)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                logger.warning(f"Error editing streamed message: {e}")
+        except TelegramError as e:
+            logger.warning(f"Error editing streamed message: {e}")
+        return False
+
+    async def _moderate_prompt(self, update: Update, prompt: str) -> bool:
+        """Pre-flight a generation prompt, replying with the reason when it is refused"""
+        verdict = await prompt_moderator.check(prompt)
+        if not verdict.allowed:
+            await update.message.reply_text(PROMPT_REFUSED_MESSAGES.get(verdict.reason, PROMPT_REFUSED_MESSAGES["prompt_rejected"]))
+        return verdict.allowed
 
     async def _handle_image_generation(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User) -> None:
         """Handle image generation requests"""
-        plan_config = PLAN_CONFIGS[user.plan]
-        
-        # Check usage limits
-        if plan_config.monthly_images > 0 and user.monthly_images >= plan_config.monthly_images:
-            await update.message.reply_text("❌ Você atingiu o limite de imagens para este mês. Use /plans para fazer upgrade.")
-            return
-        
         # Extract prompt
         prompt = update.message.text.split(':', 1)[1].strip()
         if not prompt:
             await update.message.reply_text("❌ Por favor, forneça uma descrição para a imagem.")
             return
         
-        # Update usage
-        user.monthly_images += 1
-        await self.user_service.update_user_usage(user)
+        # Refused prompts fail here, before quota or a provider is touched
+        if not await self._moderate_prompt(update, prompt):
+            return
+        
+        # Reserve usage, refunded if generation fails
+        reservation = await self.quota.reserve(user, "monthly_images")
+        if reservation is None:
+            await update.message.reply_text("❌ Você atingiu o limite de imagens para este mês. Use /plans para fazer upgrade.")
+            return
         
         # Send generating indicator
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="upload_photo")
         
         try:
             # Generate image using AI service
-            image_url = await self.ai_service.generate_image(
+            result = await self.ai_service.generate_image(
                 prompt=prompt,
                 user_context=user
             )
             
-            await update.message.reply_photo(photo=image_url, caption=f"🎨 Imagem gerada: {prompt}")
+            await update.message.reply_photo(photo=result["url"], caption=f"🎨 Imagem gerada: {prompt}")
+            await self.quota.commit(
+                reservation,
+                provider=result["provider"],
+                model=result.get("model"),
+                cost=result.get("cost", 0.0),
+                cached=bool(result.get("cached"))
+            )
             
         except Exception as e:
             logger.error(f"Error generating image: {e}")
             await update.message.reply_text("❌ Erro ao gerar imagem. Tente novamente.")
+        
+        finally:
+            await self.quota.refund(reservation)
 
     async def _handle_music_generation(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User) -> None:
         """Handle music generation requests"""
-        plan_config = PLAN_CONFIGS[user.plan]
-        
-        # Check usage limits
-        if plan_config.monthly_music > 0 and user.monthly_music >= plan_config.monthly_music:
-            await update.message.reply_text("❌ Você atingiu o limite de músicas para este mês. Use /plans para fazer upgrade.")
-            return
-        
         # Extract prompt
         prompt = update.message.text.split(':', 1)[1].strip()
         if not prompt:
             await update.message.reply_text("❌ Por favor, forneça uma descrição para a música.")
             return
         
-        # Update usage
-        user.monthly_music += 1
-        await self.user_service.update_user_usage(user)
+        # Refused prompts fail here, before quota or a provider is touched
+        if not await self._moderate_prompt(update, prompt):
+            return
+        
+        # Reserve usage, refunded if generation fails
+        reservation = await self.quota.reserve(user, "monthly_music")
+        if reservation is None:
+            await update.message.reply_text("❌ Você atingiu o limite de músicas para este mês. Use /plans para fazer upgrade.")
+            return
         
         # Send generating indicator
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="upload_audio")
         
         try:
             # Generate music using AI service
-            audio_url = await self.ai_service.generate_music(
+            result = await self.ai_service.generate_music(
                 prompt=prompt,
                 user_context=user
             )
             
-            await update.message.reply_audio(audio=audio_url, caption=f"🎵 Música gerada: {prompt}")
+            await update.message.reply_audio(audio=result["url"], caption=f"🎵 Música gerada: {prompt}")
+            await self.quota.commit(
+                reservation,
+                provider=result["provider"],
+                model=result.get("model"),
+                cost=result.get("cost", 0.0),
+                cached=bool(result.get("cached"))
+            )
             
         except Exception as e:
             logger.error(f"Error generating music: {e}")
             await update.message.reply_text("❌ Erro ao gerar música. Tente novamente.")
+        
+        finally:
+            await self.quota.refund(reservation)
 
     async def _handle_image_analysis(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User) -> None:
         """Handle image analysis requests"""
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from telegram import Update
+from telegram.ext import Application
+from config.settings import settings
+from services.metrics import metrics
+from services.shared_state import SharedStateStore
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    import json
+    ORJSON_AVAILABLE = False
+
+def parse_json(body: bytes) -> Any:
+    """Decode a request body with orjson when it is installed"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(body)
+    return json.loads(body)
+
+class UpdateIngestor:
+    """Accepts webhook updates immediately and processes them on a worker pool"""
+
+    def __init__(self, application: Application, state: SharedStateStore):
+        self.application = application
+        self.state = state
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.webhook_queue_size)
+        self.workers: List[asyncio.Task] = []
+        # Recently accepted update_ids, so redeliveries to this worker skip the queue
+        self.recent: "OrderedDict[int, None]" = OrderedDict()
+
+        self.updates = metrics.counter("webhook_updates_total", "Webhook updates by outcome", ("outcome",))
+        self.queue_depth = metrics.gauge("webhook_queue_depth", "Updates waiting for a worker")
+        self.lag = metrics.histogram("webhook_update_lag_seconds", "Time from ACK until a worker picks an update up")
+
+    def submit(self, payload: Dict[str, Any]) -> bool:
+        """Queue an update without waiting; False when the queue is full and Telegram should retry"""
+        update_id = payload.get("update_id")
+        if update_id in self.recent:
+            self.updates.inc(outcome="duplicate")
+            return True
+
+        try:
+            self.queue.put_nowait((time.monotonic(), payload))
+        except asyncio.QueueFull:
+            self.updates.inc(outcome="rejected")
+            return False
+
+        if update_id is not None:
+            self.recent[update_id] = None
+            if len(self.recent) > settings.webhook_dedup_window:
+                self.recent.popitem(last=False)
+        self.queue_depth.set(self.queue.qsize())
+        self.updates.inc(outcome="accepted")
+        return True
+
+    async def start(self) -> None:
+        """Start the worker pool"""
+        for _ in range(settings.webhook_workers):
+            self.workers.append(asyncio.create_task(self._worker()))
+
+    async def close(self) -> None:
+        """Finish queued updates (up to webhook_drain_timeout), then stop the workers"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=settings.webhook_drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self.queue.qsize()} queued updates on shutdown, Telegram will not resend them")
+
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+
+    async def _claim(self, update_id: Optional[int]) -> bool:
+        """Whether this process is the first to see the update, across every worker process"""
+        if update_id is None:
+            return True
+        try:
+            # A fresh owner per delivery, so a redelivery never renews the first claim
+            return await self.state.claim(f"update:{update_id}", uuid.uuid4().hex, settings.webhook_dedup_ttl)
+        except Exception as e:
+            # Better to risk a duplicate reply than to drop the update
+            logger.warning(f"Could not claim update {update_id}: {e}")
+            return True
+
+    async def _worker(self) -> None:
+        while True:
+            received_at, payload = await self.queue.get()
+            self.queue_depth.set(self.queue.qsize())
+            self.lag.observe(time.monotonic() - received_at)
+            try:
+                if not await self._claim(payload.get("update_id")):
+                    self.updates.inc(outcome="duplicate")
+                    continue
+                update = Update.de_json(payload, self.application.bot)
+                await self.application.process_update(update)
+                self.updates.inc(outcome="processed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.updates.inc(outcome="failed")
+                logger.error(f"Error processing update {payload.get('update_id')}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and worker count"""
+        return {
+            "queued": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            "workers": len(self.workers),
+            "orjson": ORJSON_AVAILABLE
+        }
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Column order of the usage_events table and of the exported files
+EVENT_COLUMNS = ("ts", "day", "telegram_id", "plan", "resource", "provider", "model", "quantity", "cost", "cached")
+
+class UsageEventLog:
+    """Append-only log of billable usage, batched into SQLite and rolled up daily into Parquet"""
+
+    def __init__(self, db_path: str, export_dir: str):
+        self.db_path = db_path
+        self.export_dir = export_dir
+        self.buffer: List[tuple] = []
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._tasks: List[asyncio.Task] = []
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS usage_events (
+                    ts REAL NOT NULL,
+                    day TEXT NOT NULL,
+                    telegram_id INTEGER NOT NULL,
+                    plan TEXT NOT NULL,
+                    resource TEXT NOT NULL,
+                    provider TEXT,
+                    model TEXT,
+                    quantity INTEGER NOT NULL,
+                    cost REAL NOT NULL,
+                    cached INTEGER NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_events_day ON usage_events(day)")
+            self.conn = conn
+        return self.conn
+
+    def record(
+        self,
+        telegram_id: int,
+        plan: str,
+        resource: str,
+        provider: Optional[str] = None,
+        model: Optional[str] = None,
+        cost: float = 0.0,
+        quantity: int = 1,
+        cached: bool = False
+    ) -> None:
+        """Queue one usage event, never blocks the caller"""
+        now = time.time()
+        day = datetime.fromtimestamp(now, timezone.utc).strftime("%Y-%m-%d")
+        self.buffer.append((now, day, telegram_id, plan, resource, provider, model, quantity, float(cost or 0.0), int(cached)))
+
+        if len(self.buffer) >= settings.usage_events_batch_size and not self._flush_lock.locked():
+            asyncio.get_running_loop().create_task(self.flush())
+
+    def _insert(self, rows: List[tuple]) -> None:
+        with self.lock:
+            conn = self._connect()
+            conn.execute("BEGIN")
+            conn.executemany(
+                f"INSERT INTO usage_events ({', '.join(EVENT_COLUMNS)}) VALUES ({', '.join('?' for _ in EVENT_COLUMNS)})",
+                rows
+            )
+            conn.execute("COMMIT")
+
+    async def flush(self) -> None:
+        """Write buffered events in one batch"""
+        async with self._flush_lock:
+            if not self.buffer:
+                return
+            rows, self.buffer = self.buffer, []
+            try:
+                await asyncio.to_thread(self._insert, rows)
+            except Exception as e:
+                # Keep the events for the next flush
+                self.buffer[:0] = rows
+                logger.error(f"Error writing {len(rows)} usage events: {e}")
+
+    def _rollup(self, day: str) -> Optional[str]:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        with self.lock:
+            conn = self._connect()
+            # Hold the write lock so two processes can't export the same rows
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    f"SELECT {', '.join(EVENT_COLUMNS)} FROM usage_events WHERE day = ?", (day,)
+                ).fetchall()
+                if not rows:
+                    conn.execute("ROLLBACK")
+                    return None
+
+                columns = list(zip(*rows))
+                table = pa.table({
+                    "ts": pa.array([datetime.fromtimestamp(ts, timezone.utc) for ts in columns[0]], pa.timestamp("ms", tz="UTC")),
+                    "telegram_id": pa.array(columns[2], pa.int64()),
+                    "plan": pa.array(columns[3], pa.string()).dictionary_encode(),
+                    "resource": pa.array(columns[4], pa.string()).dictionary_encode(),
+                    "provider": pa.array(columns[5], pa.string()).dictionary_encode(),
+                    "model": pa.array(columns[6], pa.string()).dictionary_encode(),
+                    "quantity": pa.array(columns[7], pa.int32()),
+                    "cost": pa.array(columns[8], pa.float64()),
+                    "cached": pa.array([bool(value) for value in columns[9]], pa.bool_())
+                })
+
+                # Hive-style day partitions; late events for an exported day become another part
+                directory = os.path.join(self.export_dir, f"day={day}")
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, f"part-{int(time.time() * 1000)}-{os.getpid()}.parquet")
+                pq.write_table(table, path + ".tmp", compression="zstd")
+                os.replace(path + ".tmp", path)
+
+                conn.execute("DELETE FROM usage_events WHERE day = ?", (day,))
+                conn.execute("COMMIT")
+                return path
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _pending_days(self, before: str) -> List[str]:
+        with self.lock:
+            rows = self._connect().execute(
+                "SELECT DISTINCT day FROM usage_events WHERE day < ? ORDER BY day", (before,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    async def rollup_completed_days(self) -> List[str]:
+        """Export every finished UTC day still in the log, returns the files written"""
+        await self.flush()
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        written = []
+        for day in await asyncio.to_thread(self._pending_days, today):
+            path = await asyncio.to_thread(self._rollup, day)
+            if path:
+                logger.info(f"Rolled up usage events for {day} into {path}")
+                written.append(path)
+        return written
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.usage_events_flush_interval)
+            await self.flush()
+
+    async def _rollup_loop(self) -> None:
+        while True:
+            try:
+                await self.rollup_completed_days()
+            except ImportError:
+                logger.warning("pyarrow is not installed, usage events stay in the SQLite log")
+                return
+            except Exception as e:
+                logger.error(f"Error rolling up usage events: {e}")
+            await asyncio.sleep(settings.usage_rollup_interval)
+
+    async def start(self) -> None:
+        """Start the background flush and daily rollup loops"""
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._flush_loop()),
+                asyncio.create_task(self._rollup_loop())
+            ]
+
+    async def close(self) -> None:
+        """Stop the loops and write anything still buffered"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        await self.flush()
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+# Global usage event log
+usage_log = UsageEventLog(settings.usage_events_db_path, settings.usage_export_dir)
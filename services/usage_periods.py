@@ -0,0 +1,50 @@
+import calendar
+import time
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional, Tuple
+
+SECONDS_PER_DAY = 86400
+
+def _add_months(anchor: date, months: int) -> date:
+    """Same day-of-month `months` later, clamped to the month's last day (Jan 31 -> Feb 28)"""
+    month_index = anchor.month - 1 + months
+    year, month = anchor.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(anchor.day, calendar.monthrange(year, month)[1]))
+
+@lru_cache(maxsize=4)
+def _daily_period(day_number: int) -> Tuple[str, float]:
+    start = date(1970, 1, 1) + timedelta(days=day_number)
+    return f"d{start:%Y%m%d}", (day_number + 1) * SECONDS_PER_DAY
+
+@lru_cache(maxsize=4096)
+def _monthly_period(day_number: int, anchor: Optional[date]) -> Tuple[str, float]:
+    today = date(1970, 1, 1) + timedelta(days=day_number)
+
+    if anchor is None:
+        # No billing cycle, use the UTC calendar month
+        start = today.replace(day=1)
+        end = _add_months(start, 1)
+    else:
+        months = (today.year - anchor.year) * 12 + today.month - anchor.month
+        start = _add_months(anchor, months)
+        if start > today:
+            months -= 1
+            start = _add_months(anchor, months)
+        end = _add_months(anchor, months + 1)
+
+    end_ts = datetime(end.year, end.month, end.day, tzinfo=timezone.utc).timestamp()
+    return f"m{start:%Y%m%d}", end_ts
+
+def daily_period(now: Optional[float] = None) -> Tuple[str, float]:
+    """(period_id, period end timestamp) of the current UTC day"""
+    return _daily_period(int((time.time() if now is None else now) // SECONDS_PER_DAY))
+
+def monthly_period(anchor: Optional[datetime] = None, now: Optional[float] = None) -> Tuple[str, float]:
+    """(period_id, period end timestamp) of the billing month containing now.
+
+    Months start on the Stripe billing anchor's day when there is one, otherwise on the 1st (UTC).
+    """
+    if anchor is not None:
+        anchor = (anchor.astimezone(timezone.utc) if anchor.tzinfo else anchor).date()
+    return _monthly_period(int((time.time() if now is None else now) // SECONDS_PER_DAY), anchor)
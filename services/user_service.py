@@ -1,15 +1,101 @@
+import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import Optional
-from models.user import User, UserPlan
+from datetime import datetime
+from typing import List, Optional, Tuple
+from config.settings import settings
+from models.user import User, UserPlan, get_plan_limits
+from services.user_store import UserStore, create_user_store
+from services.shared_state import SharedStateStore, create_state_store
+from services.usage_periods import daily_period, monthly_period
+from services.instrumentation import tag_plan
 
 logger = logging.getLogger(__name__)
 
+# Usage counters that are enforced against plan limits
+DAILY_USAGE_FIELDS = ("daily_gpt4o_messages", "daily_gpt4_messages")
+MONTHLY_USAGE_FIELDS = ("monthly_images", "monthly_music", "monthly_videos", "monthly_claude_tokens")
+USAGE_FIELDS = DAILY_USAGE_FIELDS + MONTHLY_USAGE_FIELDS
+
 class UserService:
-    def __init__(self):
-        # For now, we'll use in-memory storage
-        # Later this will be replaced with Supabase integration
+    def __init__(self, store: Optional[UserStore] = None, state: Optional[SharedStateStore] = None):
+        self.store = store or create_user_store()
+        
+        # Quota counters and plans live here so every worker process enforces the same limits
+        self.state = state or create_state_store()
+        
+        # Hot cache of loaded users, changes reach the store through write-behind batches
         self.users = {}
+        self.dirty = set()
+        self._flush_task = None
+        self._compact_task = None
+        self._flush_lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        """Open the store and start the background flush loop"""
+        await self.store.initialize()
+        await self.state.initialize()
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        if self._compact_task is None:
+            self._compact_task = asyncio.create_task(self._compact_loop())
+
+    async def close(self) -> None:
+        """Stop the background loops, write pending changes and close the store"""
+        for task in (self._flush_task, self._compact_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._flush_task = None
+        self._compact_task = None
+        
+        await self.flush()
+        await self.store.close()
+        await self.state.close()
+
+    async def _flush_loop(self) -> None:
+        """Periodically flush dirty users in batches"""
+        while True:
+            await asyncio.sleep(settings.user_store_flush_interval)
+            await self.flush()
+
+    async def _compact_loop(self) -> None:
+        """Periodically drop usage buckets of periods that have ended"""
+        while True:
+            await asyncio.sleep(settings.usage_compaction_interval)
+            try:
+                removed = await self.state.compact()
+                if removed:
+                    logger.info(f"Compacted {removed} expired usage buckets")
+            except Exception as e:
+                logger.error(f"Error compacting usage buckets: {e}")
+
+    async def flush(self) -> None:
+        """Write all dirty users to the store in one batch"""
+        async with self._flush_lock:
+            if not self.dirty:
+                return
+            
+            telegram_ids = list(self.dirty)
+            self.dirty.clear()
+            batch = [self.users[telegram_id] for telegram_id in telegram_ids if telegram_id in self.users]
+            
+            try:
+                await self.store.save_users(batch)
+            except Exception as e:
+                # Keep the changes queued for the next flush
+                self.dirty.update(telegram_ids)
+                logger.error(f"Error flushing {len(batch)} users to store: {e}")
+
+    def _mark_dirty(self, user: User) -> None:
+        """Queue a user for the next write-behind flush"""
+        self.users[user.telegram_id] = user
+        self.dirty.add(user.telegram_id)
+        
+        if len(self.dirty) >= settings.user_store_flush_batch_size and not self._flush_lock.locked():
+            asyncio.create_task(self.flush())
 
     async def get_or_create_user(
         self,
@@ -20,8 +106,13 @@ class UserService:
     ) -> User:
         """Get existing user or create new one"""
         
-        if telegram_id in self.users:
-            return self.users[telegram_id]
+        user = await self.get_user_by_telegram_id(telegram_id)
+        if user:
+            if user.blocked_at:
+                # Writing to the bot means it is unblocked, include them in broadcasts again
+                user.blocked_at = None
+                self._mark_dirty(user)
+            return user
         
         # Create new user
         user = User(
@@ -31,69 +122,149 @@ class UserService:
             last_name=last_name,
             plan=UserPlan.FREE,
             created_at=datetime.now(),
-            updated_at=datetime.now(),
-            last_daily_reset=datetime.now(),
-            last_monthly_reset=datetime.now()
+            updated_at=datetime.now()
         )
         
-        self.users[telegram_id] = user
+        self._mark_dirty(user)
+        tag_plan(user.plan)
         logger.info(f"Created new user: {telegram_id}")
         
         return user
 
     async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[User]:
         """Get user by Telegram ID"""
-        return self.users.get(telegram_id)
+        user = self.users.get(telegram_id)
+        if user is None:
+            user = await self.store.get_user(telegram_id)
+            if user:
+                self.users[telegram_id] = user
+        
+        if user:
+            await self._sync_shared(user)
+            tag_plan(user.plan)
+        return user
+
+    def _period(self, user: User, field: str) -> Tuple[str, float]:
+        """(period_id, period end) of the bucket a usage field is currently counted in"""
+        if field in DAILY_USAGE_FIELDS:
+            return daily_period()
+        return monthly_period(user.billing_anchor)
+
+    def _usage_key(self, user: User, field: str) -> Tuple[str, float]:
+        period_id, period_end = self._period(user, field)
+        return f"usage:{user.telegram_id}:{field}:{period_id}", period_end
+
+    def _roll_periods(self, user: User) -> None:
+        """Zero cached counters whose period has ended, resets are implicit in the bucket keys"""
+        for field in USAGE_FIELDS:
+            period_id = self._period(user, field)[0]
+            current = user.usage_periods.get(field)
+            if current != period_id:
+                # Rows saved before periods were tracked keep their counts for the current period
+                if current is not None:
+                    setattr(user, field, 0)
+                user.usage_periods[field] = period_id
+
+    async def _sync_shared(self, user: User) -> None:
+        """Refresh plan, billing anchor and counters that other workers may have changed"""
+        if self.state.shared:
+            values = await self.state.get_many([f"plan:{user.telegram_id}", f"anchor:{user.telegram_id}"])
+            if values[f"plan:{user.telegram_id}"]:
+                user.plan = UserPlan(values[f"plan:{user.telegram_id}"])
+            if values[f"anchor:{user.telegram_id}"]:
+                user.billing_anchor = datetime.fromisoformat(values[f"anchor:{user.telegram_id}"])
+        
+        self._roll_periods(user)
+        
+        if self.state.shared:
+            keys = {self._usage_key(user, field)[0]: field for field in USAGE_FIELDS}
+            values = await self.state.get_many(keys)
+            for key, field in keys.items():
+                if values.get(key) is not None:
+                    setattr(user, field, int(values[key]))
 
     async def update_user_usage(self, user: User) -> None:
-        """Update user usage and reset counters if needed"""
-        now = datetime.now()
-        
-        # Reset daily counters if needed
-        if user.last_daily_reset and (now - user.last_daily_reset).days >= 1:
-            user.daily_gpt4o_messages = 0
-            user.daily_gpt4_messages = 0
-            user.last_daily_reset = now
-            logger.info(f"Reset daily counters for user {user.telegram_id}")
-        
-        # Reset monthly counters if needed
-        if user.last_monthly_reset and (now - user.last_monthly_reset).days >= 30:
-            user.monthly_images = 0
-            user.monthly_music = 0
-            user.monthly_claude_tokens = 0
-            user.last_monthly_reset = now
-            logger.info(f"Reset monthly counters for user {user.telegram_id}")
-        
-        user.updated_at = now
-        self.users[user.telegram_id] = user
+        """Save the user's current usage"""
+        self._roll_periods(user)
+        user.updated_at = datetime.now()
+        self._mark_dirty(user)
+
+    async def increment_usage(self, user: User, field: str, amount: int = 1, limit: Optional[int] = None) -> Optional[int]:
+        """Atomically add to the current period's usage bucket, shared by all workers (negative amounts refund).
+
+        Returns the new value, or None without charging anything when it would pass limit.
+        """
+        self._roll_periods(user)
+        
+        key, period_end = self._usage_key(user, field)
+        # Keep ended buckets around for a while so late refunds and reports still find them
+        expires_at = period_end + settings.usage_bucket_retention_days * 86400
+        value = await self.state.incr(key, amount, limit=limit, initial=getattr(user, field), expires_at=expires_at)
+        if value is None:
+            return None
+        setattr(user, field, value)
+        
+        user.updated_at = datetime.now()
+        self._mark_dirty(user)
+        return value
 
-    async def upgrade_user_plan(self, telegram_id: int, new_plan: UserPlan) -> bool:
-        """Upgrade user plan"""
+    async def upgrade_user_plan(self, telegram_id: int, new_plan: UserPlan, billing_anchor: Optional[datetime] = None) -> bool:
+        """Upgrade user plan, monthly usage periods follow the Stripe billing anchor when given"""
         user = await self.get_user_by_telegram_id(telegram_id)
         if not user:
             return False
         
         user.plan = new_plan
         user.updated_at = datetime.now()
-        self.users[telegram_id] = user
+        await self.state.set(f"plan:{telegram_id}", new_plan.value)
+        
+        if billing_anchor and billing_anchor != user.billing_anchor:
+            user.billing_anchor = billing_anchor
+            await self.state.set(f"anchor:{telegram_id}", billing_anchor.isoformat())
+            # Counts from the previous cycle don't carry into the new one
+            self._roll_periods(user)
+        
+        # Plan changes are paid for, persist them right away
+        self._mark_dirty(user)
+        await self.flush()
         
         logger.info(f"Upgraded user {telegram_id} to plan {new_plan}")
         return True
 
+    async def mark_blocked(self, telegram_ids: List[int]) -> None:
+        """Record users who blocked the bot, broadcasts skip them from now on"""
+        blocked_at = datetime.now()
+        for telegram_id in telegram_ids:
+            user = self.users.get(telegram_id)
+            if user:
+                user.blocked_at = blocked_at
+        # Written straight to the store, a later flush of a cached copy keeps the flag
+        await self.store.mark_blocked(telegram_ids, blocked_at)
+
     async def get_user_stats(self, telegram_id: int) -> Optional[dict]:
         """Get user usage statistics"""
         user = await self.get_user_by_telegram_id(telegram_id)
         if not user:
             return None
         
+        plan_limits = get_plan_limits(user.plan)
+        
         return {
             "telegram_id": user.telegram_id,
-            "plan": user.plan,
+            "username": user.username,
+            "plan": user.plan.value.upper(),
             "daily_gpt4o_messages": user.daily_gpt4o_messages,
             "daily_gpt4_messages": user.daily_gpt4_messages,
             "monthly_images": user.monthly_images,
             "monthly_music": user.monthly_music,
+            "monthly_videos": user.monthly_videos,
             "monthly_claude_tokens": user.monthly_claude_tokens,
+            "daily_gpt4o_limit": plan_limits.daily_gpt4o_messages,
+            "daily_gpt4_limit": plan_limits.daily_gpt4_messages,
+            "monthly_images_limit": plan_limits.monthly_images,
+            "monthly_music_limit": plan_limits.monthly_music,
+            "monthly_videos_limit": plan_limits.monthly_videos,
+            "monthly_claude_limit": plan_limits.monthly_claude_tokens,
             "created_at": user.created_at,
             "updated_at": user.updated_at
         }
@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import List, Optional
+from config.settings import settings
+from models.user import User
+
+logger = logging.getLogger(__name__)
+
+class UserStore(ABC):
+    """Storage backend interface for users"""
+
+    async def initialize(self) -> None:
+        """Prepare the backend (idempotent)"""
+
+    @abstractmethod
+    async def get_user(self, telegram_id: int) -> Optional[User]:
+        """Load a single user by Telegram ID"""
+
+    @abstractmethod
+    async def save_users(self, users: List[User]) -> None:
+        """Upsert a batch of users"""
+
+    @abstractmethod
+    async def reachable_ids(self, after: int, limit: int) -> List[int]:
+        """Next page of telegram_ids above `after`, ascending, skipping users who blocked the bot"""
+
+    @abstractmethod
+    async def count_reachable(self) -> int:
+        """Users who haven't blocked the bot"""
+
+    @abstractmethod
+    async def mark_blocked(self, telegram_ids: List[int], blocked_at: datetime) -> None:
+        """Flag users who blocked the bot so broadcasts skip them"""
+
+    async def close(self) -> None:
+        """Release backend resources"""
+
+class SQLiteUserStore(UserStore):
+    """Embedded SQLite user store (WAL mode, indexed by telegram_id)"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn: Optional[sqlite3.Connection] = None
+        # sqlite3 connections are not safe for concurrent use across threads
+        self.lock = threading.Lock()
+
+    def _connect(self) -> None:
+        if self.conn is not None:
+            return
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER NOT NULL,
+                plan TEXT NOT NULL,
+                data TEXT NOT NULL,
+                updated_at TEXT
+            )
+        """)
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id)")
+        conn.commit()
+        self.conn = conn
+        logger.info(f"SQLite user store ready at {self.db_path}")
+
+    def _get_user(self, telegram_id: int) -> Optional[User]:
+        with self.lock:
+            self._connect()
+            row = self.conn.execute(
+                "SELECT id, data FROM users WHERE telegram_id = ?", (telegram_id,)
+            ).fetchone()
+
+        if not row:
+            return None
+
+        user = User.model_validate_json(row[1])
+        user.id = row[0]
+        return user
+
+    def _save_users(self, users: List[User]) -> None:
+        rows = [
+            (
+                user.telegram_id,
+                user.plan.value,
+                user.model_dump_json(exclude={"id"}),
+                user.updated_at.isoformat() if user.updated_at else None
+            )
+            for user in users
+        ]
+
+        with self.lock:
+            self._connect()
+            with self.conn:
+                self.conn.executemany("""
+                    INSERT INTO users (telegram_id, plan, data, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(telegram_id) DO UPDATE SET
+                        plan = excluded.plan,
+                        data = excluded.data,
+                        updated_at = excluded.updated_at
+                """, rows)
+
+    def _reachable_ids(self, after: int, limit: int) -> List[int]:
+        # Keyset paging on the unique telegram_id index, each page costs the same however deep
+        with self.lock:
+            self._connect()
+            rows = self.conn.execute(
+                "SELECT telegram_id FROM users WHERE telegram_id > ? AND json_extract(data, '$.blocked_at') IS NULL ORDER BY telegram_id LIMIT ?",
+                (after, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _count_reachable(self) -> int:
+        with self.lock:
+            self._connect()
+            return self.conn.execute("SELECT COUNT(*) FROM users WHERE json_extract(data, '$.blocked_at') IS NULL").fetchone()[0]
+
+    def _mark_blocked(self, telegram_ids: List[int], blocked_at: datetime) -> None:
+        with self.lock:
+            self._connect()
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE users SET data = json_set(data, '$.blocked_at', ?) WHERE telegram_id = ?",
+                    [(blocked_at.isoformat(), telegram_id) for telegram_id in telegram_ids]
+                )
+
+    async def initialize(self) -> None:
+        if self.conn is None:
+            await asyncio.to_thread(self._locked_connect)
+
+    def _locked_connect(self) -> None:
+        with self.lock:
+            self._connect()
+
+    async def get_user(self, telegram_id: int) -> Optional[User]:
+        return await asyncio.to_thread(self._get_user, telegram_id)
+
+    async def save_users(self, users: List[User]) -> None:
+        if users:
+            await asyncio.to_thread(self._save_users, users)
+
+    async def reachable_ids(self, after: int, limit: int) -> List[int]:
+        return await asyncio.to_thread(self._reachable_ids, after, limit)
+
+    async def count_reachable(self) -> int:
+        return await asyncio.to_thread(self._count_reachable)
+
+    async def mark_blocked(self, telegram_ids: List[int], blocked_at: datetime) -> None:
+        if telegram_ids:
+            await asyncio.to_thread(self._mark_blocked, telegram_ids, blocked_at)
+
+    def _close(self) -> None:
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self._close)
+
+class SupabaseUserStore(UserStore):
+    """User store backed by the configured Supabase project"""
+
+    def __init__(self, url: str, key: str, table: str = "users"):
+        self.url = url
+        self.key = key
+        self.table = table
+        self.client = None
+
+    async def initialize(self) -> None:
+        if self.client is None:
+            from supabase import create_client
+            self.client = create_client(self.url, self.key)
+            logger.info("Supabase user store initialized")
+
+    def _get_user(self, telegram_id: int) -> Optional[User]:
+        response = self.client.table(self.table).select("*").eq("telegram_id", telegram_id).limit(1).execute()
+        if not response.data:
+            return None
+        return User.model_validate(response.data[0])
+
+    def _save_users(self, users: List[User]) -> None:
+        rows = [user.model_dump(mode="json", exclude={"id"}) for user in users]
+        self.client.table(self.table).upsert(rows, on_conflict="telegram_id").execute()
+
+    def _reachable_ids(self, after: int, limit: int) -> List[int]:
+        response = (
+            self.client.table(self.table).select("telegram_id")
+            .gt("telegram_id", after).is_("blocked_at", "null")
+            .order("telegram_id").limit(limit).execute()
+        )
+        return [row["telegram_id"] for row in response.data]
+
+    def _count_reachable(self) -> int:
+        response = self.client.table(self.table).select("telegram_id", count="exact").is_("blocked_at", "null").limit(1).execute()
+        return response.count or 0
+
+    def _mark_blocked(self, telegram_ids: List[int], blocked_at: datetime) -> None:
+        self.client.table(self.table).update({"blocked_at": blocked_at.isoformat()}).in_("telegram_id", telegram_ids).execute()
+
+    async def get_user(self, telegram_id: int) -> Optional[User]:
+        await self.initialize()
+        return await asyncio.to_thread(self._get_user, telegram_id)
+
+    async def save_users(self, users: List[User]) -> None:
+        if users:
+            await self.initialize()
+            await asyncio.to_thread(self._save_users, users)
+
+    async def reachable_ids(self, after: int, limit: int) -> List[int]:
+        await self.initialize()
+        return await asyncio.to_thread(self._reachable_ids, after, limit)
+
+    async def count_reachable(self) -> int:
+        await self.initialize()
+        return await asyncio.to_thread(self._count_reachable)
+
+    async def mark_blocked(self, telegram_ids: List[int], blocked_at: datetime) -> None:
+        if telegram_ids:
+            await self.initialize()
+            await asyncio.to_thread(self._mark_blocked, telegram_ids, blocked_at)
+
+def create_user_store() -> UserStore:
+    """Build the user store selected in settings"""
+    backend = settings.user_store_backend.lower()
+
+    if backend == "supabase":
+        if not settings.supabase_url or not settings.supabase_key:
+            raise ValueError("SUPABASE_URL and SUPABASE_KEY are required for the supabase user store")
+        return SupabaseUserStore(settings.supabase_url, settings.supabase_key)
+
+    if backend == "sqlite":
+        return SQLiteUserStore(settings.sqlite_db_path)
+
+    raise ValueError(f"Unknown user store backend: {settings.user_store_backend}")
@@ -0,0 +1,101 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+logging.basicConfig(
+    format=r'%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+ENTRY_POINTS = ["app.main", "main_bot"]
+
+# Loaded lazily (services/lazy_imports.py), importing an entry point must not pull them in
+LAZY_SDKS = ["openai", "anthropic", "stripe", "tiktoken"]
+
+def measure(entry_point: str) -> dict:
+    """Import an entry point in a fresh interpreter under -X importtime"""
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_BOT_TOKEN", "0:startup-benchmark")
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {entry_point}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"import {entry_point} failed:\n{result.stderr[-2000:]}")
+
+    # "import time: self [us] | cumulative | imported package", nesting shown by indentation
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[name.strip()] = (int(cumulative), depth)
+    top_level = sum(cumulative for cumulative, depth in modules.values() if depth == 0)
+    return {"wall_ms": wall * 1000, "import_ms": top_level / 1000, "modules": modules}
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import time of the bot entry points with -X importtime")
+    parser.add_argument("--entry-point", action="append", help=f"Module to import (default: {', '.join(ENTRY_POINTS)})")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per entry point, the median is reported")
+    parser.add_argument("--top", type=int, default=10, help="Slowest modules to list")
+    parser.add_argument("--baseline", help="JSON file of median import times to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="Write this run's medians to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown over the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    if args.update_baseline and not args.baseline:
+        parser.error("--update-baseline needs --baseline")
+
+    failed = False
+    medians = {}
+    for entry_point in args.entry_point or ENTRY_POINTS:
+        runs = [measure(entry_point) for _ in range(args.runs)]
+        medians[entry_point] = round(statistics.median(run["import_ms"] for run in runs), 1)
+        wall = statistics.median(run["wall_ms"] for run in runs)
+        logger.info(f"{entry_point}: imports {medians[entry_point]:.0f}ms, process {wall:.0f}ms (median of {args.runs})")
+
+        # The last run's slowest direct dependencies
+        modules = runs[-1]["modules"]
+        slowest = sorted(
+            ((cumulative, name) for name, (cumulative, depth) in modules.items() if depth <= 1),
+            reverse=True
+        )[:args.top]
+        for cumulative, name in slowest:
+            logger.info(f"    {cumulative / 1000:8.1f}ms  {name}")
+
+        eager = [name for name in LAZY_SDKS if name in modules]
+        if eager:
+            logger.error(f"{entry_point} imports {', '.join(eager)} at startup, they should load through lazy_import()")
+            failed = True
+
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w") as handle:
+            json.dump(medians, handle, indent=2, sort_keys=True)
+        logger.info(f"Baseline written to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        for entry_point, median in medians.items():
+            if entry_point not in baseline:
+                continue
+            limit = baseline[entry_point] * (1 + args.tolerance)
+            if median > limit:
+                logger.error(f"{entry_point} regressed: {median:.0f}ms against a baseline of {baseline[entry_point]:.0f}ms")
+                failed = True
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
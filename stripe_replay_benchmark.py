@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import time
+import httpx
+
+logging.basicConfig(
+    format=r'%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+# One log line per request would dominate the measurement
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+PLANS = ["starter", "pro", "premium", "ultimate"]
+
+def synthetic_events(count: int, users: int, start_user: int) -> list:
+    """checkout.session.completed events shaped like the ones Stripe sends"""
+    now = int(time.time())
+    return [
+        {
+            "id": f"evt_replay_{now}_{index}",
+            "object": "event",
+            "type": "checkout.session.completed",
+            "created": now,
+            "data": {
+                "object": {
+                    "id": f"cs_replay_{now}_{index}",
+                    "object": "checkout.session",
+                    "client_reference_id": str(start_user + index % users),
+                    "metadata": {"plan": random.choice(PLANS)},
+                    "subscription": f"sub_replay_{index}",
+                    "created": now
+                }
+            }
+        }
+        for index in range(count)
+    ]
+
+def load_events(path: str) -> list:
+    """Recorded events, one Stripe event JSON object per line"""
+    with open(path) as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+def sign(payload: bytes, secret: str) -> str:
+    """Stripe-Signature header for a payload (v1 scheme)"""
+    timestamp = int(time.time())
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+async def run(args) -> int:
+    events = load_events(args.events_file) if args.events_file else synthetic_events(args.count, args.users, args.start_user)
+
+    # Every event delivered `deliveries` times in shuffled order, like Stripe retries
+    deliveries = [event for event in events for _ in range(args.deliveries)]
+    random.shuffle(deliveries)
+
+    latencies = []
+    statuses = {}
+    duplicates = 0
+
+    async def sender(client: httpx.AsyncClient):
+        nonlocal duplicates
+        while deliveries:
+            payload = json.dumps(deliveries.pop()).encode()
+            start = time.perf_counter()
+            response = await client.post(
+                args.url,
+                content=payload,
+                headers={"Stripe-Signature": sign(payload, args.secret), "Content-Type": "application/json"}
+            )
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code == 200 and response.json().get("duplicate"):
+                duplicates += 1
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(sender(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    logger.info(f"Replayed {len(latencies)} deliveries of {len(events)} events in {elapsed:.2f}s: {len(latencies) / elapsed:.0f} events/sec")
+    logger.info(f"Response latency p50={percentile(latencies, 0.5) * 1000:.1f}ms p99={percentile(latencies, 0.99) * 1000:.1f}ms")
+    logger.info(f"Responses by status: {dict(sorted(statuses.items()))}, acknowledged as duplicates: {duplicates}")
+
+    expected_duplicates = len(latencies) - len(events)
+    if duplicates != expected_duplicates:
+        logger.error(f"Expected {expected_duplicates} duplicates, the ledger reported {duplicates}")
+        return 1
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay signed Stripe events against the webhook and check each is recorded once")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/stripe/webhook")
+    parser.add_argument("--secret", default=os.environ.get("STRIPE_WEBHOOK_SECRET"), help="Webhook signing secret (default: $STRIPE_WEBHOOK_SECRET)")
+    parser.add_argument("--events-file", help="JSONL of recorded Stripe events; synthetic checkouts when omitted")
+    parser.add_argument("--count", type=int, default=5000, help="Synthetic events to generate")
+    parser.add_argument("--users", type=int, default=1000, help="Distinct Telegram users in synthetic events")
+    parser.add_argument("--start-user", type=int, default=1, help="First Telegram id in synthetic events")
+    parser.add_argument("--deliveries", type=int, default=3, help="Times each event is delivered")
+    parser.add_argument("--concurrency", type=int, default=32, help="Parallel connections")
+    args = parser.parse_args()
+
+    if not args.secret:
+        parser.error("--secret or STRIPE_WEBHOOK_SECRET is required")
+    return asyncio.run(run(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -174,7 +174,7 @@ async def image_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             # Send image
             await update.message.reply_photo(
-                photo=result["image_url"],
+                photo=result["url"],
                 caption=f"🎨 **Imagem gerada!**\n\n**Prompt:** {prompt}\n**Custo:** ${result['cost']:.4f}\n**Modelo:** Fal.ai FLUX",
                 parse_mode='Markdown'
             )
@@ -195,7 +195,7 @@ async def image_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 
                 # Send image
                 await update.message.reply_photo(
-                    photo=result["image_url"],
+                    photo=result["url"],
                     caption=f"🎨 **Imagem gerada!**\n\n**Prompt:** {prompt}\n**Custo:** ${result['cost']:.4f}\n**Modelo:** Replicate FLUX",
                     parse_mode='Markdown'
                 )
@@ -0,0 +1,4 @@
+import os
+
+# Settings require a bot token; tests never talk to Telegram
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:test")
@@ -0,0 +1,79 @@
+import asyncio
+import random
+import pytest
+from models.user import UserPlan, get_plan_limits
+from services import quota as quota_module
+from services.quota import QuotaEngine
+from services.shared_state import MemoryStateStore, SQLiteStateStore
+from services.user_service import UserService
+from services.user_store import SQLiteUserStore
+
+CONCURRENCY = 1000
+RESOURCE = "monthly_images"
+PLAN = UserPlan.ULTIMATE
+
+@pytest.fixture(params=["memory", "sqlite"])
+def user_service(request, tmp_path):
+    state = MemoryStateStore() if request.param == "memory" else SQLiteStateStore(str(tmp_path / "state.db"))
+    return UserService(store=SQLiteUserStore(str(tmp_path / "users.db")), state=state)
+
+@pytest.fixture(autouse=True)
+def no_usage_events(monkeypatch):
+    # Usage events are written to the configured export DB, not the test's concern
+    monkeypatch.setattr(quota_module.usage_log, "record", lambda *args, **kwargs: None)
+
+def test_parallel_reserves_never_overspend(user_service):
+    limit = get_plan_limits(PLAN).monthly_images
+    assert 0 < limit < CONCURRENCY
+
+    async def scenario():
+        await user_service.start()
+        try:
+            user = await user_service.get_or_create_user(42)
+            user.plan = PLAN
+            engine = QuotaEngine(user_service)
+            key = user_service._usage_key(user, RESOURCE)[0]
+
+            async def counter() -> int:
+                return int((await user_service.state.get_many([key]))[key])
+
+            # Everyone races for the allowance, exactly limit reservations succeed
+            first = await asyncio.gather(*(engine.reserve(user, RESOURCE) for _ in range(CONCURRENCY)))
+            held = [reservation for reservation in first if reservation is not None]
+            assert len(held) == limit
+            assert await counter() == limit
+
+            # Refunds, commits and new reserves interleave; refunded units may be taken again
+            random.Random(0).shuffle(held)
+            refunded, committed = held[:limit // 2], held[limit // 2:]
+
+            async def reserve_and_settle(index: int):
+                reservation = await engine.reserve(user, RESOURCE)
+                if reservation is None:
+                    return 0
+                if index % 2:
+                    await engine.refund(reservation)
+                    return 0
+                await engine.commit(reservation)
+                return 1
+
+            results = await asyncio.gather(
+                *(engine.refund(reservation) for reservation in refunded),
+                *(engine.commit(reservation) for reservation in committed),
+                *(reserve_and_settle(index) for index in range(CONCURRENCY))
+            )
+            taken = len(committed) + sum(result for result in results if result)
+            assert taken <= limit
+            assert await counter() == taken
+
+            # With no refunds in flight the remaining allowance is used up exactly
+            last = await asyncio.gather(*(engine.reserve(user, RESOURCE) for _ in range(CONCURRENCY)))
+            for reservation in last:
+                if reservation is not None:
+                    await engine.commit(reservation)
+            assert taken + sum(reservation is not None for reservation in last) == limit
+            assert await counter() == limit
+        finally:
+            await user_service.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import httpx
+import pytest
+from config.settings import settings
+from services.http_client import http_pool
+from services.prediction_registry import PredictionRegistry, prediction_registry
+from services.replicate_service import ReplicateService
+from services.shared_state import MemoryStateStore, SQLiteStateStore
+
+class FakeReplicate:
+    """Replicate API that finishes a prediction after a number of status polls, counting every request"""
+
+    def __init__(self, polls_until_done: int):
+        self.polls_until_done = polls_until_done
+        self.created = []
+        self.polls = 0
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "POST" and request.url.path == "/v1/predictions":
+            self.created.append(json.loads(request.content))
+            return httpx.Response(201, json={"id": "p1", "status": "starting"})
+        if request.method == "GET" and request.url.path == "/v1/predictions/p1":
+            self.polls += 1
+            if self.polls < self.polls_until_done:
+                return httpx.Response(200, json={"id": "p1", "status": "processing"})
+            return httpx.Response(200, json=self.finished())
+        return httpx.Response(404)
+
+    @staticmethod
+    def finished():
+        return {"id": "p1", "status": "succeeded", "output": "https://replicate.delivery/p1.mp3"}
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeReplicate(polls_until_done=3)
+    monkeypatch.setitem(http_pool.clients, "replicate", httpx.AsyncClient(transport=httpx.MockTransport(fake.handler)))
+    monkeypatch.setattr(settings, "replicate_poll_initial_interval", 0.01)
+    monkeypatch.setattr(settings, "replicate_poll_max_interval", 0.02)
+    # A single web worker serving the webhook itself
+    monkeypatch.setattr(prediction_registry, "state", MemoryStateStore())
+    monkeypatch.setattr(prediction_registry, "receives_webhooks", True)
+    return fake
+
+def run_music(service: ReplicateService, webhook_delay=None, receiver: PredictionRegistry = prediction_registry):
+    async def deliver_webhook():
+        await asyncio.sleep(webhook_delay)
+        await receiver.publish(FakeReplicate.finished())
+
+    async def scenario():
+        if webhook_delay is not None:
+            asyncio.create_task(deliver_webhook())
+        return await service.generate_music("calm piano")
+    return asyncio.run(scenario())
+
+def test_polls_until_done_without_webhook(fake):
+    service = ReplicateService()
+    service.webhook_url = None
+
+    result = run_music(service)
+
+    assert result["success"] and result["url"] == "https://replicate.delivery/p1.mp3"
+    assert "webhook" not in fake.created[0]
+    assert fake.polls == 3
+
+def test_webhook_resolves_without_polling(fake, monkeypatch):
+    monkeypatch.setattr(settings, "replicate_webhook_fallback_interval", 5.0)
+    service = ReplicateService()
+    service.webhook_url = "https://bot.example/replicate/webhook"
+
+    result = run_music(service, webhook_delay=0.05)
+
+    assert result["success"]
+    assert fake.created[0]["webhook"] == "https://bot.example/replicate/webhook"
+    assert fake.polls == 0
+
+def test_falls_back_to_polling_when_webhook_is_lost(fake, monkeypatch):
+    monkeypatch.setattr(settings, "replicate_webhook_fallback_interval", 0.01)
+    service = ReplicateService()
+    service.webhook_url = "https://bot.example/replicate/webhook"
+
+    result = run_music(service)
+
+    assert result["success"]
+    assert len(fake.created) == 1
+    assert fake.polls == 3
+
+def test_webhook_received_by_another_worker_reaches_the_waiter(fake, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "replicate_webhook_fallback_interval", 5.0)
+    monkeypatch.setattr(settings, "replicate_webhook_shared_interval", 0.01)
+    monkeypatch.setattr(settings, "web_concurrency", 4)
+    # Waiter and webhook receiver are different processes sharing one SQLite state file
+    monkeypatch.setattr(prediction_registry, "state", SQLiteStateStore(str(tmp_path / "state.db")))
+    monkeypatch.setattr(prediction_registry, "receives_webhooks", False)
+    receiver = PredictionRegistry()
+    receiver.attach(SQLiteStateStore(str(tmp_path / "state.db")), receives_webhooks=True)
+    service = ReplicateService()
+    service.webhook_url = "https://bot.example/replicate/webhook"
+
+    result = run_music(service, webhook_delay=0.05, receiver=receiver)
+
+    assert result["success"]
+    assert "webhook" in fake.created[0]
+    assert fake.polls == 0
+
+def test_polls_when_webhooks_cannot_reach_this_worker(fake, monkeypatch):
+    monkeypatch.setattr(settings, "web_concurrency", 4)
+    service = ReplicateService()
+    service.webhook_url = "https://bot.example/replicate/webhook"
+
+    result = run_music(service)
+
+    assert result["success"]
+    assert "webhook" not in fake.created[0]
+    assert fake.polls == 3
@@ -0,0 +1,175 @@
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+from models.user import PLAN_CONFIGS, UserPlan
+from services.usage_events import EVENT_COLUMNS
+from config.settings import settings
+
+logging.basicConfig(
+    format=r'%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+GROUP_COLUMNS = {
+    "user": "telegram_id",
+    "plan": "plan",
+    "resource": "resource",
+    "provider": "provider",
+    "model": "model",
+    "day": "day",
+    "month": "month"
+}
+
+def event_schema(pa):
+    return pa.schema([
+        ("ts", pa.timestamp("ms", tz="UTC")),
+        ("telegram_id", pa.int64()),
+        ("plan", pa.string()),
+        ("resource", pa.string()),
+        ("provider", pa.string()),
+        ("model", pa.string()),
+        ("quantity", pa.int32()),
+        ("cost", pa.float64()),
+        ("cached", pa.bool_()),
+        ("day", pa.string())
+    ])
+
+def load_exported(pa, args):
+    """Read the daily Parquet rollups between --since and --until"""
+    import pyarrow.dataset as ds
+
+    if not os.path.isdir(args.export_dir):
+        return None
+
+    dataset = ds.dataset(
+        args.export_dir,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("day", pa.string())]), flavor="hive"),
+        exclude_invalid_files=True
+    )
+    condition = None
+    if args.since:
+        condition = ds.field("day") >= args.since
+    if args.until:
+        until = ds.field("day") <= args.until
+        condition = until if condition is None else condition & until
+
+    table = dataset.to_table(filter=condition)
+    return table.select(event_schema(pa).names).cast(event_schema(pa))
+
+def load_live(pa, args):
+    """Read events not rolled up yet from the SQLite log"""
+    from datetime import datetime, timezone
+
+    if not os.path.exists(args.events_db):
+        return None
+
+    query = f"SELECT {', '.join(EVENT_COLUMNS)} FROM usage_events WHERE day >= ? AND day <= ?"
+    with sqlite3.connect(args.events_db) as conn:
+        rows = conn.execute(query, (args.since or "0000-00-00", args.until or "9999-99-99")).fetchall()
+    if not rows:
+        return None
+
+    columns = dict(zip(EVENT_COLUMNS, zip(*rows)))
+    columns["ts"] = [datetime.fromtimestamp(ts, timezone.utc) for ts in columns["ts"]]
+    columns["cached"] = [bool(value) for value in columns["cached"]]
+    return pa.table({name: list(columns[name]) for name in event_schema(pa).names}, schema=event_schema(pa))
+
+def print_table(headers, rows):
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    print("  ".join(str(header).ljust(width) for header, width in zip(headers, widths)))
+    print("  ".join("-" * width for width in widths))
+    for row in rows:
+        print("  ".join(str(value).ljust(width) for value, width in zip(row, widths)))
+
+def usage_breakdown(table, group_by):
+    """Events, units and provider cost per group"""
+    keys = [GROUP_COLUMNS[name] for name in group_by]
+    grouped = table.group_by(keys).aggregate([
+        ("quantity", "count"),
+        ("quantity", "sum"),
+        ("cost", "sum"),
+        ("cached", "sum")
+    ]).sort_by([("cost_sum", "descending")])
+
+    rows = [
+        [row[key] for key in keys] + [row["quantity_count"], row["quantity_sum"], row["cached_sum"], f"${row['cost_sum']:.4f}"]
+        for row in grouped.to_pylist()
+    ]
+    print_table(group_by + ["events", "units", "cached", "cost"], rows)
+
+def plan_margins(table):
+    """Provider cost per active user-month against each plan's price"""
+    grouped = table.group_by(["plan", "month", "telegram_id"]).aggregate([("cost", "sum")])
+    totals = {}
+    for row in grouped.to_pylist():
+        plan = totals.setdefault(row["plan"], {"user_months": 0, "cost": 0.0, "max_cost": 0.0})
+        plan["user_months"] += 1
+        plan["cost"] += row["cost_sum"]
+        plan["max_cost"] = max(plan["max_cost"], row["cost_sum"])
+
+    rows = []
+    for plan_name, plan in sorted(totals.items()):
+        try:
+            price = PLAN_CONFIGS[UserPlan(plan_name)].price_usd
+        except (KeyError, ValueError):
+            price = 0.0
+        revenue = price * plan["user_months"]
+        average_cost = plan["cost"] / plan["user_months"]
+        margin = revenue - plan["cost"]
+        rows.append([
+            plan_name,
+            plan["user_months"],
+            f"${price:.2f}",
+            f"${average_cost:.4f}",
+            f"${plan['max_cost']:.4f}",
+            f"${margin:.2f}",
+            f"{margin / revenue:.1%}" if revenue else "-"
+        ])
+    print_table(["plan", "user_months", "price", "avg_cost", "max_cost", "margin", "margin_pct"], rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize logged usage and check plan margins")
+    parser.add_argument("--since", help="First day to include (YYYY-MM-DD)")
+    parser.add_argument("--until", help="Last day to include (YYYY-MM-DD)")
+    parser.add_argument("--by", default="plan,resource", help=f"Comma-separated grouping: {', '.join(GROUP_COLUMNS)}")
+    parser.add_argument("--export-dir", default=settings.usage_export_dir, help="Directory of daily Parquet rollups")
+    parser.add_argument("--events-db", default=settings.usage_events_db_path, help="SQLite event log for days not rolled up yet")
+    parser.add_argument("--no-live", action="store_true", help="Only read the Parquet rollups")
+    args = parser.parse_args()
+
+    group_by = [name.strip() for name in args.by.split(",") if name.strip()]
+    unknown = [name for name in group_by if name not in GROUP_COLUMNS]
+    if unknown:
+        parser.error(f"Unknown grouping: {', '.join(unknown)}")
+
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+    except ImportError:
+        logger.error("pyarrow is required: pip install pyarrow")
+        return 1
+
+    tables = [load_exported(pa, args)]
+    if not args.no_live:
+        tables.append(load_live(pa, args))
+    tables = [table for table in tables if table is not None and table.num_rows]
+    if not tables:
+        logger.info("No usage events in the selected range")
+        return 0
+
+    table = pa.concat_tables(tables)
+    table = table.append_column("month", pc.utf8_slice_codeunits(table["day"], 0, 7))
+    logger.info(f"Loaded {table.num_rows} usage events")
+
+    print()
+    usage_breakdown(table, group_by)
+    print()
+    plan_margins(table)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
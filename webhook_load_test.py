@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+import httpx
+
+logging.basicConfig(
+    format=r'%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+# One log line per request would dominate the measurement
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+def make_update(update_id: int, chat_count: int) -> dict:
+    """Minimal text-message update as Telegram sends it"""
+    chat_id = 100000 + update_id % chat_count
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "text": f"load test message {update_id}"
+        }
+    }
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+async def run(args) -> int:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    next_id = args.start_id
+    latencies = []
+    statuses = {}
+
+    async def sender(client: httpx.AsyncClient):
+        nonlocal next_id
+        while next_id < args.start_id + args.updates:
+            update_id = next_id
+            next_id += 1
+            # Replay an earlier update now and then, like Telegram does after a timeout
+            if args.duplicates and update_id > args.start_id and random.random() < args.duplicates:
+                update_id = random.randint(args.start_id, update_id - 1)
+
+            start = time.perf_counter()
+            response = await client.post(args.url, json=make_update(update_id, args.chats), headers=headers)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(sender(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    logger.info(f"Sent {len(latencies)} updates in {elapsed:.2f}s: {len(latencies) / elapsed:.0f} updates/sec")
+    logger.info(f"ACK latency p50={percentile(latencies, 0.5) * 1000:.1f}ms p99={percentile(latencies, 0.99) * 1000:.1f}ms max={max(latencies) * 1000:.1f}ms")
+    logger.info(f"Responses by status: {dict(sorted(statuses.items()))}")
+    return 0 if set(statuses) == {200} else 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Post synthetic Telegram updates to the webhook and measure sustained throughput")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/webhook")
+    parser.add_argument("--updates", type=int, default=20000, help="Number of updates to send")
+    parser.add_argument("--concurrency", type=int, default=64, help="Parallel connections")
+    parser.add_argument("--chats", type=int, default=1000, help="Distinct chats the updates come from")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="Fraction of redelivered update_ids")
+    parser.add_argument("--start-id", type=int, default=int(time.time()) * 1000, help="First update_id")
+    parser.add_argument("--secret", help="Webhook secret token")
+    return asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    sys.exit(main())